@@ -1,9 +1,32 @@
 from django.contrib import admin
-from .models import Course, Lecture, Question, Student, Submission, Profile
+from .models import Course, Lecture, Question, Student, Submission, Profile, LectureJob, LiveChunk, PipelineRun, PipelineStage
 
 admin.site.register(Course)
 admin.site.register(Lecture)
 admin.site.register(Question)
 admin.site.register(Student)
 admin.site.register(Submission)
-admin.site.register(Profile)
\ No newline at end of file
+admin.site.register(Profile)
+
+@admin.register(LectureJob)
+class LectureJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'lecture', 'kind', 'status', 'attempts', 'run_after', 'updated_at')
+    list_filter = ('status', 'kind')
+
+@admin.register(LiveChunk)
+class LiveChunkAdmin(admin.ModelAdmin):
+    list_display = ('id', 'lecture', 'session_id', 'seq', 'status', 'created_at', 'transcribed_at')
+    list_filter = ('status',)
+
+class PipelineStageInline(admin.TabularInline):
+    model = PipelineStage
+    extra = 0
+    readonly_fields = ('name', 'started_at', 'wall_seconds', 'api_calls', 'api_seconds', 'wait_seconds',
+                       'prompt_tokens', 'completion_tokens', 'retries', 'audio_seconds', 'cost_usd', 'failed')
+
+@admin.register(PipelineRun)
+class PipelineRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'lecture', 'kind', 'status', 'attempt', 'wall_seconds', 'prompt_tokens',
+                    'completion_tokens', 'retries', 'cost_usd', 'started_at')
+    list_filter = ('status', 'kind')
+    inlines = [PipelineStageInline]
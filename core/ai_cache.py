@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import caches
+
+from .ledger import record_chat_call
+from .rate_limit import acquire, estimate_chat_tokens, reconcile
+
+# 快取後端：sqlite（預設，跨 worker 共用）/ django（使用 Django CACHES）/ none（停用）
+AI_CACHE_BACKEND = os.getenv("AI_CACHE_BACKEND", "sqlite")
+# 預設放在暫存目錄：App Engine 等環境的程式目錄是唯讀的，只有 /tmp 可寫入
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", os.path.join(tempfile.gettempdir(), "ai_cache.sqlite3"))
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", 60 * 60 * 24 * 30))
+AI_CACHE_MAX_MB = float(os.getenv("AI_CACHE_MAX_MB", 200))
+AI_CACHE_DJANGO_ALIAS = os.getenv("AI_CACHE_DJANGO_ALIAS", "default")
+
+
+class NullCacheBackend:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+class DjangoCacheBackend:
+    """使用 Django 的 cache framework（需在 settings.CACHES 設定共用後端才會跨 worker）
+
+    key 前面帶上世代編號；clear() 只把編號加一讓舊項目失效（之後依 TTL 過期），不清掉同一個快取裡的其他資料。
+    """
+
+    GENERATION_KEY = "ai:generation"
+
+    def __init__(self, alias=AI_CACHE_DJANGO_ALIAS, ttl=AI_CACHE_TTL):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def key(self, key):
+        # 編號遺失時以目前時間重新起算，不會撞到之前已清除的世代
+        generation = self.cache.get_or_set(self.GENERATION_KEY, time.time_ns, None)
+        return f"ai:{generation}:{key}"
+
+    def get(self, key):
+        return self.cache.get(self.key(key))
+
+    def set(self, key, value):
+        self.cache.set(self.key(key), value, self.ttl)
+
+    def clear(self):
+        try:
+            self.cache.incr(self.GENERATION_KEY)
+        except ValueError:
+            self.cache.set(self.GENERATION_KEY, time.time_ns(), None)
+
+
+class SQLiteCacheBackend:
+    """本機 SQLite 快取，含 TTL 與依總大小的 LRU 淘汰"""
+
+    def __init__(self, path=AI_CACHE_PATH, ttl=AI_CACHE_TTL, max_bytes=int(AI_CACHE_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ai_cache_accessed ON ai_cache (accessed_at)")
+
+    @contextmanager
+    def connect(self):
+        # 每次操作開新連線，thread / fork 之間不共用 sqlite 連線
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        with self.connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM ai_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM ai_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE ai_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now),
+            )
+            self.evict(conn, now)
+
+    def evict(self, conn, now):
+        if self.ttl:
+            conn.execute("DELETE FROM ai_cache WHERE created_at < ?", (now - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ai_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 淘汰最久未使用的項目，直到總量降到上限的 90%
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM ai_cache ORDER BY accessed_at"):
+            stale.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM ai_cache WHERE key = ?", stale)
+
+    def clear(self):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM ai_cache")
+
+
+BACKENDS = {
+    "none": NullCacheBackend,
+    "django": DjangoCacheBackend,
+    "sqlite": SQLiteCacheBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_cache_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = BACKENDS.get(AI_CACHE_BACKEND, NullCacheBackend)()
+    return _backend
+
+
+def set_cache_backend(backend):
+    """替換快取後端（測試或自訂儲存用）"""
+    global _backend
+    _backend = backend
+
+
+def record(namespace, hit):
+    with _stats_lock:
+        counter = _stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counter["hits" if hit else "misses"] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        return {ns: dict(counter) for ns, counter in _stats.items()}
+
+
+def chat_cache_key(model, messages, temperature=None, max_tokens=None, response_format=None):
+    body = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+    if response_format is not None:
+        # 只有指定時才納入，沿用既有快取的 key 不變
+        body["response_format"] = response_format
+    payload = json.dumps(body, ensure_ascii=False, sort_keys=True)
+    return "chat:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_digest(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def audio_cache_key(path, model="whisper-1"):
+    return f"audio:{model}:{file_digest(path)}"
+
+
+def cached_chat_completion(client, model, messages, temperature=None, max_tokens=None, parse=None, **kwargs):
+    """呼叫 chat completion 並依 (model, messages, temperature, max_tokens) 快取回應文字
+
+    有給 parse 時回傳解析結果，且只有解析成功的回應才寫入快取。
+    """
+    backend = get_cache_backend()
+    key = chat_cache_key(model, messages, temperature, max_tokens, kwargs.get("response_format"))
+    cached = backend.get(key)
+    record("chat", cached is not None)
+    if cached is not None:
+        return parse(cached) if parse else cached
+
+    params = {"model": model, "messages": messages, **kwargs}
+    if temperature is not None:
+        params["temperature"] = temperature
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+    # 只有未命中快取、真的要打 API 時才佔用速率額度
+    estimated = estimate_chat_tokens(messages, max_tokens)
+    waited = acquire(model, estimated)
+    started = time.perf_counter()
+    try:
+        response = client.chat.completions.create(**params)
+    except Exception:
+        record_chat_call(model, time.perf_counter() - started, wait_seconds=waited)
+        raise
+    usage = getattr(response, "usage", None)
+    record_chat_call(model, time.perf_counter() - started, usage, waited)
+    if usage is not None:
+        reconcile(model, estimated, getattr(usage, "total_tokens", None))
+    content = response.choices[0].message.content or ""
+    result = parse(content) if parse else content
+    if content:
+        backend.set(key, content)
+    return result
+
+
+def cached_transcription(audio_path, transcribe, model="whisper-1"):
+    """依音檔內容雜湊快取轉錄結果，transcribe() 只在未命中時呼叫"""
+    backend = get_cache_backend()
+    key = audio_cache_key(audio_path, model)
+    cached = backend.get(key)
+    record("audio", cached is not None)
+    if cached is not None:
+        return cached
+    text = transcribe()
+    if text:
+        backend.set(key, text)
+    return text
@@ -1,61 +1,205 @@
 import os
 import re
 import json
+import time
+import tempfile
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
-from .models import Lecture, Question
+import importlib.util
+import threading
+from openai import DefaultHttpxClient, OpenAI, Timeout
+import hashlib
+from django.db import IntegrityError, transaction
+from .models import Lecture, LectureSummaryChunk, Question
+from .ai_cache import cached_chat_completion, cached_transcription
+from .audio_utils import load_audio, plan_audio_segments, stitch_transcripts
+from .audio_ingest import TEMP_PREFIX
+from .chunking import token_chunks
+from .ledger import count_http_request, pipeline_stage, propagate, record_retry, record_transcription
+from .rate_limit import acquire
 
 load_dotenv()
 
+# 段落摘要同時送出的請求數與單次呼叫逾時（秒）
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", 4))
+SUMMARY_CALL_TIMEOUT = float(os.getenv("SUMMARY_CALL_TIMEOUT", 60))
+# 段落摘要寫入時與其他 worker 撞到同一段，最多重新讀取幾輪
+PARTIAL_SUMMARY_RACE_ROUNDS = int(os.getenv("PARTIAL_SUMMARY_RACE_ROUNDS", 3))
 
-def create_openai_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    api_base = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
-    if not api_key or api_key.strip().upper() == "EMPTY":
-        raise ValueError("❌ 請設定 OPENAI_API_KEY")
-    return OpenAI(api_key=api_key, base_url=api_base)
+# OpenAI 連線：逾時（秒）、重試次數、HTTP/2（auto：有安裝 h2 就啟用）
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 120))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 10))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 4))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "auto").lower()
+
+# 出題模型（需支援 Structured Outputs）
+QUIZ_MODEL = os.getenv("QUIZ_MODEL", "gpt-4o")
+
+# 轉錄後端：api（OpenAI Whisper API）/ local（本機 Whisper 模型，見 local_whisper.py）
+TRANSCRIBE_BACKEND = os.getenv("TRANSCRIBE_BACKEND", "api")
+
+# 語音轉錄模式：auto（大檔自動分段）/ single / segmented
+TRANSCRIBE_MODE = os.getenv("TRANSCRIBE_MODE", "auto")
+TRANSCRIBE_SEGMENT_ABOVE_MB = float(os.getenv("TRANSCRIBE_SEGMENT_ABOVE_MB", 10))
+TRANSCRIBE_SEGMENT_SECONDS = int(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", 600))
+TRANSCRIBE_OVERLAP_SECONDS = float(os.getenv("TRANSCRIBE_OVERLAP_SECONDS", 2))
+TRANSCRIBE_MAX_CONCURRENCY = int(os.getenv("TRANSCRIBE_MAX_CONCURRENCY", 4))
 
 
-def transcribe_with_whisper(audio_path):
+def use_http2():
+    if OPENAI_HTTP2 == "auto":
+        return importlib.util.find_spec("h2") is not None
+    return OPENAI_HTTP2 in ("1", "true", "yes")
+
+
+def create_openai_client(api_key=None, api_base=None):
+    """建立新的 client（含自己的連線池）；一般請改用 get_openai_client() 共用"""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    api_base = api_base or os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+    if not api_key or api_key.strip().upper() == "EMPTY":
+        raise ValueError("❌ 請設定 OPENAI_API_KEY")
+    timeout = Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    return OpenAI(
+        api_key=api_key,
+        base_url=api_base,
+        # SDK 內建的重試：429 / 5xx / 連線錯誤時以含 jitter 的指數退避重送，並遵守 Retry-After
+        max_retries=OPENAI_MAX_RETRIES,
+        timeout=timeout,
+        http_client=DefaultHttpxClient(
+            http2=use_http2(), timeout=timeout,
+            # 每次實際送出（含自動重送）都計入目前流程階段的重試統計
+            event_hooks={"request": [count_http_request]},
+        ),
+    )
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+
+
+def reset_openai_clients():
+    """fork 之後子 process 不可沿用父 process 的連線，丟掉重建（不 close，連線仍屬於父 process）"""
+    global _clients, _clients_lock, _clients_pid
+    _clients = {}
+    _clients_lock = threading.Lock()
+    _clients_pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_openai_clients)
+
+
+def get_openai_client():
+    """同一個 process 內共用 client 與其 keep-alive 連線池（依 API key / base URL 區分）"""
+    if os.getpid() != _clients_pid:
+        reset_openai_clients()
+    api_key = os.getenv("OPENAI_API_KEY")
+    api_base = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+    key = (api_key, api_base)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = create_openai_client(api_key, api_base)
+    return client
+
+
+def whisper_api_transcribe(client, audio_path):
+    waited = acquire("whisper-1")
+    started = time.perf_counter()
+    with open(audio_path, "rb") as f:
+        # verbose_json 會附上音檔長度，用來估算轉錄成本
+        response = client.audio.transcriptions.create(
+            model="whisper-1",
+            file=f,
+            response_format="verbose_json",
+        )
+    record_transcription(time.perf_counter() - started, getattr(response, "duration", 0) or 0, waited)
+    return response.text
+
+
+def should_segment(audio_path):
+    if TRANSCRIBE_MODE == "segmented":
+        return True
+    if TRANSCRIBE_MODE == "single":
+        return False
+    return os.path.getsize(audio_path) > TRANSCRIBE_SEGMENT_ABOVE_MB * 1024 * 1024
+
+
+def transcribe_segmented(audio_path, client=None, segment_seconds=None, overlap_seconds=None, max_workers=None):
+    """依靜音切段後併發轉錄，回傳 {"text": 完整逐字稿, "segments": [各段起訖秒數與文字]}"""
+    client = client or get_openai_client()
+    segment_seconds = segment_seconds or TRANSCRIBE_SEGMENT_SECONDS
+    overlap_seconds = TRANSCRIBE_OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds
+    max_workers = max_workers or TRANSCRIBE_MAX_CONCURRENCY
+
+    audio = load_audio(audio_path)
+    plan = plan_audio_segments(audio, int(segment_seconds * 1000), int(overlap_seconds * 1000))
+    print(f"✂️ 音檔長度 {len(audio) / 1000:.0f}s，切成 {len(plan)} 段併發轉錄")
+
+    with tempfile.TemporaryDirectory(prefix=TEMP_PREFIX) as tmpdir:
+        paths = []
+        for i, (start, end) in enumerate(plan):
+            path = os.path.join(tmpdir, f"segment_{i:03d}.mp3")
+            audio.export_segment(start, end, path, bitrate="64k")
+            paths.append(path)
+
+        def run(index):
+            started = time.perf_counter()
+            text = whisper_api_transcribe(client, paths[index])
+            start, end = plan[index]
+            return {
+                "index": index,
+                "start": start / 1000,
+                "end": end / 1000,
+                "text": text,
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(plan)))) as pool:
+            segments = list(pool.map(propagate(run), range(len(plan))))
+
+    return {
+        "text": stitch_transcripts([seg["text"] for seg in segments]),
+        "segments": segments,
+    }
+
+
+def transcribe_with_whisper(audio_path, segmented=None, backend=None):
     try:
         if not os.path.exists(audio_path):
             print(f"❌ 找不到音訊檔案：{audio_path}")
             return None
-        print("✅ Whisper API 轉錄開始")
-        client = create_openai_client()
-        with open(audio_path, "rb") as f:
-            response = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=f
+        if (backend or TRANSCRIBE_BACKEND) == "local":
+            from .local_whisper import LOCAL_WHISPER_MODEL, transcribe_local
+            print("✅ 本機 Whisper 轉錄開始")
+            return cached_transcription(
+                audio_path, lambda: transcribe_local(audio_path)["text"], model=f"local-{LOCAL_WHISPER_MODEL}"
             )
-        return response.text
+        print("✅ Whisper API 轉錄開始")
+        client = get_openai_client()
+        if segmented is None:
+            segmented = should_segment(audio_path)
+        if segmented:
+            return cached_transcription(audio_path, lambda: transcribe_segmented(audio_path, client)["text"])
+        return cached_transcription(audio_path, lambda: whisper_api_transcribe(client, audio_path))
     except Exception as e:
         print(f"❌ Whisper API 轉錄錯誤: {e}")
         return None
 
 
-def dynamic_split(text, min_length=300, max_length=1000):
-    text = text.strip()
-    if len(text) <= max_length:
-        return [text]
-    paragraphs = re.split(r'(?<=[。！？])\s*', text)
-    chunks, temp = [], ""
-    for para in paragraphs:
-        if len(temp) + len(para) <= max_length:
-            temp += para
-        else:
-            if len(temp) >= min_length:
-                chunks.append(temp.strip())
-                temp = para
-            else:
-                temp += para
-    if temp:
-        chunks.append(temp.strip())
-    return chunks
+def dynamic_split(text, max_tokens=None, overlap_tokens=None):
+    """依 token 預算切段（見 chunking.token_chunks），每段前面附上一小段重疊的上下文"""
+    return [
+        text[context:end].strip()
+        for _, end, context in token_chunks(text, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    ]
 
 
-def generate_summary_for_chunk(client, chunk, chunk_index, total_chunks):
+def generate_summary_for_chunk(client, chunk, chunk_index, total_chunks, timeout=None):
     prompt = [
         {"role": "system", "content": f"""你是一位專業的繁體中文課程摘要設計師。
 請針對第 {chunk_index + 1} 段課程內容進行重點摘要，包含：
@@ -65,18 +209,46 @@ def generate_summary_for_chunk(client, chunk, chunk_index, total_chunks):
         {"role": "user", "content": chunk}
     ]
     try:
-        response = client.chat.completions.create(
+        content = cached_chat_completion(
+            client,
             model="gpt-4o",
             messages=prompt,
             temperature=0.3,
-            max_tokens=400
+            max_tokens=400,
+            timeout=timeout or SUMMARY_CALL_TIMEOUT
         )
-        return response.choices[0].message.content.strip()
+        return content.strip()
     except Exception as e:
         print(f"❌ 段落摘要錯誤: {e}")
         return f"第 {chunk_index + 1} 段摘要失敗"
 
 
+def summarize_chunks(client, chunks, max_workers=None, timeout=None):
+    """以有限併發同時摘要各段落，結果依原段落順序回傳，並附上每段耗時"""
+    max_workers = max(1, min(max_workers or SUMMARY_MAX_CONCURRENCY, len(chunks) or 1))
+    total = len(chunks)
+
+    def run(index, chunk):
+        started = time.perf_counter()
+        summary = generate_summary_for_chunk(client, chunk, index, total, timeout=timeout)
+        return summary, {
+            "index": index,
+            "chars": len(chunk),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(propagate(run), range(total), chunks))
+    summaries = [summary for summary, _ in results]
+    timings = [timing for _, timing in results]
+
+    for t in timings:
+        print(f"⏱ 段落 {t['index'] + 1}/{total}：{t['chars']} 字，{t['seconds']}s")
+    print(f"⏱ 段落摘要共 {total} 段，併發 {max_workers}，總耗時 {time.perf_counter() - started:.2f}s")
+    return summaries, timings
+
+
 def combine_summaries(client, summaries):
     combined = "\n\n".join([f"段落 {i+1}：{s}" for i, s in enumerate(summaries)])
     prompt = [
@@ -90,22 +262,24 @@ def combine_summaries(client, summaries):
         {"role": "user", "content": combined}
     ]
     try:
-        response = client.chat.completions.create(
+        content = cached_chat_completion(
+            client,
             model="gpt-4o",
             messages=prompt,
             temperature=0.3,
             max_tokens=512
         )
-        return response.choices[0].message.content.strip()
+        return content.strip()
     except Exception as e:
         print(f"❌ 總結錯誤: {e}")
         return "整合摘要失敗"
 
 
 # 🆕 改善版 generate_quiz 加入自動重試與解析處理
-def safe_json_parse(raw: str):
+def safe_json_parse(raw: str, normalize=None):
+    normalize = normalize or normalize_mcq_payload
     try:
-        return normalize_mcq_payload(json.loads(raw))
+        return normalize(json.loads(raw))
     except Exception:
         pass
 
@@ -117,20 +291,23 @@ def safe_json_parse(raw: str):
         candidate = candidate.replace("“", '"').replace("”", '"').replace("’", "'")
         candidate = re.sub(r",\s*([\]}])", r"\1", candidate)
         try:
-            return normalize_mcq_payload(json.loads(candidate))
+            return normalize(json.loads(candidate))
         except Exception as e:
             print("❌ JSON 區塊解析仍失敗：", e)
-    print("⚠️ MCQ 原始回應（截斷 500 字）：", raw[:500])
+    print("⚠️ 出題原始回應（截斷 500 字）：", raw[:500])
     raise ValueError("模型未回傳合法 JSON")
 
 
-def normalize_mcq_payload(data):
+def payload_items(data):
     if isinstance(data, dict) and "items" in data and isinstance(data["items"], list):
-        items = data["items"]
-    elif isinstance(data, list):
-        items = data
-    else:
-        raise ValueError("JSON 結構不符合預期")
+        return data["items"]
+    if isinstance(data, list):
+        return data
+    raise ValueError("JSON 結構不符合預期")
+
+
+def normalize_mcq_payload(data):
+    items = payload_items(data)
 
     cleaned = []
     for it in items:
@@ -161,73 +338,125 @@ def normalize_mcq_payload(data):
     return cleaned
 
 
-def generate_quiz_with_retry(client, summary, count=3, retries=1):
-    system = f"""你是一位課程出題 AI，請根據以下課程摘要產生 {count} 題選擇題。
-嚴格且只輸出 JSON「陣列」，不要任何說明、不要加 ```json。每一題物件必須包含：
-concept, question, options(A/B/C/D), answer(只能是 A/B/C/D), explanation。"""
-    messages = [
-        {"role": "system", "content": system},
-        {"role": "user", "content": summary}
-    ]
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.2,
-            max_tokens=1500
-        )
-        raw = response.choices[0].message.content or ""
-        return safe_json_parse(raw)
-    except Exception as e:
-        print("🔁 第一次解析失敗，改用更嚴格提示重試：", e)
+TF_ANSWERS = {
+    "true": "True", "t": "True", "o": "True", "是": "True", "對": "True", "正確": "True",
+    "false": "False", "f": "False", "x": "False", "否": "False", "錯": "False", "錯誤": "False",
+}
 
-    hard_prompt = summary + f"\n\n請嚴格輸出 {count} 題選擇題，只輸出 JSON 陣列，格式嚴謹。不要有任何說明、```json、前後文字。"
-    try:
-        messages = [
-            {"role": "system", "content": "你只會輸出 JSON。"},
-            {"role": "user", "content": hard_prompt}
-        ]
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.1,
-            max_tokens=1500
-        )
-        raw = response.choices[0].message.content or ""
-        return safe_json_parse(raw)
-    except Exception as e:
-        print("❌ 重試仍失敗：", e)
-        return []
 
+def normalize_tf_payload(data):
+    """是非題的答案統一成 quiz.html 使用的 "True" / "False"，不合格的題目略過"""
+    items = payload_items(data)
 
-def generate_tf_questions(client, summary, count):
-    prompt = [
-        {
-            "role": "system",
-            "content": f"""請根據以下課程摘要，設計 {count} 題是非題（True/False），格式如下：
-[
-  {{
-    "concept": "學習概念",
-    "question": "問題內容",
-    "answer": "True",
-    "explanation": "正確答案解析"
-  }},
-  ...
-]
-請回傳 JSON 格式資料，不要有其他文字說明。"""
+    cleaned = []
+    for it in items:
+        try:
+            answer = it["answer"]
+            answer = ("True" if answer else "False") if isinstance(answer, bool) else TF_ANSWERS.get(str(answer).strip().lower())
+            question = it["question"].strip()
+            if not answer or not question:
+                continue
+            cleaned.append({
+                "concept": it["concept"].strip(),
+                "question": question,
+                "answer": answer,
+                "explanation": it.get("explanation", "").strip(),
+            })
+        except Exception:
+            continue
+    return cleaned
+
+
+def normalize_quiz_payload(data):
+    if not isinstance(data, dict):
+        raise ValueError("JSON 結構不符合預期")
+    return {
+        "mcq": normalize_mcq_payload(data.get("mcq") or []),
+        "tf": normalize_tf_payload(data.get("tf") or []),
+    }
+
+
+def parse_quiz_payload(raw):
+    return safe_json_parse(raw, normalize=normalize_quiz_payload)
+
+
+def quiz_response_format():
+    """Structured Outputs 的 JSON schema：選擇題與是非題一次產生"""
+    def item(properties):
+        return {
+            "type": "object",
+            "properties": {
+                "concept": {"type": "string"},
+                "question": {"type": "string"},
+                **properties,
+                "explanation": {"type": "string"},
+            },
+            "required": ["concept", "question", *properties, "explanation"],
+            "additionalProperties": False,
+        }
+
+    options = {
+        "type": "object",
+        "properties": {k: {"type": "string"} for k in "ABCD"},
+        "required": list("ABCD"),
+        "additionalProperties": False,
+    }
+    schema = {
+        "type": "object",
+        "properties": {
+            "mcq": {"type": "array", "items": item({"options": options, "answer": {"type": "string", "enum": list("ABCD")}})},
+            "tf": {"type": "array", "items": item({"answer": {"type": "string", "enum": ["True", "False"]}})},
         },
-        {"role": "user", "content": summary}
+        "required": ["mcq", "tf"],
+        "additionalProperties": False,
+    }
+    return {"type": "json_schema", "json_schema": {"name": "quiz", "strict": True, "schema": schema}}
+
+
+def quiz_messages(summary, num_mcq, num_tf, existing=()):
+    system = f"""你是一位課程出題 AI，請根據課程摘要出題：
+- 選擇題（mcq）{num_mcq} 題：concept, question, options(A/B/C/D), answer(只能是 A/B/C/D), explanation
+- 是非題（tf）{num_tf} 題：concept, question, answer(只能是 "True" 或 "False"), explanation
+concept 請填該題考的學習概念（簡短名詞），沒有要求的題型回傳空陣列。只輸出 JSON。"""
+    if existing:
+        system += "\n以下題目已經出過，請不要重複：\n" + "\n".join(f"- {q}" for q in existing)
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": summary},
     ]
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=prompt,
-            temperature=0.5
-        )
-        return json.loads(response.choices[0].message.content)
-    except Exception as e:
-        print(f"❌ 是非題產生失敗：{e}")
-        return []
+
+
+def generate_quiz(client, summary, num_mcq=3, num_tf=0, retries=1):
+    """一次呼叫同時產生選擇題與是非題；數量不足時只針對缺少的部分重試"""
+    quiz = {"mcq": [], "tf": []}
+    for attempt in range(retries + 1):
+        missing_mcq = num_mcq - len(quiz["mcq"])
+        missing_tf = num_tf - len(quiz["tf"])
+        if missing_mcq <= 0 and missing_tf <= 0:
+            break
+        if attempt:
+            record_retry()
+            print(f"🔁 補出缺少的題目：選擇題 {max(missing_mcq, 0)}、是非題 {max(missing_tf, 0)}")
+        existing = [q["question"] for q in quiz["mcq"] + quiz["tf"]]
+        try:
+            data = cached_chat_completion(
+                client,
+                model=QUIZ_MODEL,
+                messages=quiz_messages(summary, max(missing_mcq, 0), max(missing_tf, 0), existing),
+                temperature=0.2 if attempt == 0 else 0.1,
+                max_tokens=300 + 350 * max(missing_mcq, 0) + 150 * max(missing_tf, 0),
+                parse=parse_quiz_payload,
+                response_format=quiz_response_format(),
+            )
+        except Exception as e:
+            print(f"❌ 第 {attempt + 1} 次出題失敗：", e)
+            continue
+        seen = set(existing)
+        for kind, missing in (("mcq", missing_mcq), ("tf", missing_tf)):
+            fresh = [q for q in data[kind] if q["question"] not in seen]
+            quiz[kind].extend(fresh[:max(missing, 0)])
+            seen.update(q["question"] for q in fresh)
+    return quiz
 
 
 def parse_and_store_questions(summary, quiz_data, lecture, question_type):
@@ -235,6 +464,7 @@ def parse_and_store_questions(summary, quiz_data, lecture, question_type):
         question_text = item.get('question', '').strip()
         explanation = item.get('explanation', '').strip()
         answer = item.get('answer', '').strip()
+        concept = item.get('concept', '').strip()[:100] or '未分類'
 
         if question_type == 'mcq':
             options = item.get('options', {})
@@ -247,6 +477,7 @@ def parse_and_store_questions(summary, quiz_data, lecture, question_type):
                 option_d=options.get('D'),
                 correct_answer=answer,
                 explanation=explanation,
+                concept=concept,
                 question_type='mcq'
             )
         elif question_type == 'tf':
@@ -255,110 +486,125 @@ def parse_and_store_questions(summary, quiz_data, lecture, question_type):
                 question_text=item.get('question', '').strip(),
                 correct_answer=item.get('answer'),
                 explanation=item.get('explanation', '').strip(),
+                concept=concept,
                 question_type='tf'
             )
         else:
             print(f"⚠️ 未知題型：{question_type}")
 
 
-def process_audio_and_generate_quiz(lecture_id, num_mcq=3, num_tf=0):
-    lecture = Lecture.objects.get(id=lecture_id)
-    client = create_openai_client()
+def chunk_digest(text):
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
 
-    print("🎧 開始語音轉錄")
-    transcript = transcribe_with_whisper(lecture.audio_file.path)
-    if not transcript:
-        return
-    lecture.transcript = transcript
-    lecture.save()
 
-    print("📝 開始摘要處理")
-    chunks = dynamic_split(transcript)
-    summaries = [generate_summary_for_chunk(client, c, i, len(chunks)) for i, c in enumerate(chunks)]
+def valid_partial_summaries(lecture, transcript):
+    """取出仍與目前逐字稿相符、且首尾相接的段落摘要，回傳 (摘要清單, 已涵蓋到的位置)"""
+    partials, covered = [], 0
+    for p in LectureSummaryChunk.objects.filter(lecture=lecture).order_by('index'):
+        if p.start_offset != covered or chunk_digest(transcript[p.start_offset:p.end_offset]) != p.digest:
+            break
+        partials.append(p)
+        covered = p.end_offset
+    return partials, covered
 
-    final_summary = combine_summaries(client, summaries)
-    lecture.summary = final_summary
-    lecture.save()
-
-    print("🧠 開始產生考題")
 
-    if num_mcq > 0:
-        mcq_data = generate_quiz_with_retry(client, final_summary, num_mcq)
-        if mcq_data:
-            parse_and_store_questions(final_summary, mcq_data, lecture, 'mcq')
-        else:
-            print("⚠️ 沒有回傳 MCQ 題目")
+def summarize_ready_chunks(lecture, client=None, final=False, transcript=None):
+    """直播時逐段摘要：只處理已完整的段落（final=True 時連最後一段一起處理）"""
+    transcript = (lecture.transcript if transcript is None else transcript) or ""
+    for _ in range(PARTIAL_SUMMARY_RACE_ROUNDS):
+        partials, covered = valid_partial_summaries(lecture, transcript)
+        # 逐字稿被改寫過時，之後的段落摘要已失效
+        LectureSummaryChunk.objects.filter(lecture=lecture, index__gte=len(partials)).delete()
 
-    if num_tf > 0:
-        tf_data = generate_tf_questions(client, final_summary, num_tf)
-        if tf_data:
-            parse_and_store_questions(final_summary, tf_data, lecture, 'tf')
-        else:
-            print("⚠️ 沒有回傳 TF 題目")
+        spans = token_chunks(transcript, start=covered)
+        if not final:
+            spans = spans[:-1]  # 最後一段可能還在增長
+        if not spans:
+            return partials
 
+        client = client or get_openai_client()
+        # 送給模型的內容含前一段結尾的重疊上下文；digest 只算本段，用來檢查逐字稿是否被改寫
+        chunks = [transcript[context:e].strip() for s, e, context in spans]
+        summaries, _ = summarize_chunks(client, chunks)
+        try:
+            for (s, e, _), summary in zip(spans, summaries):
+                with transaction.atomic():
+                    partials.append(LectureSummaryChunk.objects.create(
+                        lecture=lecture,
+                        index=len(partials),
+                        start_offset=s,
+                        end_offset=e,
+                        digest=chunk_digest(transcript[s:e]),
+                        summary=summary,
+                    ))
+        except IntegrityError:
+            # 另一個 worker 已經寫入同一段：重新讀取已存的段落，從它們涵蓋到的位置繼續
+            # （已送出過的段落內容相同，再摘要時會命中快取）
+            continue
+        print(f"🧩 已完成 {len(partials)} 段直播摘要（涵蓋 {partials[-1].end_offset}/{len(transcript)} 字）")
+        return partials
+    # 一直與其他 worker 互相覆寫：交給工作佇列重試，不回傳缺了結尾的摘要
+    raise RuntimeError(f"講次 {lecture.id} 的段落摘要與其他 worker 衝突 {PARTIAL_SUMMARY_RACE_ROUNDS} 次")
 
-def process_transcript_and_generate_quiz(lecture, client=None, num_mcq=3, num_tf=0):
-    if not client:
-        client = create_openai_client()
 
-    transcript = lecture.transcript
-    if not transcript:
-        print("❌ 無轉錄內容，無法生成摘要與題目")
-        return
+def summarize_and_generate_quiz(client, lecture, transcript, num_mcq=3, num_tf=0, on_stage=None, incremental=False):
+    """摘要 + 出題的共用流程，on_stage(stage) 用於回報目前處理階段
 
+    incremental=True 時沿用直播期間已完成的段落摘要，只補摘要剩下的段落。
+    """
+    if on_stage:
+        on_stage('summarizing')
     print("📝 開始摘要處理")
-    chunks = dynamic_split(transcript)
-    summaries = [generate_summary_for_chunk(client, c, i, len(chunks)) for i, c in enumerate(chunks)]
-
-    final_summary = combine_summaries(client, summaries)
+    with pipeline_stage('chunk_summaries'):
+        if incremental:
+            summaries = [p.summary for p in summarize_ready_chunks(lecture, client, final=True)]
+        else:
+            chunks = dynamic_split(transcript)
+            summaries, _ = summarize_chunks(client, chunks)
+    with pipeline_stage('combine_summaries'):
+        final_summary = combine_summaries(client, summaries)
     lecture.summary = final_summary
     lecture.save()
 
+    if on_stage:
+        on_stage('generating')
     print("🧠 開始產生考題")
 
-    if num_mcq > 0:
-        mcq_data = generate_quiz_with_retry(client, final_summary, num_mcq)
-        if mcq_data:
-            parse_and_store_questions(final_summary, mcq_data, lecture, 'mcq')
-        else:
-            print("⚠️ 沒有回傳 MCQ 題目")
+    if num_mcq > 0 or num_tf > 0:
+        with pipeline_stage('generate_quiz'):
+            quiz = generate_quiz(client, final_summary, num_mcq, num_tf)
+        for question_type, count in (('mcq', num_mcq), ('tf', num_tf)):
+            if quiz[question_type]:
+                parse_and_store_questions(final_summary, quiz[question_type], lecture, question_type)
+            elif count > 0:
+                print(f"⚠️ 沒有回傳 {question_type.upper()} 題目")
+    return True
 
-    if num_tf > 0:
-        tf_data = generate_tf_questions(client, final_summary, num_tf)
-        if tf_data:
-            parse_and_store_questions(final_summary, tf_data, lecture, 'tf')
-        else:
-            print("⚠️ 沒有回傳 TF 題目")
 
-def process_transcript_and_generate_quiz(lecture, client=None, num_mcq=3, num_tf=0):
-    if not client:
-        client = create_openai_client()
+def process_audio_and_generate_quiz(lecture_id, num_mcq=3, num_tf=0, on_stage=None):
+    lecture = Lecture.objects.get(id=lecture_id)
+    client = get_openai_client()
 
-    transcript = lecture.transcript
+    if on_stage:
+        on_stage('transcribing')
+    print("🎧 開始語音轉錄")
+    with pipeline_stage('transcribe'):
+        transcript = transcribe_with_whisper(lecture.audio_file.path)
     if not transcript:
-        print("❌ 無轉錄內容，無法生成摘要與題目")
-        return
+        return False
+    lecture.transcript = transcript
+    lecture.save()
 
-    print("📝 開始摘要處理")
-    chunks = dynamic_split(transcript)
-    summaries = [generate_summary_for_chunk(client, c, i, len(chunks)) for i, c in enumerate(chunks)]
+    return summarize_and_generate_quiz(client, lecture, transcript, num_mcq, num_tf, on_stage)
 
-    final_summary = combine_summaries(client, summaries)
-    lecture.summary = final_summary
-    lecture.save()
 
-    print("🧠 開始產生考題")
+def process_transcript_and_generate_quiz(lecture, client=None, num_mcq=3, num_tf=0, on_stage=None):
+    if not client:
+        client = get_openai_client()
 
-    if num_mcq > 0:
-        mcq_data = generate_quiz(client, final_summary, num_mcq)
-        if mcq_data:
-            parse_and_store_questions(final_summary, mcq_data, lecture, 'mcq')
-        else:
-            print("⚠️ 沒有回傳 MCQ 題目")
+    transcript = lecture.transcript
+    if not transcript:
+        print("❌ 無轉錄內容，無法生成摘要與題目")
+        return False
 
-    if num_tf > 0:
-        tf_data = generate_tf_questions(client, final_summary, num_tf)
-        if tf_data:
-            parse_and_store_questions(final_summary, tf_data, lecture, 'tf')
-        else:
-            print("⚠️ 沒有回傳 TF 題目")
\ No newline at end of file
+    return summarize_and_generate_quiz(client, lecture, transcript, num_mcq, num_tf, on_stage, incremental=True)
@@ -0,0 +1,92 @@
+import os
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncWeek
+
+from .models import StudentLectureStats, Submission
+
+CONCEPT_CACHE_TTL = int(os.getenv('CONCEPT_CACHE_TTL', 60 * 60))
+
+
+def mastery_rows(grouped):
+    """把 GROUP BY 結果轉成含錯誤率 / 掌握度的列，依錯誤率高到低排序"""
+    rows = []
+    for row in grouped:
+        total, wrong = row['total'], row['wrong']
+        error_rate = round(wrong / total * 100, 2) if total else 0
+        rows.append({
+            'concept': row['question__concept'],
+            'total': total,
+            'wrong': wrong,
+            'error_rate': error_rate,
+            'mastery': round(100 - error_rate, 2),
+            'students': row.get('students'),
+        })
+    rows.sort(key=lambda r: (-r['error_rate'], -r['wrong'], r['concept']))
+    return rows
+
+
+def weekly_trend(submissions):
+    """各概念每週錯誤率：{概念: [{'week': 'YYYY-MM-DD', 'error_rate': x}, ...]}"""
+    trend = {}
+    grouped = (
+        submissions.annotate(week=TruncWeek('submitted_at'))
+        .values('question__concept', 'week')
+        .annotate(total=Count('id'), wrong=Count('id', filter=Q(is_correct=False)))
+        .order_by('question__concept', 'week')
+    )
+    for row in grouped:
+        trend.setdefault(row['question__concept'], []).append({
+            'week': row['week'].date().isoformat() if row['week'] else '',
+            'error_rate': round(row['wrong'] / row['total'] * 100, 2) if row['total'] else 0,
+        })
+    return trend
+
+
+def compute_concept_report(submissions, with_students=False):
+    aggregates = {'total': Count('id'), 'wrong': Count('id', filter=Q(is_correct=False))}
+    if with_students:
+        aggregates['students'] = Count('student', distinct=True)
+    grouped = submissions.values('question__concept').annotate(**aggregates).order_by()
+    return {
+        'concepts': mastery_rows(grouped),
+        'trend': weekly_trend(submissions),
+    }
+
+
+def fingerprint(stats):
+    """以統計表的總題數與最後作答時間當快取版本，有新作答就自動失效（跨 worker 也成立）"""
+    agg = stats.aggregate(total=Sum('total'), last=Max('last_submitted_at'))
+    last = agg['last'].timestamp() if agg['last'] else 0
+    return f"{agg['total'] or 0}:{last}"
+
+
+def cached_report(key, stats, compute):
+    key = f"{key}:{fingerprint(stats)}"
+    report = cache.get(key)
+    if report is None:
+        report = compute()
+        cache.set(key, report, CONCEPT_CACHE_TTL)
+    return report
+
+
+def student_concept_report(student):
+    """學生各概念的錯誤率、掌握度與每週趨勢"""
+    return cached_report(
+        f"concepts:student:{student.id}",
+        StudentLectureStats.objects.filter(student=student),
+        lambda: compute_concept_report(Submission.objects.filter(student=student)),
+    )
+
+
+def course_concept_report(course):
+    """全班在某課程各概念的錯誤率（含作答人數）與每週趨勢"""
+    return cached_report(
+        f"concepts:course:{course.id}",
+        StudentLectureStats.objects.filter(lecture__course=course),
+        lambda: compute_concept_report(
+            Submission.objects.filter(question__lecture__course=course), with_students=True
+        ),
+    )
+
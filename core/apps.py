@@ -6,4 +6,5 @@ class CoreConfig(AppConfig):
 
     def ready(self):
         import core.signals  # 👈 啟用 signals
+        import core.metrics  # 在資料庫連線建立時掛上 SQL 計數
 
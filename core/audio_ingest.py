@@ -0,0 +1,132 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from django.core.files import File
+
+AUDIO_STORAGE_FORMAT = os.getenv("AUDIO_STORAGE_FORMAT", "opus")  # opus / flac
+AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", 16000))
+AUDIO_OPUS_BITRATE = os.getenv("AUDIO_OPUS_BITRATE", "24k")
+AUDIO_SPOOL_MAX_MB = int(os.getenv("AUDIO_SPOOL_MAX_MB", 32))
+AUDIO_TEMP_MAX_AGE_SECONDS = int(os.getenv("AUDIO_TEMP_MAX_AGE_SECONDS", 6 * 60 * 60))
+
+# 所有暫存音檔都用這個前綴，方便清掃遺留檔案
+TEMP_PREFIX = "lecture-audio-"
+
+# 16 kHz 單聲道語音：Opus 24 kbps 約為同長度 WAV 的 1/20，FLAC 無損約 1/2~1/3
+CODECS = {
+    "opus": {"ext": "ogg", "args": ["-c:a", "libopus", "-b:a", AUDIO_OPUS_BITRATE, "-application", "voip", "-f", "ogg"]},
+    "flac": {"ext": "flac", "args": ["-c:a", "flac", "-f", "flac"]},
+}
+
+
+class AudioConversionError(Exception):
+    pass
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+
+def transcode_for_speech(upload, fmt=None):
+    """把上傳的音檔經由 ffmpeg 管線轉成 16 kHz 單聲道語音格式，全程不落地成 WAV
+
+    upload 需提供 chunks()（Django UploadedFile）。回傳 (副檔名, SpooledTemporaryFile)。
+    """
+    codec = CODECS[fmt or AUDIO_STORAGE_FORMAT]
+    if not ffmpeg_available():
+        raise AudioConversionError("找不到 ffmpeg")
+
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+        "-vn", "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE), *codec["args"], "pipe:1",
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed():
+        # 另開執行緒寫入 stdin，避免 stdout 緩衝區滿時互相等待
+        try:
+            for chunk in upload.chunks():
+                proc.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            proc.stdin.close()
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    output = tempfile.SpooledTemporaryFile(max_size=AUDIO_SPOOL_MAX_MB * 1024 * 1024, prefix=TEMP_PREFIX)
+    try:
+        shutil.copyfileobj(proc.stdout, output)
+        writer.join()
+        stderr = proc.stderr.read().decode(errors="ignore")
+        if proc.wait() != 0 or output.tell() == 0:
+            raise AudioConversionError(stderr.strip() or f"ffmpeg exit {proc.returncode}")
+    except Exception:
+        proc.kill()
+        output.close()
+        raise
+    finally:
+        proc.stdout.close()
+        proc.stderr.close()
+    output.seek(0)
+    return codec["ext"], output
+
+
+def ingest_audio(upload, basename):
+    """轉成壓縮語音格式，回傳可直接存進 FileField 的 File（用完以 with 關閉）；無法轉檔時保留原始檔"""
+    try:
+        ext, converted = transcode_for_speech(upload)
+    except AudioConversionError as e:
+        print("⚠️ 音檔轉檔失敗，保留原始格式：", e)
+        upload.seek(0)
+        original_ext = os.path.splitext(upload.name or "")[1] or ".webm"
+        return File(upload, name=f"{basename}{original_ext}")
+    converted.seek(0, os.SEEK_END)
+    print(f"🎧 音檔轉為 {ext}：{upload.size} → {converted.tell()} bytes")
+    converted.seek(0)
+    return File(converted, name=f"{basename}.{ext}")
+
+
+def save_upload_to_tempfile(upload, suffix=".webm"):
+    """存成暫存檔供 Whisper 讀取；呼叫端負責以 discard() 刪除"""
+    # ✅ 注意：Windows 下不要 delete=True，Whisper會讀不到檔案
+    with tempfile.NamedTemporaryFile(prefix=TEMP_PREFIX, suffix=suffix, delete=False) as tmp:
+        for chunk in upload.chunks():
+            tmp.write(chunk)
+        return tmp.name
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_temp_audio(max_age_seconds=None):
+    """清除程序中斷時遺留的暫存音檔，回傳刪除數量"""
+    max_age = AUDIO_TEMP_MAX_AGE_SECONDS if max_age_seconds is None else max_age_seconds
+    cutoff = time.time() - max_age
+    removed = 0
+    tmpdir = tempfile.gettempdir()
+    for name in os.listdir(tmpdir):
+        if not name.startswith(TEMP_PREFIX):
+            continue
+        path = os.path.join(tmpdir, name)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            removed += 1
+        except OSError:
+            continue
+    if removed:
+        print(f"🧹 已清除 {removed} 個遺留的暫存音檔")
+    return removed
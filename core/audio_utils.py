@@ -0,0 +1,162 @@
+import re
+import subprocess
+from difflib import SequenceMatcher
+
+from pydub import AudioSegment
+from pydub.utils import get_prober_name
+
+SILENCE_RE = re.compile(r"silence_(start|end): (-?[\d.]+)")
+MEAN_VOLUME_RE = re.compile(r"mean_volume: (-?[\d.]+|-inf) dB")
+PROGRESS_TIME_RE = re.compile(r"time=(\d+):(\d+):([\d.]+)")
+
+
+def plan_audio_segments(audio, max_ms, overlap_ms=2000, min_silence_len=700, silence_thresh=None):
+    """依靜音位置切割長音檔，回傳 [(start_ms, end_ms), ...]
+
+    每段不超過 max_ms；優先在後半段最後一個靜音中點切開，
+    找不到靜音時硬切，並讓下一段往前重疊 overlap_ms 以免切斷字句。
+    """
+    total = len(audio)
+    if total <= max_ms:
+        return [(0, total)]
+
+    if silence_thresh is None:
+        silence_thresh = audio.dBFS - 16
+    silences = detect_silence(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh, seek_step=100)
+    cut_points = [(s + e) // 2 for s, e in silences]
+
+    segments = []
+    start = 0
+    while total - start > max_ms:
+        limit = start + max_ms
+        candidates = [p for p in cut_points if start + max_ms // 2 <= p <= limit]
+        if candidates:
+            cut, next_start = candidates[-1], candidates[-1]
+        else:
+            cut, next_start = limit, max(limit - overlap_ms, start + 1)
+        segments.append((start, cut))
+        start = next_start
+    segments.append((start, total))
+    return segments
+
+
+def run_ffmpeg(*args, stdout=subprocess.DEVNULL):
+    """執行 ffmpeg，回傳 (stdout, stderr)；失敗時帶上 stderr 最後幾行方便除錯"""
+    result = subprocess.run(
+        [AudioSegment.converter, "-hide_banner", "-nostdin", *args],
+        stdout=stdout, stderr=subprocess.PIPE, check=False,
+    )
+    stderr = result.stderr.decode("utf-8", "replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"❌ ffmpeg 失敗：{stderr.strip().splitlines()[-3:]}")
+    return result.stdout, stderr
+
+
+class AudioFile:
+    """以 ffmpeg 串流處理的音檔
+
+    長度、音量與靜音位置都由 ffmpeg 逐段解碼後回報，各段再用 -ss/-t 直接從原檔抽出，
+    整堂課的音訊不會一次解碼進記憶體（一小時的 44.1kHz 立體聲約 600MB）。
+    介面與 plan_audio_segments 用到的 AudioSegment 屬性相同（len()、dBFS）。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._dBFS = None
+        self.length_ms = self.probe_duration_ms()
+
+    def __len__(self):
+        return self.length_ms
+
+    @property
+    def dBFS(self):
+        if self._dBFS is None:
+            self.scan_volume()
+        return self._dBFS
+
+    def probe_duration_ms(self):
+        result = subprocess.run(
+            [get_prober_name(), "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", self.path],
+            capture_output=True, check=False,
+        )
+        try:
+            return int(float(result.stdout.decode().strip()) * 1000)
+        except ValueError:
+            # 瀏覽器錄的 webm 沒有寫入長度，掃過一次取得
+            return self.scan_volume()
+
+    def scan_volume(self):
+        """串流解碼一次，取得平均音量（dBFS）與實際長度（毫秒）"""
+        _, stderr = run_ffmpeg("-i", self.path, "-vn", "-af", "volumedetect", "-f", "null", "-")
+        match = MEAN_VOLUME_RE.search(stderr)
+        self._dBFS = float(match.group(1)) if match else float("-inf")
+        times = PROGRESS_TIME_RE.findall(stderr)
+        if not times:
+            return 0
+        hours, minutes, seconds = times[-1]
+        return int((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000)
+
+    def export_segment(self, start_ms, end_ms, out_path, bitrate="64k"):
+        """把 [start_ms, end_ms) 轉成單聲道檔案（格式依副檔名）"""
+        run_ffmpeg("-y", *self.seek_args(start_ms, end_ms), "-vn", "-ac", "1", "-b:a", bitrate, out_path)
+
+    def read_pcm(self, start_ms, end_ms, sample_rate):
+        """[start_ms, end_ms) 的單聲道 16-bit PCM（little-endian）"""
+        stdout, _ = run_ffmpeg(
+            *self.seek_args(start_ms, end_ms), "-vn", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "-",
+            stdout=subprocess.PIPE,
+        )
+        return stdout
+
+    def seek_args(self, start_ms, end_ms):
+        return ["-ss", f"{start_ms / 1000:.3f}", "-t", f"{(end_ms - start_ms) / 1000:.3f}", "-i", self.path]
+
+
+def detect_silence(audio, min_silence_len, silence_thresh, seek_step=None):
+    """以 ffmpeg silencedetect 找出靜音區間 [(start_ms, end_ms), ...]
+
+    參數與 pydub 的 detect_silence 相同（seek_step 不適用）。
+    """
+    if silence_thresh == float("-inf"):
+        return []  # 整段無聲
+    _, stderr = run_ffmpeg(
+        "-i", audio.path, "-vn",
+        "-af", f"silencedetect=noise={silence_thresh:.1f}dB:d={min_silence_len / 1000:.3f}",
+        "-f", "null", "-",
+    )
+    silences, start = [], None
+    for kind, value in SILENCE_RE.findall(stderr):
+        ms = max(0, int(float(value) * 1000))
+        if kind == "start":
+            start = ms
+        elif start is not None:
+            silences.append((start, ms))
+            start = None
+    if start is not None:
+        silences.append((start, len(audio)))
+    return silences
+
+
+def load_audio(audio_path):
+    return AudioFile(audio_path)
+
+
+def stitch_transcripts(texts, window=200, min_match=8):
+    """把相鄰片段的逐字稿接起來，去除重疊區重複轉錄的文字"""
+    result = ""
+    for text in texts:
+        text = (text or "").strip()
+        if not text:
+            continue
+        if not result:
+            result = text
+            continue
+        tail, head = result[-window:], text[:window]
+        match = SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(0, len(tail), 0, len(head))
+        slack = window // 4
+        if match.size >= min_match and match.b <= slack and len(tail) - (match.a + match.size) <= slack:
+            result = result[:len(result) - len(tail) + match.a] + text[match.b:]
+        else:
+            result = result + "\n" + text
+    return result
@@ -0,0 +1,39 @@
+import threading
+
+from django.core.cache import caches
+
+
+def shared_cache_configured(alias="default"):
+    """Django 快取是否為跨 process 共用的後端（LocMem / Dummy 只存在單一 process）"""
+    backend = caches[alias].__class__.__module__
+    return not backend.endswith(("locmem", "dummy"))
+
+
+def select_store(backend, alias, cache_store, db_store, warning):
+    """依設定（cache / db / auto）選擇共用狀態的存放處；auto 在快取不是共用後端時改用資料庫"""
+    shared = shared_cache_configured(alias)
+    if backend == "db" or (backend == "auto" and not shared):
+        return db_store()
+    if not shared:
+        print(warning)
+    return cache_store()
+
+
+class LazyStore:
+    """process 內只建立一次的存放處；第一次使用時才建立（import 時還不能讀 CACHES）"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.store = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.store is None:
+            with self.lock:
+                if self.store is None:
+                    self.store = self.factory()
+        return self.store
+
+    def set(self, store):
+        """替換存放處（測試用）；傳入 None 則下次使用時重新建立"""
+        self.store = store
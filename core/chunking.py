@@ -0,0 +1,154 @@
+import math
+import os
+import re
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 700))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", 200))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 60))
+TOKENIZER_MODEL = os.getenv("CHUNK_TOKENIZER_MODEL", "gpt-4o")
+
+# 切點優先順序：句尾 → 子句 → 空白；都找不到時才硬切
+BOUNDARIES = [
+    re.compile(r'[。！？!?]+[」』）)"]*\s*|\.(?=\s)\s*|\n+'),
+    re.compile(r'[，,；;：:、]\s*'),
+    re.compile(r'\s+'),
+]
+CJK_RE = re.compile(r'[㐀-鿿豈-﫿぀-ヿ가-힯]')
+WORD_RE = re.compile(r'[0-9A-Za-zÀ-ɏ]+')
+
+_encoder = None
+
+
+def get_encoder():
+    """有安裝 tiktoken 時用實際的 tokenizer，否則回傳 None 改用估算"""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+        except ImportError:
+            _encoder = False
+        else:
+            try:
+                _encoder = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+            except KeyError:
+                _encoder = tiktoken.get_encoding("o200k_base")
+    return _encoder or None
+
+
+def estimate_tokens(text):
+    """沒有 tiktoken 時的估算：中日韓字約 1 token、英文單字約 1.3 token、其他符號約 0.5 token
+
+    回傳小數，切成很多小單位再加總時才不會因為逐一進位而高估。
+    """
+    cjk = len(CJK_RE.findall(text))
+    words = WORD_RE.findall(text)
+    word_chars = sum(len(w) for w in words)
+    others = len(text) - cjk - word_chars - text.count(" ")
+    return cjk + len(words) * 4 / 3 + max(others, 0) / 2
+
+
+def unit_tokens(text):
+    encoder = get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def count_tokens(text):
+    return math.ceil(unit_tokens(text))
+
+
+def split_units(text, start, end, max_tokens, level=0):
+    """把 text[start:end] 切成不超過 max_tokens 的單位，回傳 [(start, end, tokens), ...]
+
+    每一層只處理上一層切不動的片段，所以整體仍是線性時間。
+    """
+    tokens = unit_tokens(text[start:end])
+    if tokens <= max_tokens:
+        return [(start, end, tokens)]
+    if level >= len(BOUNDARIES):
+        # 沒有任何切點（例如一長串沒有標點的中文）：依 token 密度切成小塊，裝箱與重疊才有彈性
+        step = max(1, int((end - start) * max(max_tokens // 16, 16) / tokens))
+        units = []
+        for s in range(start, end, step):
+            e = min(s + step, end)
+            units.append((s, e, unit_tokens(text[s:e])))
+        return units
+
+    units = []
+    piece_start = start
+    for match in BOUNDARIES[level].finditer(text, start, end):
+        units.extend(split_units(text, piece_start, match.end(), max_tokens, level + 1))
+        piece_start = match.end()
+    if piece_start < end:
+        units.extend(split_units(text, piece_start, end, max_tokens, level + 1))
+    return units
+
+
+def pack_units(units, max_tokens, min_tokens):
+    """把單位依序裝箱成每段不超過 max_tokens，回傳每段的 (第一個單位, 最後一個單位+1)"""
+    groups = []
+    first, total = 0, 0
+    for i, (_, _, tokens) in enumerate(units):
+        if total and total + tokens > max_tokens:
+            groups.append((first, i))
+            first, total = i, 0
+        total += tokens
+    if first < len(units):
+        tail = sum(u[2] for u in units[first:])
+        if groups and tail < min_tokens:
+            previous = groups.pop()[0]
+            if total + sum(u[2] for u in units[previous:first]) <= max_tokens:
+                # 最後一段太短、併入前一段也不超過預算：直接合併
+                first = previous
+            else:
+                # 否則從前一段尾端挪單位過來，兩段都維持在 max_tokens 以內
+                while tail < min_tokens and first - 1 > previous and tail + units[first - 1][2] <= max_tokens:
+                    first -= 1
+                    tail += units[first][2]
+                groups.append((previous, first))
+        groups.append((first, len(units)))
+    return groups
+
+
+def context_start(text, start, overlap_tokens):
+    """往 start 之前取約 overlap_tokens 的完整句子／子句，回傳上下文起點"""
+    if start <= 0 or overlap_tokens <= 0:
+        return start
+    # 一個 token 最多約 4 個字元，只需要看這麼長的尾巴
+    tail = max(0, start - overlap_tokens * 4)
+    units = split_units(text, tail, start, overlap_tokens)
+    context, budget = start, overlap_tokens
+    for s, _, tokens in reversed(units):
+        if tokens > budget:
+            break
+        budget -= tokens
+        context = s
+    return context
+
+
+def token_chunks(text, start=0, max_tokens=None, min_tokens=None, overlap_tokens=None):
+    """把 text[start:] 依 token 預算切段，回傳 [(start, end, context_start), ...]
+
+    (start, end) 首尾相接；context_start <= start，多出來的部分是前面約
+    overlap_tokens 的內容（第一段也會往 start 之前取），送給模型時當作上下文。
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    min_tokens = CHUNK_MIN_TOKENS if min_tokens is None else min_tokens
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    if not text[start:].strip():
+        return []
+
+    units = split_units(text, start, len(text), max_tokens)
+    chunks = []
+    for first, last in pack_units(units, max_tokens, min_tokens):
+        if first == 0:
+            context = context_start(text, start, overlap_tokens)
+        else:
+            context_first, budget = first, overlap_tokens
+            while context_first > 0 and units[context_first - 1][2] <= budget:
+                budget -= units[context_first - 1][2]
+                context_first -= 1
+            context = units[context_first][0]
+        chunks.append((units[first][0], units[last - 1][1], context))
+    return chunks
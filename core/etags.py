@@ -0,0 +1,60 @@
+import os
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .models import Question, Student, StudentLectureStats
+
+# 預設快取是各 process 各自一份，作答後只清得掉本 process 的；TTL 設短，其他 worker 最多延遲這麼久
+SUBMISSION_ETAG_TTL = int(os.getenv('SUBMISSION_ETAG_TTL', 5 * 60))
+
+
+def submission_etag_key(student_id, lecture_id):
+    return f"etag:submissions:{student_id}:{lecture_id}"
+
+
+def timestamp_version(value):
+    return int(value.timestamp() * 1e6) if value else 0
+
+
+def question_set_version(lecture_id):
+    """講次題目的版本：新增、刪除或修改題目（含答案、解析）都會改變"""
+    version = Question.objects.filter(lecture_id=lecture_id).aggregate(
+        count=Count('id'), last_id=Max('id'), updated=Max('updated_at'),
+    )
+    return f"{version['count']}.{version['last_id'] or 0}.{timestamp_version(version['updated'])}"
+
+
+def submission_etag(student_id, lecture_id):
+    """學生在某講次作答結果頁的版本
+
+    作答的部分（批改後就不會再變）存在快取；題目版本每次以一個彙總查詢取得，
+    老師修改題目或答案後不會繼續回 304。
+    """
+    key = submission_etag_key(student_id, lecture_id)
+    answered = cache.get(key)
+    if answered is None:
+        stats = (
+            StudentLectureStats.objects.filter(student_id=student_id, lecture_id=lecture_id)
+            .values_list('total', 'last_submitted_at')
+            .first()
+        )
+        total, last = stats or (0, None)
+        answered = f"{total}-{timestamp_version(last)}"
+        cache.set(key, answered, SUBMISSION_ETAG_TTL)
+    return f"{student_id}-{lecture_id}-{answered}-{question_set_version(lecture_id)}"
+
+
+def invalidate_submission_etag(student_id, lecture_id):
+    cache.delete(submission_etag_key(student_id, lecture_id))
+
+
+def student_id_for_user(user):
+    """登入者對應的學生 id（快取起來，ETag 比對時不用查 Student）"""
+    key = f"student-id:user:{user.id}"
+    student_id = cache.get(key)
+    if student_id is None:
+        student_id = Student.objects.filter(user=user).values_list('id', flat=True).first()
+        if student_id is not None:
+            cache.set(key, student_id, SUBMISSION_ETAG_TTL)
+    return student_id
@@ -0,0 +1,247 @@
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .chunking import CHUNK_MAX_TOKENS, count_tokens
+from .models import Lecture, LectureJob, LectureSummaryChunk, Question
+
+# 佇列參數（可由環境變數調整）
+JOB_MAX_ATTEMPTS = int(os.getenv('LECTURE_JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_BASE_SECONDS = int(os.getenv('LECTURE_JOB_RETRY_BASE_SECONDS', 30))
+JOB_STALE_SECONDS = int(os.getenv('LECTURE_JOB_STALE_SECONDS', 60 * 60))
+WORKER_POLL_SECONDS = float(os.getenv('LECTURE_WORKER_POLL_SECONDS', 2))
+
+ACTIVE_STATUSES = ('transcribing', 'summarizing', 'generating', 'partial_summarizing')
+# 各類工作被搶到時的第一個狀態
+FIRST_STAGES = {'audio': 'transcribing', 'transcript': 'summarizing', 'partial': 'partial_summarizing'}
+
+# 直播逐字稿未摘要的部分累積超過此 token 數（即至少切得出兩段）才排入段落摘要
+PARTIAL_SUMMARY_MIN_PENDING_TOKENS = int(os.getenv('PARTIAL_SUMMARY_MIN_PENDING_TOKENS', 2 * CHUNK_MAX_TOKENS))
+
+# worker 每隔多久清一次遺留的暫存音檔
+TEMP_SWEEP_SECONDS = int(os.getenv('TEMP_AUDIO_SWEEP_SECONDS', 10 * 60))
+
+
+class JobFailed(Exception):
+    """AI 流程回報失敗（例如轉錄沒有結果），交由重試機制處理"""
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_lecture_job(lecture, kind='audio', num_mcq=3, num_tf=0):
+    """建立一筆排隊中的工作，立即返回，由 worker 背景處理"""
+    job = LectureJob.objects.create(
+        lecture=lecture,
+        kind=kind,
+        num_mcq=max(num_mcq, 0),
+        num_tf=max(num_tf, 0),
+        max_attempts=JOB_MAX_ATTEMPTS,
+    )
+    print(f"📥 已排入工作佇列：{job}")
+    return job
+
+
+def enqueue_lecture_job_once(lecture, kind='transcript', num_mcq=3, num_tf=0):
+    """同講次已有排隊中或處理中的工作（段落摘要除外）就沿用，重複送出不會多排一筆；回傳 (job, created)"""
+    with transaction.atomic():
+        # 鎖住講次列，讓同時送出的請求依序檢查
+        Lecture.objects.select_for_update().filter(id=lecture.id).first()
+        existing = (
+            LectureJob.objects.filter(lecture=lecture, status__in=('queued',) + ACTIVE_STATUSES)
+            .exclude(kind='partial')
+            .order_by('-id')
+            .first()
+        )
+        if existing:
+            return existing, False
+        return enqueue_lecture_job(lecture, kind=kind, num_mcq=num_mcq, num_tf=num_tf), True
+
+
+def enqueue_partial_summary(lecture, transcript=None):
+    """直播上傳新段落後，若未摘要的逐字稿夠長就排入段落摘要工作（同講次只排一筆）"""
+    transcript = lecture.transcript if transcript is None else transcript
+    covered = LectureSummaryChunk.objects.filter(lecture=lecture).aggregate(end=Max('end_offset'))['end'] or 0
+    if count_tokens((transcript or '')[covered:]) <= PARTIAL_SUMMARY_MIN_PENDING_TOKENS:
+        return None
+    pending = LectureJob.objects.filter(
+        lecture=lecture, kind='partial', status__in=('queued',) + ACTIVE_STATUSES
+    )
+    if pending.exists():
+        return None
+    return enqueue_lecture_job(lecture, kind='partial', num_mcq=0, num_tf=0)
+
+
+def latest_job_for(lecture):
+    return (
+        LectureJob.objects.filter(lecture=lecture)
+        .exclude(kind='partial')
+        .order_by('-id')
+        .first()
+    )
+
+
+def retry_delay(attempts):
+    """指數退避：30s、60s、120s…"""
+    return timedelta(seconds=JOB_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+
+
+def requeue_stale_jobs():
+    """worker 中途當機時，把卡在處理中太久的工作放回佇列"""
+    cutoff = timezone.now() - timedelta(seconds=JOB_STALE_SECONDS)
+    return LectureJob.objects.filter(
+        status__in=ACTIVE_STATUSES, locked_at__lt=cutoff
+    ).update(status='queued', locked_by='', locked_at=None, run_after=timezone.now())
+
+
+def claim_next_job(owner=None):
+    """以條件式 UPDATE 搶佔下一筆工作，多個 worker 同時執行也不會重複處理"""
+    owner = owner or worker_id()
+    now = timezone.now()
+    candidates = (
+        LectureJob.objects.filter(status='queued', run_after__lte=now)
+        .order_by('run_after', 'id')
+        .values_list('id', 'kind')[:5]
+    )
+    for job_id, kind in candidates:
+        claimed = LectureJob.objects.filter(id=job_id, status='queued').update(
+            status=FIRST_STAGES[kind], locked_by=owner, locked_at=now, updated_at=now
+        )
+        if claimed:
+            return LectureJob.objects.select_related('lecture').get(id=job_id)
+    return None
+
+
+def set_job_status(job, status):
+    job.status = status
+    LectureJob.objects.filter(id=job.id).update(status=status, updated_at=timezone.now())
+
+
+def run_job(job):
+    """執行單一工作，失敗時依退避時間重新排隊，超過次數標記為 failed"""
+    from .ai_modules import (
+        process_audio_and_generate_quiz,
+        process_transcript_and_generate_quiz,
+        summarize_ready_chunks,
+    )
+    from .ledger import pipeline_run, pipeline_stage
+    from .live import live_transcript
+
+    job.attempts += 1
+    LectureJob.objects.filter(id=job.id).update(attempts=job.attempts)
+    if job.attempts > 1 and job.kind != 'partial':
+        # 重試前清掉上次中途寫入、尚未被作答的題目，避免重複出題
+        Question.objects.filter(lecture_id=job.lecture_id, submission__isnull=True).delete()
+
+    def on_stage(stage):
+        set_job_status(job, stage)
+
+    try:
+        # 每次執行都留下一筆 PipelineRun，記錄各階段耗時、tokens 與成本
+        with pipeline_run(job.lecture, job.kind, job):
+            if job.kind == 'partial':
+                lecture = Lecture.objects.get(id=job.lecture_id)
+                # 錄音中的逐字稿尚未寫回講次，以已連續轉錄完成的段落為準
+                with pipeline_stage('chunk_summaries'):
+                    summarize_ready_chunks(lecture, transcript=live_transcript(lecture, contiguous=True))
+                ok = True
+            elif job.kind == 'transcript':
+                lecture = Lecture.objects.get(id=job.lecture_id)
+                ok = process_transcript_and_generate_quiz(
+                    lecture, num_mcq=job.num_mcq, num_tf=job.num_tf, on_stage=on_stage
+                )
+            else:
+                ok = process_audio_and_generate_quiz(
+                    job.lecture_id, num_mcq=job.num_mcq, num_tf=job.num_tf, on_stage=on_stage
+                )
+            if not ok:
+                raise JobFailed("AI 處理流程沒有產生結果")
+    except Exception as e:
+        error = f"{e.__class__.__name__}: {e}"
+        print(f"❌ 工作 #{job.id} 第 {job.attempts} 次執行失敗：{error}")
+        job.last_error = traceback.format_exc() if not isinstance(e, JobFailed) else error
+        if job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.status = 'failed'
+        job.locked_by = ''
+        job.locked_at = None
+        job.save(update_fields=['status', 'run_after', 'last_error', 'locked_by', 'locked_at', 'updated_at'])
+        return job
+
+    with transaction.atomic():
+        if job.kind != 'partial':
+            Lecture.objects.filter(id=job.lecture_id).update(quiz_generated=True)
+        job.status = 'done'
+        job.last_error = ''
+        job.locked_by = ''
+        job.locked_at = None
+        job.save(update_fields=['status', 'last_error', 'locked_by', 'locked_at', 'updated_at'])
+    print(f"✅ 工作 #{job.id} 完成")
+    return job
+
+
+def run_worker(once=False, poll_seconds=None, stop_after=None):
+    """worker 主迴圈；once=True 時處理完目前佇列即結束"""
+    poll_seconds = WORKER_POLL_SECONDS if poll_seconds is None else poll_seconds
+    owner = worker_id()
+    processed = 0
+    print(f"👷 Lecture worker 啟動：{owner}")
+    from .ai_modules import TRANSCRIBE_BACKEND
+    if TRANSCRIBE_BACKEND == "local":
+        from .local_whisper import preload_local_whisper
+        preload_local_whisper()
+    from .audio_ingest import sweep_temp_audio
+    from .live import claim_next_chunk, requeue_stale_chunks, transcribe_chunk
+    last_sweep = 0
+    while True:
+        requeue_stale_jobs()
+        requeue_stale_chunks()
+        if time.monotonic() - last_sweep > TEMP_SWEEP_SECONDS:
+            sweep_temp_audio()
+            last_sweep = time.monotonic()
+        # 直播段落很短、使用者正在等逐字稿，優先於講次工作
+        chunk = claim_next_chunk()
+        if chunk is not None:
+            transcribe_chunk(chunk)
+            processed += 1
+            if stop_after and processed >= stop_after:
+                break
+            continue
+        job = claim_next_job(owner)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_seconds)
+            continue
+        run_job(job)
+        processed += 1
+        if stop_after and processed >= stop_after:
+            break
+    return processed
+
+
+def job_status_payload(lecture):
+    """提供前端輪詢用的 JSON 內容"""
+    job = latest_job_for(lecture)
+    payload = {
+        'lecture_id': lecture.id,
+        'status': job.status if job else ('done' if lecture.summary else 'unknown'),
+        'status_display': job.get_status_display() if job else '',
+        'attempts': job.attempts if job else 0,
+        'max_attempts': job.max_attempts if job else 0,
+        'finished': job.is_finished() if job else bool(lecture.summary),
+        'error': '',
+        'updated_at': job.updated_at.isoformat() if job else None,
+    }
+    if job and job.status == 'failed':
+        payload['error'] = job.last_error.strip().splitlines()[-1] if job.last_error else ''
+    return payload
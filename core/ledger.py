@@ -0,0 +1,248 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import PipelineRun, PipelineStage
+
+
+def parse_prices(spec):
+    """'gpt-4o=2.5:10' → {model: (每百萬輸入 tokens 美元, 每百萬輸出 tokens 美元)}"""
+    prices = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        model, _, price = item.partition("=")
+        prompt, _, completion = price.partition(":")
+        prices[model.strip()] = (float(prompt or 0), float(completion or 0))
+    return prices
+
+
+# 估算成本用的價格，格式同 RATE_LIMITS；Whisper 以音檔長度每分鐘計價
+MODEL_PRICES = parse_prices(os.getenv("MODEL_PRICES", "gpt-4o=2.5:10"))
+WHISPER_PRICE_PER_MINUTE = float(os.getenv("WHISPER_PRICE_PER_MINUTE", 0.006))
+
+STAGE_FIELDS = ("api_calls", "api_seconds", "wait_seconds", "prompt_tokens", "completion_tokens",
+                "retries", "audio_seconds", "cost_usd")
+STAGE_LABELS = {
+    "transcribe": "語音轉錄",
+    "chunk_summaries": "段落摘要",
+    "combine_summaries": "整合摘要",
+    "generate_quiz": "出題",
+}
+RUN_FIELDS = ("api_seconds", "prompt_tokens", "completion_tokens", "retries", "audio_seconds", "cost_usd")
+
+# 目前所在的流程與階段；沒有在 pipeline_run() 裡時，以下的 record_* 都不做事
+_run = contextvars.ContextVar("pipeline_run", default=None)
+_stage = contextvars.ContextVar("pipeline_stage", default=None)
+
+
+class StageMeter:
+    """累計單一階段的用量；段落摘要等會由多個執行緒同時回報"""
+
+    def __init__(self, name):
+        self.name = name
+        self.totals = dict.fromkeys(STAGE_FIELDS, 0)
+        self.http_requests = 0
+        self.lock = threading.Lock()
+
+    def add(self, **amounts):
+        with self.lock:
+            for field, amount in amounts.items():
+                self.totals[field] += amount
+
+    def count_http_request(self):
+        with self.lock:
+            self.http_requests += 1
+
+    def result(self):
+        with self.lock:
+            totals = dict(self.totals)
+            # SDK 自動重送的次數 = 實際送出的 HTTP 請求 - 呼叫次數
+            totals["retries"] += max(0, self.http_requests - totals["api_calls"])
+        return totals
+
+
+@contextmanager
+def pipeline_run(lecture, kind, job=None):
+    """記錄一次流程執行；例外會照常往外丟，記錄標為 failed"""
+    run = PipelineRun.objects.create(
+        lecture=lecture, job=job, kind=kind, attempt=job.attempts if job else 1,
+    )
+    token = _run.set(run)
+    started = time.perf_counter()
+    try:
+        yield run
+    except Exception as e:
+        finish_run(run, started, 'failed', f"{e.__class__.__name__}: {e}")
+        raise
+    else:
+        finish_run(run, started, 'done')
+    finally:
+        _run.reset(token)
+
+
+def finish_run(run, started, status, error=""):
+    run.status = status
+    run.error = error
+    run.finished_at = timezone.now()
+    run.wall_seconds = round(time.perf_counter() - started, 3)
+    for field in RUN_FIELDS:
+        setattr(run, field, sum(getattr(stage, field) for stage in run.stages.all()))
+    run.save()
+    print(f"📒 流程 #{run.id} {status}：{run.wall_seconds:.1f}s，"
+          f"tokens {run.prompt_tokens}+{run.completion_tokens}，約 ${run.cost_usd:.4f}")
+
+
+@contextmanager
+def pipeline_stage(name):
+    """記錄一個階段的耗時與期間內所有 API 呼叫的用量"""
+    run = _run.get()
+    if run is None:
+        yield None
+        return
+    meter = StageMeter(name)
+    token = _stage.set(meter)
+    started_at, started = timezone.now(), time.perf_counter()
+    failed = True
+    try:
+        yield meter
+        failed = False
+    finally:
+        _stage.reset(token)
+        PipelineStage.objects.create(
+            run=run, name=name, started_at=started_at, failed=failed,
+            wall_seconds=round(time.perf_counter() - started, 3),
+            **meter.result(),
+        )
+
+
+def propagate(fn):
+    """交給 ThreadPoolExecutor 的函式需包一層，子執行緒才會把用量記到目前的階段"""
+    meter = _stage.get()
+
+    def wrapper(*args, **kwargs):
+        token = _stage.set(meter)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _stage.reset(token)
+    return wrapper
+
+
+def chat_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def record_chat_call(model, seconds, usage=None, wait_seconds=0):
+    meter = _stage.get()
+    if meter is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    meter.add(
+        api_calls=1, api_seconds=seconds, wait_seconds=wait_seconds,
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+        cost_usd=chat_cost(model, prompt_tokens, completion_tokens),
+    )
+
+
+def record_transcription(seconds, audio_seconds=0, wait_seconds=0):
+    meter = _stage.get()
+    if meter is None:
+        return
+    meter.add(
+        api_calls=1, api_seconds=seconds, wait_seconds=wait_seconds, audio_seconds=audio_seconds,
+        cost_usd=audio_seconds / 60 * WHISPER_PRICE_PER_MINUTE,
+    )
+
+
+def record_retry(count=1):
+    """流程自己的重試（例如出題數量不足再補出）"""
+    meter = _stage.get()
+    if meter is not None:
+        meter.add(retries=count)
+
+
+def count_http_request(request):
+    """OpenAI client 的 httpx event hook：每送出一次 HTTP 請求（含自動重送）呼叫一次"""
+    meter = _stage.get()
+    if meter is not None:
+        meter.count_http_request()
+
+
+def percentile(values, q):
+    """最近排名法；values 需已排序"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+    }
+
+
+def pipeline_stats(days=7):
+    """最近 days 天各階段的耗時百分位數與用量，以及每日整體流程耗時"""
+    since = timezone.now() - timedelta(days=days)
+    stages = {}
+    rows = PipelineStage.objects.filter(started_at__gte=since).values_list(
+        "name", "wall_seconds", "api_seconds", "wait_seconds", "prompt_tokens", "completion_tokens",
+        "retries", "audio_seconds", "cost_usd", "failed",
+    )
+    for name, wall, api, wait, prompt, completion, retries, audio, cost, failed in rows:
+        stage = stages.setdefault(name, {"wall": [], "api": [], "tokens": 0, "retries": 0,
+                                         "wait": 0.0, "audio": 0.0, "cost": 0.0, "failed": 0})
+        stage["wall"].append(wall)
+        stage["api"].append(api)
+        stage["tokens"] += prompt + completion
+        stage["retries"] += retries
+        stage["wait"] += wait
+        stage["audio"] += audio
+        stage["cost"] += cost
+        stage["failed"] += failed
+
+    stage_rows = []
+    for name, stage in stages.items():
+        stage_rows.append({
+            "name": name,
+            "label": STAGE_LABELS.get(name, name),
+            "wall": summarize(stage["wall"]),
+            "api": summarize(stage["api"]),
+            "total_seconds": round(sum(stage["wall"]), 1),
+            "tokens": stage["tokens"],
+            "retries": stage["retries"],
+            "wait_seconds": round(stage["wait"], 1),
+            "audio_minutes": round(stage["audio"] / 60, 1),
+            "cost_usd": round(stage["cost"], 4),
+            "failed": stage["failed"],
+        })
+    # 總耗時最多的階段排最前面，就是最該優化的地方
+    stage_rows.sort(key=lambda row: row["total_seconds"], reverse=True)
+
+    daily = {}
+    runs = PipelineRun.objects.filter(started_at__gte=since).exclude(status='running').values_list(
+        "started_at", "wall_seconds", "cost_usd", "status",
+    )
+    for started_at, wall, cost, status in runs:
+        day = daily.setdefault(timezone.localdate(started_at), {"wall": [], "cost": 0.0, "failed": 0})
+        day["wall"].append(wall)
+        day["cost"] += cost
+        day["failed"] += status == 'failed'
+    daily_rows = [
+        {"date": date, "wall": summarize(day["wall"]), "cost_usd": round(day["cost"], 4), "failed": day["failed"]}
+        for date, day in sorted(daily.items(), reverse=True)
+    ]
+    return {"stages": stage_rows, "daily": daily_rows}
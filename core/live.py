@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .ai_modules import transcribe_with_whisper
+from .audio_ingest import discard, save_upload_to_tempfile
+from .jobs import enqueue_partial_summary
+from .models import Lecture, LiveChunk
+
+LIVE_CHUNK_MAX_ATTEMPTS = int(os.getenv("LIVE_CHUNK_MAX_ATTEMPTS", 3))
+# 轉錄中的段落超過此秒數沒有結果，視為 worker 當掉並放回佇列
+LIVE_CHUNK_STALE_SECONDS = int(os.getenv("LIVE_CHUNK_STALE_SECONDS", 300))
+SSE_KEEPALIVE_SECONDS = int(os.getenv("SSE_KEEPALIVE_SECONDS", 15))
+SSE_POLL_SECONDS = float(os.getenv("SSE_POLL_SECONDS", 1))
+SSE_POLL_LOOKBACK_SECONDS = int(os.getenv("SSE_POLL_LOOKBACK_SECONDS", 30))
+
+# 啟用直播段落前就已存在的逐字稿，以這個 session 保留在最前面
+LEGACY_SESSION_ID = ""
+
+# 轉錄結果已出爐（成功或放棄）的狀態
+FINISHED_STATUSES = ('done', 'failed')
+
+
+def store_chunk(lecture, session_id, seq, upload):
+    """把段落音檔存進 storage 並排入轉錄佇列；重送的段落（已轉錄或排隊中）不會重複處理
+
+    回傳 (chunk, queued)。
+    """
+    keep_legacy_transcript(lecture)
+    try:
+        chunk, created = LiveChunk.objects.get_or_create(lecture=lecture, session_id=session_id, seq=seq)
+    except IntegrityError:
+        chunk, created = LiveChunk.objects.get(lecture=lecture, session_id=session_id, seq=seq), False
+
+    if created or chunk.status == 'failed':
+        chunk.audio.save(f"{lecture.id}-{seq}.webm", upload, save=False)
+        LiveChunk.objects.filter(id=chunk.id).update(
+            status='pending', audio=chunk.audio.name, attempts=0, locked_at=None, created_at=timezone.now(),
+        )
+        chunk.status = 'pending'
+        return chunk, True
+    return chunk, False
+
+
+def keep_legacy_transcript(lecture):
+    """第一次直播上傳時，把既有逐字稿存成最前面的段落，組稿時才不會被覆蓋"""
+    if not lecture.transcript or LiveChunk.objects.filter(lecture=lecture).exists():
+        return
+    LiveChunk.objects.get_or_create(
+        lecture=lecture, session_id=LEGACY_SESSION_ID, seq=0,
+        defaults={'status': 'done', 'text': lecture.transcript.strip(), 'transcribed_at': timezone.now()},
+    )
+
+
+def claim_next_chunk():
+    """以條件式 UPDATE 搶佔下一個待轉錄段落，多個 worker 同時執行也不會重複轉錄"""
+    now = timezone.now()
+    for chunk_id in LiveChunk.objects.filter(status='pending').order_by('id').values_list('id', flat=True)[:5]:
+        claimed = LiveChunk.objects.filter(id=chunk_id, status='pending').update(
+            status='transcribing', locked_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return LiveChunk.objects.get(id=chunk_id)
+    return None
+
+
+def requeue_stale_chunks():
+    """轉錄到一半 worker 當掉時，把段落放回佇列（音檔仍在 storage）"""
+    cutoff = timezone.now() - timedelta(seconds=LIVE_CHUNK_STALE_SECONDS)
+    return LiveChunk.objects.filter(status='transcribing', locked_at__lt=cutoff).update(status='pending', locked_at=None)
+
+
+def transcribe_chunk(chunk):
+    """轉錄一個已搶到的段落；失敗時放回佇列，超過 LIVE_CHUNK_MAX_ATTEMPTS 次標為 failed"""
+    path = None
+    try:
+        with chunk.audio.open('rb') as audio:
+            # storage 不一定是本機檔案，先複製一份給 Whisper 讀
+            path = save_upload_to_tempfile(audio)
+        text = (transcribe_with_whisper(path) or "").strip()
+    except Exception as e:
+        print(f"❌ 直播段落 {chunk.seq} 第 {chunk.attempts} 次轉錄錯誤:", e)
+        if chunk.attempts < LIVE_CHUNK_MAX_ATTEMPTS:
+            LiveChunk.objects.filter(id=chunk.id).update(status='pending', locked_at=None)
+            return chunk
+        chunk.status, chunk.text = 'failed', ""
+    else:
+        chunk.status, chunk.text = 'done', text
+    finally:
+        if path:
+            discard(path)
+
+    # 只更新這一列，不再每段改寫整份逐字稿；SSE 依 transcribed_at 輪詢到這一列
+    LiveChunk.objects.filter(id=chunk.id).update(
+        status=chunk.status, text=chunk.text, transcribed_at=timezone.now(), locked_at=None, audio='',
+    )
+    chunk.audio.delete(save=False)
+    if chunk.text:
+        # 累積足夠內容就先在背景做段落摘要，結束錄音時只剩整合與出題
+        lecture = Lecture.objects.get(id=chunk.lecture_id)
+        enqueue_partial_summary(lecture, live_transcript(lecture, contiguous=True))
+    return chunk
+
+
+def pending_chunks(lecture):
+    """還沒有轉錄結果的段落（排隊中或轉錄中）；佇列存在資料庫，不會因為 process 重啟而遺失"""
+    return LiveChunk.objects.filter(lecture=lecture).exclude(status__in=FINISHED_STATUSES)
+
+
+def failed_chunks(lecture):
+    return LiveChunk.objects.filter(lecture=lecture, status='failed')
+
+
+def live_transcript(lecture, contiguous=False):
+    """依錄音先後、段落序號組出逐字稿
+
+    contiguous=True 時只取最新一次錄音中「從頭連續且已轉錄完成」的部分，
+    結果一定是最終逐字稿的前綴，段落摘要的位置因此不會失效。
+    """
+    sessions = (
+        LiveChunk.objects.filter(lecture=lecture)
+        .values('session_id')
+        .annotate(first=Min('id'))
+        .order_by('first')
+    )
+    order = [row['session_id'] for row in sessions]
+    rows = LiveChunk.objects.filter(lecture=lecture).values_list('session_id', 'seq', 'status', 'text')
+    by_session = {}
+    for session_id, seq, status, text in rows:
+        by_session.setdefault(session_id, []).append((seq, status, text))
+
+    texts = []
+    for position, session_id in enumerate(order):
+        chunks = sorted(by_session[session_id])
+        recording = contiguous and position == len(order) - 1 and session_id != LEGACY_SESSION_ID
+        expected = 0
+        for seq, status, text in chunks:
+            if recording and (seq != expected or status == 'pending'):
+                break
+            expected = seq + 1
+            if status == 'done' and text:
+                texts.append(text)
+    return "\n".join(texts)
+
+
+def finalize_live_transcript(lecture):
+    """結束錄音：依序組好逐字稿並一次寫入（可重複呼叫，結果相同）"""
+    if not LiveChunk.objects.filter(lecture=lecture).exists():
+        return lecture.transcript
+    lecture.transcript = live_transcript(lecture)
+    lecture.save(update_fields=['transcript'])
+    return lecture.transcript
+
+
+def sse_message(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def finished_chunks_since(lecture_id, session_id, since):
+    """since 之後（含）才有轉錄結果的段落，依完成時間排序；since 為 None 時取全部"""
+    rows = LiveChunk.objects.filter(lecture_id=lecture_id, status__in=FINISHED_STATUSES)
+    if session_id:
+        rows = rows.filter(session_id=session_id)
+    if since is not None:
+        rows = rows.filter(transcribed_at__gte=since)
+    return list(rows.order_by('transcribed_at', 'id').values_list('id', 'seq', 'status', 'text', 'transcribed_at'))
+
+
+async def transcript_events(lecture_id, session_id=None):
+    """SSE 產生器：每 SSE_POLL_SECONDS 查一次新完成的段落並推送（可能不依序，前端以 seq 排列）
+
+    事件來源是 LiveChunk 資料表，轉錄在哪個 worker 完成、訂閱者連到哪個 process 都看得到。
+    有給 session_id 時先送出這次錄音已完成的段落，讓晚到或重新連線的訂閱者補齊；
+    沒給時只推送訂閱之後完成的段落。閒置超過 SSE_KEEPALIVE_SECONDS 送 keepalive 註解。
+    """
+    # 不同 worker 的時鐘與 commit 先後不一，每次往前多查一段時間，已送過的（同一次結果）略過
+    lookback = timedelta(seconds=SSE_POLL_LOOKBACK_SECONDS)
+    newest = None if session_id else timezone.now()
+    sent = {}
+    if newest:
+        # 沒有 session_id 只推送之後的結果：回看範圍內已有結果的段落當作送過了
+        rows = await sync_to_async(finished_chunks_since)(lecture_id, None, newest - lookback)
+        sent = {chunk_id: transcribed_at for chunk_id, _, _, _, transcribed_at in rows}
+    yield sse_message("ready", {"lecture_id": lecture_id})
+    idle_since = time.monotonic()
+    while True:
+        since = newest - lookback if newest else None
+        for chunk_id, seq, status, text, transcribed_at in await sync_to_async(finished_chunks_since)(
+            lecture_id, session_id, since
+        ):
+            if sent.get(chunk_id) == transcribed_at:
+                continue
+            sent[chunk_id] = transcribed_at
+            newest = max(newest, transcribed_at) if newest else transcribed_at
+            idle_since = time.monotonic()
+            yield sse_message("transcript", {"seq": seq, "status": status, "text": text}, event_id=seq)
+        if time.monotonic() - idle_since >= SSE_KEEPALIVE_SECONDS:
+            idle_since = time.monotonic()
+            yield ": keepalive\n\n"
+        await asyncio.sleep(SSE_POLL_SECONDS)
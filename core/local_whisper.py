@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+
+from .audio_utils import load_audio, plan_audio_segments, stitch_transcripts
+
+# 本機 Whisper 參數（需安裝 openai-whisper 與 torch）
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "base")
+LOCAL_WHISPER_DEVICE = os.getenv("LOCAL_WHISPER_DEVICE", "cpu")
+LOCAL_WHISPER_LANGUAGE = os.getenv("LOCAL_WHISPER_LANGUAGE", "zh")
+LOCAL_WHISPER_BATCH_SIZE = int(os.getenv("LOCAL_WHISPER_BATCH_SIZE", 8))
+LOCAL_WHISPER_THREADS = int(os.getenv("LOCAL_WHISPER_THREADS", 0))
+
+# Whisper 模型一次只看 30 秒，切段後可直接批次解碼
+WINDOW_MS = 30 * 1000
+SAMPLE_RATE = 16000
+
+_model = None
+_model_name = None
+_model_lock = threading.Lock()
+_decode_lock = threading.Lock()
+
+
+def get_local_model(name=None):
+    """每個 worker process 只載入一次模型並常駐記憶體"""
+    global _model, _model_name
+    name = name or LOCAL_WHISPER_MODEL
+    if _model is not None and _model_name == name:
+        return _model
+    with _model_lock:
+        if _model is None or _model_name != name:
+            try:
+                import torch
+                import whisper
+            except ImportError as e:
+                raise RuntimeError("❌ 本機轉錄需要安裝 openai-whisper 與 torch") from e
+            if LOCAL_WHISPER_THREADS:
+                torch.set_num_threads(LOCAL_WHISPER_THREADS)
+            started = time.perf_counter()
+            _model = whisper.load_model(name, device=LOCAL_WHISPER_DEVICE)
+            _model_name = name
+            print(f"✅ 本機 Whisper 模型 {name} 載入完成（{time.perf_counter() - started:.1f}s）")
+    return _model
+
+
+def preload_local_whisper():
+    get_local_model()
+
+
+def segment_to_array(audio, start, end):
+    """由 ffmpeg 直接抽出 16kHz 單聲道片段，轉成 Whisper 需要的 float32 陣列"""
+    import numpy as np
+
+    samples = np.frombuffer(audio.read_pcm(start, end, SAMPLE_RATE), dtype=np.int16).astype(np.float32)
+    return samples / 32768.0
+
+
+def decode_batch(model, arrays):
+    import torch
+    import whisper
+
+    mels = torch.stack([
+        whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(a)), model.dims.n_mels)
+        for a in arrays
+    ]).to(model.device)
+    options = whisper.DecodingOptions(language=LOCAL_WHISPER_LANGUAGE or None, fp16=False, without_timestamps=True)
+    with _decode_lock:
+        results = whisper.decode(model, mels, options)
+    return [r.text.strip() for r in results]
+
+
+def transcribe_local(audio_path, batch_size=None):
+    """本機 CPU 轉錄：依靜音切成 30 秒內片段後批次解碼，回傳格式與 transcribe_segmented 相同"""
+    model = get_local_model()
+    batch_size = batch_size or LOCAL_WHISPER_BATCH_SIZE
+
+    audio = load_audio(audio_path)
+    plan = plan_audio_segments(audio, WINDOW_MS, overlap_ms=1000)
+    print(f"🖥️ 本機 Whisper 轉錄：{len(audio) / 1000:.0f}s，{len(plan)} 段，每批 {batch_size} 段")
+
+    segments = []
+    for offset in range(0, len(plan), batch_size):
+        batch = plan[offset:offset + batch_size]
+        started = time.perf_counter()
+        texts = decode_batch(model, [segment_to_array(audio, start, end) for start, end in batch])
+        elapsed = round((time.perf_counter() - started) / len(batch), 3)
+        for i, ((start, end), text) in enumerate(zip(batch, texts)):
+            segments.append({
+                "index": offset + i,
+                "start": start / 1000,
+                "end": end / 1000,
+                "text": text,
+                "seconds": elapsed,
+            })
+
+    return {
+        "text": stitch_transcripts([seg["text"] for seg in segments]),
+        "segments": segments,
+    }
@@ -0,0 +1,99 @@
+import random
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.chunking import count_tokens, token_chunks
+
+# 約略的口語速度（每分鐘）
+CJK_CHARS_PER_MINUTE = 250
+EN_WORDS_PER_MINUTE = 150
+
+CJK_PHRASES = [
+    "資料庫正規化的目的是減少重複資料", "第一正規化要求每個欄位都是不可再分割的值",
+    "交易必須滿足原子性與一致性", "索引可以加快查詢但會拖慢寫入", "我們來看一下這個例子",
+    "查詢最佳化器會根據統計資訊選擇執行計畫", "那這邊大家有沒有問題", "鎖的粒度越細並行度越高",
+]
+EN_WORDS = (
+    "the query planner uses table statistics to choose between an index scan and a sequential scan "
+    "so keeping statistics fresh matters when data changes quickly and we will see why in the lab"
+).split()
+
+
+def legacy_dynamic_split(text, min_length=300, max_length=1000):
+    """原本以字元長度、只在。！？切段的做法（字串累加），保留作為比較基準"""
+    text = text.strip()
+    if len(text) <= max_length:
+        return [text]
+    paragraphs = re.split(r'(?<=[。！？])\s*', text)
+    chunks, temp = [], ""
+    for para in paragraphs:
+        if len(temp) + len(para) <= max_length:
+            temp += para
+        else:
+            if len(temp) >= min_length:
+                chunks.append(temp.strip())
+                temp = para
+            else:
+                temp += para
+    if temp:
+        chunks.append(temp.strip())
+    return chunks
+
+
+def synth_transcript(kind, minutes, rng):
+    """產生合成逐字稿：zh（有標點中文）、zh-nopunct（Whisper 常見的無標點輸出）、en（英文）"""
+    if kind == "en":
+        words = [rng.choice(EN_WORDS) for _ in range(minutes * EN_WORDS_PER_MINUTE)]
+        return " ".join(words)
+    parts, length = [], 0
+    target = minutes * CJK_CHARS_PER_MINUTE
+    while length < target:
+        phrase = rng.choice(CJK_PHRASES)
+        if kind == "zh":
+            phrase += rng.choice("，，，。！？")
+        parts.append(phrase)
+        length += len(phrase)
+    return "".join(parts)
+
+
+class Command(BaseCommand):
+    help = "以合成的多小時逐字稿量測切段速度與每段 token 數（新舊做法比較）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, nargs='+', default=[1, 3, 6])
+        parser.add_argument('--kinds', nargs='+', default=['zh', 'zh-nopunct', 'en'])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--max-tokens', type=int, default=None)
+        parser.add_argument('--overlap-tokens', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        for kind in options['kinds']:
+            for hours in options['hours']:
+                text = synth_transcript(kind, int(hours * 60), rng)
+                self.stdout.write(f"\n📄 {kind} {hours:g} 小時：{len(text):,} 字元")
+                self.run('legacy', lambda: legacy_dynamic_split(text), options['repeat'])
+                chunks = self.run('token', lambda: [
+                    text[c:e] for _, e, c in token_chunks(
+                        text, max_tokens=options['max_tokens'], overlap_tokens=options['overlap_tokens'])
+                ], options['repeat'])
+                self.report_sizes('legacy', legacy_dynamic_split(text))
+                self.report_sizes('token', chunks)
+
+    def run(self, name, split, repeat):
+        samples, result = [], None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = split()
+            samples.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(f"  ⏱ {name:<7} 中位數 {statistics.median(samples):9.1f} ms  {len(result):6d} 段")
+        return result
+
+    def report_sizes(self, name, chunks):
+        sizes = sorted(count_tokens(c) for c in chunks)
+        self.stdout.write(
+            f"  📏 {name:<7} 每段 tokens：最小 {sizes[0]}  中位數 {sizes[len(sizes) // 2]}  最大 {sizes[-1]}"
+        )
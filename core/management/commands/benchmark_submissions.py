@@ -0,0 +1,179 @@
+import os
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Q
+
+from core.models import Course, Lecture, Question, Student, Submission
+from core.rollups import rebuild_student_lecture_stats
+from core.reports import lecture_submission_stats, student_totals, top_wrong_questions
+
+BENCH_COURSE_NAME = "__benchmark__"
+
+
+class Command(BaseCommand):
+    help = (
+        "在暫時建立的測試資料庫中產生大量作答資料，量測 student_report / student_aggregate / submission_result / "
+        "lecture_submissions 查詢的延遲與查詢計畫；結束後刪除，不會寫入或修改目前設定的資料庫"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=1000)
+        parser.add_argument('--lectures', type=int, default=50)
+        parser.add_argument('--questions', type=int, default=20, help='每個講次的題數')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--compare', action='store_true', help='在測試資料庫中移除新增的索引再量測一次以比較')
+        parser.add_argument('--explain', action='store_true', help='輸出每個查詢的 query plan')
+
+    def handle(self, *args, **options):
+        # 與 manage.py test 相同的方式建立獨立資料庫（SQLite 為記憶體資料庫），connection 期間改指向它
+        old_name = connection.settings_dict['NAME']
+        # 連線若在切換前就開啟過，SQLite 會在設定的路徑留下空白的資料庫檔，結束時一併清掉
+        leftover = connection.vendor == 'sqlite' and not os.path.exists(old_name)
+        self.stdout.write("🧪 建立暫時的測試資料庫…")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            connection.close()
+            if leftover and os.path.exists(old_name) and os.path.getsize(old_name) == 0:
+                os.remove(old_name)
+
+    def benchmark(self, options):
+        course = self.seed(options)
+        lecture = Lecture.objects.filter(course=course).order_by('id').first()
+        student = Student.objects.filter(submission__question__lecture=lecture).first()
+        total = Submission.objects.filter(question__lecture__course=course).count()
+        self.stdout.write(f"📦 測試資料：{total} 筆作答")
+
+        cases = self.cases(student, lecture)
+        results = {'with_indexes': self.run_cases(cases, options)}
+        if options['compare']:
+            with self.indexes_removed():
+                results['without_indexes'] = self.run_cases(cases, options)
+            self.stdout.write("\n📊 比較（中位數 ms）")
+            for name in cases:
+                before = results['without_indexes'][name]
+                after = results['with_indexes'][name]
+                self.stdout.write(f"  {name:<22} 無索引 {before:8.2f}  有索引 {after:8.2f}  ({before / after if after else 0:.1f}x)")
+
+    def cases(self, student, lecture):
+        return {
+            'student_report': lambda: (student_totals(student), list(top_wrong_questions(student))),
+            # student_report 已改讀 StudentLectureStats；直接對 Submission 依學生彙總，才量得到 (student, is_correct) 索引
+            'student_aggregate': lambda: list(
+                Submission.objects.values('student_id')
+                .annotate(total=Count('id'), correct=Count('id', filter=Q(is_correct=True)))
+            ),
+            'submission_result': lambda: list(
+                Submission.objects.filter(student=student, question__lecture=lecture).select_related('question')
+            ),
+            'lecture_submissions': lambda: list(lecture_submission_stats(lecture).order_by('-accuracy')[:50]),
+        }
+
+    def run_cases(self, cases, options):
+        medians = {}
+        for name, run in cases.items():
+            run()  # 暖身
+            samples = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                run()
+                samples.append((time.perf_counter() - started) * 1000)
+            medians[name] = statistics.median(samples)
+            self.stdout.write(f"⏱ {name:<22} 中位數 {medians[name]:8.2f} ms  p95 {sorted(samples)[int(len(samples) * 0.95) - 1]:8.2f} ms")
+            if options['explain']:
+                self.explain(name, cases)
+        return medians
+
+    def explain(self, name, cases):
+        queries = self.capture(cases[name])
+        for sql, params in queries:
+            with connection.cursor() as cursor:
+                prefix = "EXPLAIN QUERY PLAN " if connection.vendor == 'sqlite' else "EXPLAIN "
+                cursor.execute(prefix + sql, params)
+                for row in cursor.fetchall():
+                    self.stdout.write(f"    {row}")
+
+    def capture(self, run):
+        captured = []
+
+        def wrapper(execute, sql, params, many, context):
+            captured.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(wrapper):
+            run()
+        return captured
+
+    @contextmanager
+    def indexes_removed(self):
+        self.toggle_indexes(remove=True)
+        try:
+            yield
+        finally:
+            self.toggle_indexes(remove=False)
+
+    def toggle_indexes(self, remove):
+        with connection.schema_editor() as editor:
+            for model in (Submission, Lecture):
+                for index in model._meta.indexes:
+                    if remove:
+                        editor.remove_index(model, index)
+                    else:
+                        editor.add_index(model, index)
+
+    def seed(self, options):
+        rng = random.Random(42)
+        batch = options['batch_size']
+        self.stdout.write("🌱 產生測試資料中…")
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            course = Course.objects.create(name=BENCH_COURSE_NAME)
+            Lecture.objects.bulk_create([
+                Lecture(course=course, title=f"benchmark-{i}") for i in range(options['lectures'])
+            ])
+            lectures = list(Lecture.objects.filter(course=course))
+            Question.objects.bulk_create([
+                Question(lecture=lec, question_text=f"Q{lec.id}-{j}", correct_answer="A",
+                         explanation="", concept=f"concept-{j % 7}")
+                for lec in lectures for j in range(options['questions'])
+            ], batch_size=batch)
+            Student.objects.bulk_create([
+                Student(name=f"bench{i}", email=f"bench{i}-{course.id}@example.com")
+                for i in range(options['students'])
+            ], batch_size=batch)
+
+        question_ids = list(Question.objects.filter(lecture__course=course).values_list('id', flat=True))
+        student_ids = list(
+            Student.objects.filter(email__endswith=f"-{course.id}@example.com").values_list('id', flat=True)
+        )
+
+        pending = []
+        created = 0
+        for student_id in student_ids:
+            for question_id in question_ids:
+                correct = rng.random() < 0.7
+                pending.append(Submission(
+                    student_id=student_id, question_id=question_id,
+                    student_answer="A" if correct else "B", is_correct=correct,
+                ))
+                if len(pending) >= batch:
+                    Submission.objects.bulk_create(pending)
+                    created += len(pending)
+                    pending = []
+        if pending:
+            Submission.objects.bulk_create(pending)
+            created += len(pending)
+        rebuild_student_lecture_stats(student_ids)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")  # 更新統計資訊，讓查詢計畫反映實際資料量
+        self.stdout.write(f"✅ 已建立 {created} 筆作答（{time.perf_counter() - started:.1f}s）")
+        return course
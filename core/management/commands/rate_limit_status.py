@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core.rate_limit import RATE_LIMITS, DatabaseBucketStore, get_bucket_store, utilization
+
+
+def percent(value):
+    return "—" if value is None else f"{value * 100:5.1f}%"
+
+
+class Command(BaseCommand):
+    help = "顯示各模型目前的速率額度使用率（RATE_LIMITS 設定的每分鐘請求數／tokens）"
+
+    def handle(self, *args, **options):
+        if not RATE_LIMITS:
+            self.stdout.write("⚠️ 未設定 RATE_LIMITS，所有模型皆不限速")
+            return
+        store = "資料庫" if isinstance(get_bucket_store(), DatabaseBucketStore) else "快取"
+        self.stdout.write(f"🗄 額度存放於{store}")
+        for model, row in utilization().items():
+            self.stdout.write(
+                f"📊 {model:<12} 請求 {percent(row['requests_used'])} (上限 {row['rpm_limit']}/分)  "
+                f"tokens {percent(row['tokens_used'])} (上限 {row['tpm_limit']}/分)  "
+                f"新請求需等待 {row['queue_seconds']:.1f} 秒"
+            )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Lecture
+from core.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "重新建立講次標題 / 摘要 / 逐字稿的全文檢索索引"
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild(Lecture.objects.all().iterator())
+        self.stdout.write(self.style.SUCCESS(f"✅ 已使用 {backend.__class__.__name__} 重建索引"))
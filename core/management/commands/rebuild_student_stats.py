@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.rollups import rebuild_student_lecture_stats
+
+
+class Command(BaseCommand):
+    help = "由作答紀錄重新計算每位學生每個講次的統計（StudentLectureStats）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--student', type=int, action='append', dest='students', help='只重建指定學生 id，可重複指定')
+
+    def handle(self, *args, **options):
+        count = rebuild_student_lecture_stats(options['students'])
+        self.stdout.write(self.style.SUCCESS(f"✅ 已重建 {count} 筆講次統計"))
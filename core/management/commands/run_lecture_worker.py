@@ -0,0 +1,50 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import run_worker
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """App Engine（/_ah/start、/_ah/health）與 Cloud Run 需要 worker 也回應 HTTP，一律回 200"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_health_server(port):
+    server = ThreadingHTTPServer(("0.0.0.0", port), HealthHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = "背景執行直播段落轉錄與講次 AI 處理工作（語音轉錄、摘要、出題）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='處理完目前佇列後結束')
+        parser.add_argument('--poll', type=float, default=None, help='佇列為空時的輪詢秒數')
+        parser.add_argument('--max-jobs', type=int, default=None, help='處理指定數量的工作後結束')
+        parser.add_argument(
+            '--health-port', type=int, default=int(os.getenv('PORT', 0)),
+            help='在此 port 回應健康檢查（預設取 $PORT，App Engine / Cloud Run 會設定；0 表示不開）',
+        )
+
+    def handle(self, *args, **options):
+        if options['health_port']:
+            start_health_server(options['health_port'])
+            self.stdout.write(f"🩺 健康檢查：0.0.0.0:{options['health_port']}")
+        processed = run_worker(
+            once=options['once'],
+            poll_seconds=options['poll'],
+            stop_after=options['max_jobs'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"✅ 共處理 {processed} 筆工作"))
@@ -0,0 +1,299 @@
+import contextvars
+import hmac
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.dispatch import receiver
+
+from .cache_utils import LazyStore, select_store
+
+# 計數存放處：cache（需在 settings.CACHES 設定共用後端，例如 REDIS_URL）/ db / auto（有共用快取用 cache，否則 db）
+METRICS_BACKEND = os.getenv("METRICS_BACKEND", "auto")
+METRICS_CACHE_ALIAS = os.getenv("METRICS_CACHE_ALIAS", "default")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+PREFIX = "metrics"
+VIEWS_KEY = f"{PREFIX}:views"
+UNMATCHED_VIEW = "unmatched"
+
+# (名稱, 說明, bucket 上界)；秒數以微秒整數累加，cache.incr 在 Redis 上只接受整數
+HISTOGRAMS = [
+    ("django_http_request_duration_seconds", "每個請求的處理時間（秒）",
+     (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    ("django_db_queries_per_request", "每個請求執行的 SQL 數量",
+     (0, 1, 2, 5, 10, 20, 50, 100, 200)),
+    ("django_db_duration_seconds_per_request", "每個請求花在 SQL 的時間（秒）",
+     (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)),
+]
+SECONDS_METRICS = {"django_http_request_duration_seconds", "django_db_duration_seconds_per_request"}
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+def count_query(execute, sql, params, many, context):
+    """掛在每條資料庫連線上的 execute wrapper；只有在請求中（由 middleware 設定）才計數"""
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    # 以 contextvar 區分請求：async view 透過 sync_to_async 在別的執行緒查詢也能算到
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def metric_key(name, view, suffix):
+    return f"{PREFIX}:{name}:{view}:{suffix}"
+
+
+def observed_amount(name, value):
+    return int(value * 1_000_000) if name in SECONDS_METRICS else int(value)
+
+
+class CacheMetricStore:
+    """存在 Django 快取（Redis 等共用後端）"""
+
+    def __init__(self, alias=METRICS_CACHE_ALIAS):
+        self.cache = caches[alias]
+
+    def add(self, pending, views):
+        known = set(self.cache.get(VIEWS_KEY) or ())
+        if not views <= known:
+            # 同時寫入可能互相覆蓋，但每次 flush 都會再檢查補上
+            self.cache.set(VIEWS_KEY, sorted(known | views), None)
+        for key, delta in pending.items():
+            try:
+                self.cache.incr(key, delta)
+            except ValueError:
+                if not self.cache.add(key, delta, None):
+                    self.cache.incr(key, delta)
+
+    def load(self):
+        """回傳 (views, {key: value})"""
+        views = self.cache.get(VIEWS_KEY) or []
+        keys = []
+        for view in views:
+            for name, _, buckets in HISTOGRAMS:
+                keys.extend(metric_key(name, view, i) for i in range(len(buckets) + 1))
+                keys.append(metric_key(name, view, "sum"))
+            keys.extend(metric_key("django_http_responses_total", view, s) for s in STATUS_CLASSES)
+        return views, (self.cache.get_many(keys) if keys else {})
+
+
+class DatabaseMetricStore:
+    """存在資料庫：沒有共用快取時，/metrics 仍能彙總所有 worker"""
+
+    def add(self, pending, views):
+        from .models import MetricCounter
+
+        with transaction.atomic():
+            for key, delta in pending.items():
+                if MetricCounter.objects.filter(key=key).update(value=F("value") + delta):
+                    continue
+                try:
+                    with transaction.atomic():
+                        MetricCounter.objects.create(key=key, value=delta)
+                except IntegrityError:
+                    # 另一個 worker 同時建立
+                    MetricCounter.objects.filter(key=key).update(value=F("value") + delta)
+
+    def load(self):
+        from .models import MetricCounter
+
+        values = dict(MetricCounter.objects.filter(key__startswith=f"{PREFIX}:").values_list("key", "value"))
+        names = [name for name, _, _ in HISTOGRAMS] + ["django_http_responses_total"]
+        views = set()
+        for key in values:
+            for name in names:
+                head = f"{PREFIX}:{name}:"
+                if key.startswith(head):
+                    # URL name 可能含冒號（namespace），suffix 一定是最後一段
+                    views.add(key[len(head):].rpartition(":")[0])
+                    break
+        return sorted(views), values
+
+
+def create_metric_store():
+    return select_store(
+        METRICS_BACKEND, METRICS_CACHE_ALIAS, CacheMetricStore, DatabaseMetricStore,
+        "⚠️ METRICS_BACKEND=cache 但快取不是共用後端，/metrics 只會看到處理該次請求的 worker",
+    )
+
+
+_store = LazyStore(create_metric_store)
+
+
+def get_metric_store():
+    return _store.get()
+
+
+def set_metric_store(store):
+    """替換計數存放處（測試用）"""
+    _store.set(store)
+
+
+class MetricsBuffer:
+    """先在 process 內累加，每隔 METRICS_FLUSH_SECONDS 一次寫進共用儲存，避免每個請求都打一輪 Redis／資料庫"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = defaultdict(int)
+        self.views = set()
+        self.flushed_at = time.monotonic()
+
+    def observe(self, view, status, seconds, queries, db_seconds):
+        """累加一個請求，回傳是否該 flush 了（由呼叫端決定在哪個執行緒寫入）"""
+        status_class = f"{min(max(status // 100, 1), 5)}xx"
+        with self.lock:
+            self.views.add(view)
+            for (name, _, buckets), value in zip(HISTOGRAMS, (seconds, queries, db_seconds)):
+                self.pending[metric_key(name, view, bisect_left(buckets, value))] += 1
+                self.pending[metric_key(name, view, "sum")] += observed_amount(name, value)
+            self.pending[metric_key("django_http_responses_total", view, status_class)] += 1
+            return time.monotonic() - self.flushed_at >= METRICS_FLUSH_SECONDS
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(int)
+            views, self.views = self.views, set()
+            self.flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            get_metric_store().add(pending, views)
+        except Exception:
+            # 寫入失敗時放回去，下次 flush 再試
+            with self.lock:
+                for key, delta in pending.items():
+                    self.pending[key] += delta
+                self.views |= views
+            raise
+
+
+_buffer = MetricsBuffer()
+
+
+def view_label(request):
+    match = getattr(request, "resolver_match", None)
+    return (match.view_name if match else None) or UNMATCHED_VIEW
+
+
+class RequestMetricsMiddleware:
+    """記錄每個 URL name 的延遲、SQL 數量與 SQL 時間，供 /metrics 以 Prometheus 格式輸出"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        if self.observe(request, response, time.perf_counter() - started, stats):
+            self.flush()
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        if self.observe(request, response, time.perf_counter() - started, stats):
+            # 資料庫存放處不能在 event loop 上直接查詢
+            await sync_to_async(self.flush)()
+        return response
+
+    def observe(self, request, response, seconds, stats):
+        return _buffer.observe(view_label(request), response.status_code, seconds, stats.queries, stats.db_seconds)
+
+    def flush(self):
+        try:
+            _buffer.flush()
+        except Exception as e:
+            # 統計失敗（例如 Redis 暫時連不上）不能影響請求本身
+            print("⚠️ 請求統計寫入失敗：", e)
+
+
+def format_value(name, value):
+    if name in SECONDS_METRICS and isinstance(value, int):
+        return f"{value / 1_000_000:.6f}"
+    return str(value)
+
+
+def render_metrics():
+    """彙總共用儲存中的所有計數，輸出 Prometheus text format"""
+    _buffer.flush()
+    views, values = get_metric_store().load()
+
+    lines = []
+    for name, help_text, buckets in HISTOGRAMS:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for view in views:
+            counts = [values.get(metric_key(name, view, i), 0) for i in range(len(buckets) + 1)]
+            total = sum(counts)
+            if not total:
+                continue
+            label = f'view="{escape_label(view)}"'
+            cumulative = 0
+            for bound, count in zip(buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{label}}} {format_value(name, values.get(metric_key(name, view, 'sum'), 0))}")
+            lines.append(f"{name}_count{{{label}}} {total}")
+
+    name = "django_http_responses_total"
+    lines += [f"# HELP {name} 依狀態碼類別統計的回應數", f"# TYPE {name} counter"]
+    for view in views:
+        for status_class in STATUS_CLASSES:
+            count = values.get(metric_key(name, view, status_class), 0)
+            if count:
+                lines.append(f'{name}{{view="{escape_label(view)}",status="{status_class}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def metrics_authorized(request):
+    """設定 METRICS_TOKEN 時以 Bearer token 驗證；否則只開放給 staff 帳號"""
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}")
+    return request.user.is_authenticated and request.user.is_staff
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_alter_submission_student_answer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LectureJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('audio', '音檔轉錄 + 摘要 + 出題'), ('transcript', '逐字稿摘要 + 出題')], default='audio', max_length=20)),
+                ('status', models.CharField(choices=[('queued', '排隊中'), ('transcribing', '語音轉錄中'), ('summarizing', '摘要生成中'), ('generating', '出題中'), ('done', '完成'), ('failed', '失敗')], default='queued', max_length=20)),
+                ('num_mcq', models.PositiveIntegerField(default=3)),
+                ('num_tf', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='core.lecture')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='core_lectur_status_fb5109_idx')],
+            },
+        ),
+    ]
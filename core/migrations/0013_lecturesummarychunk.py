@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_lecturejob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lecturejob',
+            name='kind',
+            field=models.CharField(choices=[('audio', '音檔轉錄 + 摘要 + 出題'), ('transcript', '逐字稿摘要 + 出題'), ('partial', '直播段落摘要')], default='audio', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='LectureSummaryChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('start_offset', models.PositiveIntegerField()),
+                ('end_offset', models.PositiveIntegerField()),
+                ('digest', models.CharField(max_length=64)),
+                ('summary', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summary_chunks', to='core.lecture')),
+            ],
+            options={
+                'ordering': ['index'],
+                'constraints': [models.UniqueConstraint(fields=('lecture', 'index'), name='unique_lecture_summary_chunk')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:55
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_submissions(apps, schema_editor):
+    # 保留每位學生每題最早的一筆作答，才能加上唯一限制
+    Submission = apps.get_model('core', 'Submission')
+    duplicates = (
+        Submission.objects.values('student_id', 'question_id')
+        .annotate(first_id=Min('id'), n=Count('id'))
+        .filter(n__gt=1)
+    )
+    for dup in duplicates:
+        Submission.objects.filter(
+            student_id=dup['student_id'], question_id=dup['question_id']
+        ).exclude(id=dup['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_lecturesummarychunk'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_submissions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='submission',
+            constraint=models.UniqueConstraint(fields=('student', 'question'), name='unique_student_question_submission'),
+        ),
+    ]
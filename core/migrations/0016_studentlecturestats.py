@@ -0,0 +1,64 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:58
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def build_stats(apps, schema_editor):
+    # 邏輯與 core.rollups.compute_student_lecture_stats 相同，但不匯入應用程式碼，之後修改 rollups 也不影響這個 migration
+    Submission = apps.get_model('core', 'Submission')
+    StudentLectureStats = apps.get_model('core', 'StudentLectureStats')
+
+    concept_counts = defaultdict(dict)
+    wrong = (
+        Submission.objects.filter(is_correct=False)
+        .values('student_id', 'question__lecture_id', 'question__concept')
+        .annotate(n=Count('id'))
+    )
+    for row in wrong:
+        concept_counts[(row['student_id'], row['question__lecture_id'])][row['question__concept']] = row['n']
+
+    rows = (
+        Submission.objects.values('student_id', 'question__lecture_id')
+        .annotate(total=Count('id'), correct=Count('id', filter=Q(is_correct=True)), last=Max('submitted_at'))
+    )
+    StudentLectureStats.objects.bulk_create([
+        StudentLectureStats(
+            student_id=row['student_id'],
+            lecture_id=row['question__lecture_id'],
+            total=row['total'],
+            correct=row['correct'],
+            last_submitted_at=row['last'],
+            concept_wrong_counts=concept_counts.get((row['student_id'], row['question__lecture_id']), {}),
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_submission_lecture_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentLectureStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('last_submitted_at', models.DateTimeField(blank=True, null=True)),
+                ('concept_wrong_counts', models.JSONField(blank=True, default=dict)),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='student_stats', to='core.lecture')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lecture_stats', to='core.student')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('student', 'lecture'), name='unique_student_lecture_stats')],
+            },
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
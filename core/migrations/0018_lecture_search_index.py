@@ -0,0 +1,62 @@
+import re
+
+from django.db import migrations
+
+# 以下與 core/search.py 當時的內容相同，寫死在這裡：之後修改斷詞方式不會改變這個 migration 的行為
+FTS_TABLE = 'core_lecture_fts'
+TOKEN_RE = re.compile(r'[㐀-鿿豈-﫿]+|[0-9A-Za-zÀ-ɏ]+')
+CJK_RE = re.compile(r'[㐀-鿿豈-﫿]')
+
+
+def cjk_tokenize(text):
+    tokens = []
+    for match in TOKEN_RE.finditer(text or ''):
+        word = match.group()
+        if CJK_RE.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word.lower())
+    return ' '.join(tokens)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    Lecture = apps.get_model('core', 'Lecture')
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                "USING fts5(title, summary, transcript, tokenize='unicode61')"
+            )
+            for lecture in Lecture.objects.all().iterator():
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE} (rowid, title, summary, transcript) VALUES (%s, %s, %s, %s)",
+                    [lecture.id, cjk_tokenize(lecture.title), cjk_tokenize(lecture.summary), cjk_tokenize(lecture.transcript)],
+                )
+    elif connection.vendor == 'mysql':
+        schema_editor.execute(
+            "ALTER TABLE core_lecture ADD FULLTEXT INDEX lecture_fulltext_idx "
+            "(title, summary, transcript) WITH PARSER ngram"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == 'mysql':
+        schema_editor.execute("ALTER TABLE core_lecture DROP INDEX lecture_fulltext_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_submission_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
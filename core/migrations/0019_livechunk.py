@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_lecture_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=64)),
+                ('seq', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('pending', '轉錄中'), ('done', '完成'), ('failed', '失敗')], default='pending', max_length=10)),
+                ('text', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('transcribed_at', models.DateTimeField(blank=True, null=True)),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='live_chunks', to='core.lecture')),
+            ],
+            options={
+                'ordering': ['id'],
+                'constraints': [models.UniqueConstraint(fields=('lecture', 'session_id', 'seq'), name='unique_live_chunk_seq')],
+            },
+        ),
+    ]
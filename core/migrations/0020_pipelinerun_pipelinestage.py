@@ -0,0 +1,68 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_livechunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('audio', '音檔轉錄 + 摘要 + 出題'), ('transcript', '逐字稿摘要 + 出題'), ('partial', '直播段落摘要')], default='audio', max_length=20)),
+                ('attempt', models.PositiveIntegerField(default=1)),
+                ('status', models.CharField(choices=[('running', '執行中'), ('done', '完成'), ('failed', '失敗')], default='running', max_length=10)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('wall_seconds', models.FloatField(default=0)),
+                ('api_seconds', models.FloatField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('retries', models.PositiveIntegerField(default=0)),
+                ('audio_seconds', models.FloatField(default=0)),
+                ('cost_usd', models.FloatField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='runs', to='core.lecturejob')),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pipeline_runs', to='core.lecture')),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PipelineStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+                ('started_at', models.DateTimeField()),
+                ('wall_seconds', models.FloatField(default=0)),
+                ('api_calls', models.PositiveIntegerField(default=0)),
+                ('api_seconds', models.FloatField(default=0)),
+                ('wait_seconds', models.FloatField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('retries', models.PositiveIntegerField(default=0)),
+                ('audio_seconds', models.FloatField(default=0)),
+                ('cost_usd', models.FloatField(default=0)),
+                ('failed', models.BooleanField(default=False)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='core.pipelinerun')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pipelinerun',
+            index=models.Index(fields=['started_at'], name='core_pipeli_started_a40471_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pipelinestage',
+            index=models.Index(fields=['name', 'started_at'], name='core_pipeli_name_1aaacc_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_question_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, unique=True)),
+                ('requests', models.FloatField(null=True)),
+                ('tokens', models.FloatField(null=True)),
+                ('updated', models.FloatField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_metriccounter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lecturejob',
+            name='status',
+            field=models.CharField(choices=[('queued', '排隊中'), ('transcribing', '語音轉錄中'), ('summarizing', '摘要生成中'), ('generating', '出題中'), ('partial_summarizing', '段落摘要中'), ('done', '完成'), ('failed', '失敗')], default='queued', max_length=20),
+        ),
+    ]
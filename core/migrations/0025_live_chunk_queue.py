@@ -0,0 +1,48 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:45
+
+from django.db import migrations, models
+
+
+def fail_orphaned_chunks(apps, schema_editor):
+    # 舊版的待轉錄段落只存在已消失的暫存檔與執行緒中，標為失敗讓結束錄音時明確回報
+    LiveChunk = apps.get_model('core', 'LiveChunk')
+    LiveChunk.objects.filter(status='pending', audio='').update(status='failed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_lecturejob_partial_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='livechunk',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='livechunk',
+            name='audio',
+            field=models.FileField(blank=True, upload_to='live_chunks/'),
+        ),
+        migrations.AddField(
+            model_name='livechunk',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='livechunk',
+            name='status',
+            field=models.CharField(choices=[('pending', '排隊中'), ('transcribing', '轉錄中'), ('done', '完成'), ('failed', '失敗')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='livechunk',
+            index=models.Index(fields=['status', 'id'], name='live_chunk_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='livechunk',
+            index=models.Index(fields=['lecture', 'transcribed_at'], name='live_chunk_events_idx'),
+        ),
+        migrations.RunPython(fail_orphaned_chunks, migrations.RunPython.noop),
+    ]
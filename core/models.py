@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 class Course(models.Model):
     name = models.CharField(max_length=200)
@@ -18,6 +19,182 @@ class Lecture(models.Model):
     summary = models.TextField(blank=True)
     quiz_generated = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', 'date'], name='lecture_course_date_idx'),
+        ]
+
+class LectureJob(models.Model):
+    """講次 AI 處理工作佇列（由 run_lecture_worker 背景執行）"""
+    STATUS_CHOICES = [
+        ('queued', '排隊中'),
+        ('transcribing', '語音轉錄中'),
+        ('summarizing', '摘要生成中'),
+        ('generating', '出題中'),
+        ('partial_summarizing', '段落摘要中'),
+        ('done', '完成'),
+        ('failed', '失敗'),
+    ]
+    KIND_CHOICES = [
+        ('audio', '音檔轉錄 + 摘要 + 出題'),
+        ('transcript', '逐字稿摘要 + 出題'),
+        ('partial', '直播段落摘要'),
+    ]
+
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='audio')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    num_mcq = models.PositiveIntegerField(default=3)
+    num_tf = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    def __str__(self):
+        return f"Job #{self.id} ({self.get_status_display()}) - Lecture {self.lecture_id}"
+
+class LectureSummaryChunk(models.Model):
+    """直播錄音時逐段先做好的段落摘要，涵蓋 transcript[start_offset:end_offset]"""
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='summary_chunks')
+    index = models.PositiveIntegerField()
+    start_offset = models.PositiveIntegerField()
+    end_offset = models.PositiveIntegerField()
+    digest = models.CharField(max_length=64)
+    summary = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['lecture', 'index'], name='unique_lecture_summary_chunk'),
+        ]
+
+class LiveChunk(models.Model):
+    """直播錄音的單一音訊段落；同一次錄音（session_id）內以 seq 排序，結束時依序組成逐字稿
+
+    音檔先存進 storage，由 run_lecture_worker 以條件式 UPDATE 搶佔轉錄，web process 重啟也不會遺失。
+    """
+    STATUS_CHOICES = [
+        ('pending', '排隊中'),
+        ('transcribing', '轉錄中'),
+        ('done', '完成'),
+        ('failed', '失敗'),
+    ]
+
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='live_chunks')
+    session_id = models.CharField(max_length=64)
+    seq = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    audio = models.FileField(upload_to='live_chunks/', blank=True)  # 轉錄完成後刪除
+    attempts = models.PositiveIntegerField(default=0)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    text = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    transcribed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['lecture', 'session_id', 'seq'], name='unique_live_chunk_seq'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'id'], name='live_chunk_queue_idx'),
+            # SSE 依轉錄完成時間輪詢新段落
+            models.Index(fields=['lecture', 'transcribed_at'], name='live_chunk_events_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.lecture_id} / {self.session_id} #{self.seq} ({self.status})"
+
+class PipelineRun(models.Model):
+    """一次 AI 處理流程（一筆 LectureJob 的一次執行）的耗時、用量與成本，各階段明細見 PipelineStage"""
+    STATUS_CHOICES = [
+        ('running', '執行中'),
+        ('done', '完成'),
+        ('failed', '失敗'),
+    ]
+
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='pipeline_runs')
+    job = models.ForeignKey(LectureJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='runs')
+    kind = models.CharField(max_length=20, choices=LectureJob.KIND_CHOICES, default='audio')
+    attempt = models.PositiveIntegerField(default=1)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='running')
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    wall_seconds = models.FloatField(default=0)
+    api_seconds = models.FloatField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    retries = models.PositiveIntegerField(default=0)
+    audio_seconds = models.FloatField(default=0)
+    cost_usd = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['started_at']),
+        ]
+
+    def __str__(self):
+        return f"Run #{self.id} ({self.kind}, {self.status}) - Lecture {self.lecture_id}"
+
+class PipelineStage(models.Model):
+    """流程中的單一階段：轉錄、段落摘要、整合摘要、出題"""
+    run = models.ForeignKey(PipelineRun, on_delete=models.CASCADE, related_name='stages')
+    name = models.CharField(max_length=30)
+    started_at = models.DateTimeField()
+    wall_seconds = models.FloatField(default=0)
+    api_calls = models.PositiveIntegerField(default=0)
+    api_seconds = models.FloatField(default=0)
+    wait_seconds = models.FloatField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    retries = models.PositiveIntegerField(default=0)
+    audio_seconds = models.FloatField(default=0)
+    cost_usd = models.FloatField(default=0)
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['name', 'started_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.run_id} / {self.name} ({self.wall_seconds:.1f}s)"
+
+class RateLimitBucket(models.Model):
+    """模型 API 速率限制的 token bucket（沒有共用快取時存在資料庫，所有 worker 共用）"""
+    model = models.CharField(max_length=100, unique=True)
+    requests = models.FloatField(null=True)  # null 表示尚未使用（桶子是滿的）
+    tokens = models.FloatField(null=True)
+    updated = models.FloatField(default=0)  # time.time()
+
+    def __str__(self):
+        return self.model
+
+class MetricCounter(models.Model):
+    """/metrics 的計數器（沒有共用快取時存在資料庫，彙總所有 worker）"""
+    key = models.CharField(max_length=255, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
 class Question(models.Model):
     lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE)
     question_text = models.TextField()
@@ -36,6 +213,8 @@ class Question(models.Model):
         ],
         default='mcq'
     )
+    # 題目或答案被修改時更新，作答結果頁的 ETag 依此判斷是否過期
+    updated_at = models.DateTimeField(auto_now=True)
 
 class Student(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -49,6 +228,35 @@ class Submission(models.Model):
     is_correct = models.BooleanField()
     submitted_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # (student, question) 的唯一限制本身即提供該組合索引
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'question'], name='unique_student_question_submission'),
+        ]
+        indexes = [
+            models.Index(fields=['student', 'is_correct'], name='sub_student_correct_idx'),
+            models.Index(fields=['question', 'student'], name='sub_question_student_idx'),
+            models.Index(fields=['submitted_at', 'id'], name='sub_submitted_id_idx'),
+        ]
+
+class StudentLectureStats(models.Model):
+    """每位學生每個講次的作答統計（批改時累加，可用 rebuild_student_stats 重建）"""
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='lecture_stats')
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='student_stats')
+    total = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    last_submitted_at = models.DateTimeField(null=True, blank=True)
+    concept_wrong_counts = models.JSONField(default=dict, blank=True)  # {概念: 答錯次數}
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'lecture'], name='unique_student_lecture_stats'),
+        ]
+
+    @property
+    def accuracy(self):
+        return round(self.correct / self.total * 100, 2) if self.total > 0 else 0
+
 #class Profile(models.Model):
 #    user = models.OneToOneField(User, on_delete=models.CASCADE)
 #    role = models.CharField(max_length=10, choices=[('teacher', '老師'), ('student', '學生')])
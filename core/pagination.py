@@ -0,0 +1,50 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(submitted_at, pk):
+    raw = f"{submitted_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解析游標，格式錯誤時回傳 None（當成第一頁）"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(queryset, after=None, before=None, page_size=50):
+    """依 (submitted_at, id) 由新到舊的 keyset 分頁，不使用 OFFSET，翻到多深都是固定成本
+
+    回傳 (rows, next_cursor, prev_cursor)。
+    """
+    if before:
+        position = decode_cursor(before)
+        if position:
+            ts, pk = position
+            queryset = queryset.filter(Q(submitted_at__gt=ts) | Q(submitted_at=ts, id__gt=pk))
+        rows = list(queryset.order_by('submitted_at', 'id')[:page_size + 1])
+        has_newer = len(rows) > page_size
+        rows = list(reversed(rows[:page_size]))
+        has_older = position is not None
+    else:
+        position = decode_cursor(after)
+        if position:
+            ts, pk = position
+            queryset = queryset.filter(Q(submitted_at__lt=ts) | Q(submitted_at=ts, id__lt=pk))
+        rows = list(queryset.order_by('-submitted_at', '-id')[:page_size + 1])
+        has_older = len(rows) > page_size
+        rows = rows[:page_size]
+        has_newer = position is not None
+
+    next_cursor = encode_cursor(rows[-1].submitted_at, rows[-1].id) if rows and has_older else None
+    prev_cursor = encode_cursor(rows[0].submitted_at, rows[0].id) if rows and has_newer else None
+    return rows, next_cursor, prev_cursor
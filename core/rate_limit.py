@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+
+from .cache_utils import LazyStore, select_store
+from .chunking import count_tokens
+
+# 額度存放處：cache（需在 settings.CACHES 設定共用後端，例如 REDIS_URL）/ db / auto（有共用快取用 cache，否則 db）
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "auto")
+RATE_LIMIT_CACHE_ALIAS = os.getenv("RATE_LIMIT_CACHE_ALIAS", "default")
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", 300))
+# 沒有指定 max_tokens 時，預估回應會用掉的 tokens
+RATE_LIMIT_COMPLETION_TOKENS = int(os.getenv("RATE_LIMIT_COMPLETION_TOKENS", 800))
+LOCK_TIMEOUT_SECONDS = 5
+
+
+def parse_limits(spec):
+    """'gpt-4o=500:30000,whisper-1=50' → {model: (每分鐘請求數, 每分鐘 tokens)}；0 或省略表示不限制，* 套用到其他模型"""
+    limits = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        model, _, quota = item.partition("=")
+        rpm, _, tpm = quota.partition(":")
+        limits[model.strip()] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+
+RATE_LIMITS = parse_limits(os.getenv("RATE_LIMITS", ""))
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_limits(model):
+    rpm, tpm = RATE_LIMITS.get(model) or RATE_LIMITS.get("*") or (0, 0)
+    if not rpm and not tpm:
+        return None
+    return rpm, tpm
+
+
+def bucket_key(model):
+    return f"ratelimit:{model}"
+
+
+@contextmanager
+def bucket_lock(cache, key):
+    """以 cache.add 做跨 worker 的短暫互斥；持有者當掉時鎖會在 LOCK_TIMEOUT_SECONDS 後自動失效"""
+    lock_key, token = f"{key}:lock", uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_TIMEOUT_SECONDS
+    while not cache.add(lock_key, token, LOCK_TIMEOUT_SECONDS):
+        if time.monotonic() > deadline:
+            break
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+class CacheBucketStore:
+    """存在 Django 快取（Redis 等共用後端）"""
+
+    def __init__(self, alias=RATE_LIMIT_CACHE_ALIAS):
+        self.cache = caches[alias]
+
+    def read(self, model):
+        return self.cache.get(bucket_key(model))
+
+    def modify(self, model, change):
+        """在鎖內讀出狀態交給 change(state)，它回傳 (要寫回的狀態, 結果)"""
+        key = bucket_key(model)
+        with bucket_lock(self.cache, key):
+            state, result = change(self.cache.get(key))
+            self.cache.set(key, state, None)
+        return result
+
+
+class DatabaseBucketStore:
+    """存在資料庫：沒有共用快取時，仍讓所有 worker 共用同一份額度"""
+
+    def read(self, model):
+        from .models import RateLimitBucket
+
+        bucket = RateLimitBucket.objects.filter(model=model).first()
+        return self.state_of(bucket)
+
+    def state_of(self, bucket):
+        if bucket is None or bucket.requests is None:
+            return None
+        return {"requests": bucket.requests, "tokens": bucket.tokens, "updated": bucket.updated}
+
+    def modify(self, model, change):
+        from .models import RateLimitBucket
+
+        try:
+            RateLimitBucket.objects.get_or_create(model=model)
+        except IntegrityError:
+            pass  # 另一個 worker 同時建立
+        with transaction.atomic():
+            # 先對這一列做一次 UPDATE 取得寫入鎖（MySQL 鎖列、SQLite 鎖整個資料庫），讀出的狀態才不會被別人同時改掉
+            RateLimitBucket.objects.filter(model=model).update(model=model)
+            bucket = RateLimitBucket.objects.get(model=model)
+            state, result = change(self.state_of(bucket))
+            RateLimitBucket.objects.filter(model=model).update(**state)
+        return result
+
+
+def create_bucket_store():
+    return select_store(
+        RATE_LIMIT_BACKEND, RATE_LIMIT_CACHE_ALIAS, CacheBucketStore, DatabaseBucketStore,
+        "⚠️ RATE_LIMIT_BACKEND=cache 但快取不是共用後端，每個 worker 會各自計算額度（實際上限 = worker 數 × 設定值）",
+    )
+
+
+_store = LazyStore(create_bucket_store)
+
+
+def get_bucket_store():
+    return _store.get()
+
+
+def set_bucket_store(store):
+    """替換額度存放處（測試用）"""
+    _store.set(store)
+
+
+def refill(state, limits, now):
+    """依經過時間補充桶子，容量為一分鐘的配額；餘額可為負（代表已預約、正在排隊的額度）"""
+    rpm, tpm = limits
+    if state is None:
+        return {"requests": float(rpm), "tokens": float(tpm), "updated": now}
+    elapsed = max(0.0, now - state["updated"])
+    return {
+        "requests": min(rpm, state["requests"] + elapsed * rpm / 60),
+        "tokens": min(tpm, state["tokens"] + elapsed * tpm / 60),
+        "updated": now,
+    }
+
+
+def wait_seconds(state, limits, tokens):
+    """還要等多久，桶子裡才夠一個請求與 tokens 個 token"""
+    rpm, tpm = limits
+    waits = [0.0]
+    if rpm:
+        waits.append((1 - state["requests"]) * 60 / rpm)
+    if tpm:
+        waits.append((tokens - state["tokens"]) * 60 / tpm)
+    return max(waits)
+
+
+def acquire(model, tokens=0, max_wait=None):
+    """為一次 API 呼叫預約額度，不足時睡到輪到自己為止，回傳等待秒數
+
+    預約會直接從桶子扣除（可扣成負數），後來的呼叫端自然排在後面，
+    不需要輪詢；要等超過 max_wait 秒時不預約並丟出 RateLimitTimeout。
+    """
+    limits = get_limits(model)
+    if limits is None:
+        return 0.0
+    rpm, tpm = limits
+    if tpm:
+        # 單次超過整個桶子的容量永遠等不到，最多只算一分鐘的量
+        tokens = min(tokens, tpm)
+    max_wait = RATE_LIMIT_MAX_WAIT_SECONDS if max_wait is None else max_wait
+
+    def reserve(state):
+        state = refill(state, limits, time.time())
+        wait = wait_seconds(state, limits, tokens)
+        if wait > max_wait:
+            raise RateLimitTimeout(f"{model} 需等待 {wait:.1f} 秒，超過上限 {max_wait:g} 秒")
+        if rpm:
+            state["requests"] -= 1
+        if tpm:
+            state["tokens"] -= tokens
+        return state, wait
+
+    wait = get_bucket_store().modify(model, reserve)
+    record(model, wait)
+    if wait > 0:
+        print(f"⏳ {model} 達到速率上限，排隊等待 {wait:.1f} 秒")
+        time.sleep(wait)
+    return wait
+
+
+def reconcile(model, estimated, actual):
+    """呼叫完成後以實際用量修正預估的 tokens（多退少補）"""
+    limits = get_limits(model)
+    if limits is None or not limits[1] or actual is None:
+        return
+
+    def refund(state):
+        state = refill(state, limits, time.time())
+        state["tokens"] = min(limits[1], state["tokens"] + min(estimated, limits[1]) - actual)
+        return state, None
+
+    get_bucket_store().modify(model, refund)
+
+
+def estimate_chat_tokens(messages, max_tokens=None):
+    prompt = sum(count_tokens(m.get("content") or "") + 4 for m in messages)
+    return prompt + (max_tokens or RATE_LIMIT_COMPLETION_TOKENS)
+
+
+def record(model, wait):
+    with _stats_lock:
+        counter = _stats.setdefault(model, {"calls": 0, "waits": 0, "wait_seconds": 0.0})
+        counter["calls"] += 1
+        if wait > 0:
+            counter["waits"] += 1
+            counter["wait_seconds"] += wait
+
+
+def utilization():
+    """各模型目前的額度使用率（跨 worker 共用的桶子）與本 process 的等待統計"""
+    store = get_bucket_store()
+    now = time.time()
+    with _stats_lock:
+        stats = {model: dict(counter) for model, counter in _stats.items()}
+    report = {}
+    for model in sorted(set(RATE_LIMITS) | set(stats)):
+        limits = get_limits(model)
+        if limits is None or model == "*":
+            continue
+        rpm, tpm = limits
+        state = refill(store.read(model), limits, now)
+        report[model] = {
+            "rpm_limit": rpm,
+            "tpm_limit": tpm,
+            "requests_used": round(1 - state["requests"] / rpm, 3) if rpm else None,
+            "tokens_used": round(1 - state["tokens"] / tpm, 3) if tpm else None,
+            "queue_seconds": round(wait_seconds(state, limits, 0), 2),
+            **stats.get(model, {"calls": 0, "waits": 0, "wait_seconds": 0.0}),
+        }
+    return report
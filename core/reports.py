@@ -0,0 +1,123 @@
+import json
+from collections import Counter
+
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .analytics import student_concept_report
+from .models import Question, StudentLectureStats, Submission
+
+
+def student_totals(student):
+    """學生總作答數與答對數（由每講次統計表加總，與作答筆數無關）"""
+    totals = StudentLectureStats.objects.filter(student=student).aggregate(
+        total=Coalesce(Sum('total'), 0),
+        correct=Coalesce(Sum('correct'), 0),
+    )
+    total, correct = totals['total'], totals['correct']
+    return {
+        'total': total,
+        'correct': correct,
+        'wrong_count': total - correct,
+        'accuracy': round(correct / total * 100, 2) if total > 0 else 0,
+    }
+
+
+def submission_results(student_id, lecture):
+    """講次每一題搭配該學生的作答（未作答為 None），作答以一次查詢取出後用 dict 對應"""
+    answers = {
+        s.question_id: s
+        for s in Submission.objects.filter(student_id=student_id, question__lecture=lecture)
+    }
+    results = []
+    for question in Question.objects.filter(lecture=lecture).order_by('id'):
+        sub = answers.get(question.id)
+        results.append({
+            'question': question,
+            'student_answer': sub.student_answer if sub else None,
+            'is_correct': sub.is_correct if sub else None,
+        })
+    return results
+
+
+def lecture_accuracy_rows(student):
+    """各講次作答題數、答對數與正確率（讀取預先統計的 StudentLectureStats）"""
+    stats = (
+        StudentLectureStats.objects.filter(student=student, total__gt=0)
+        .select_related('lecture__course')
+        .order_by('lecture_id')
+    )
+    return [{
+        'lecture': row.lecture,
+        'total': row.total,
+        'correct': row.correct,
+        'accuracy': row.accuracy,
+    } for row in stats]
+
+
+def lecture_submission_stats(lecture):
+    """某講次每位有作答學生的題數、答對數與正確率
+
+    從 Submission 端依學生 GROUP BY，可走 (question, student) 索引，
+    不必掃描整張 Student 表；回傳 values() 列，學生物件再依分頁另外取。
+    """
+    return (
+        Submission.objects.filter(question__lecture=lecture)
+        .values('student_id', 'student__user__username')
+        .annotate(
+            total=Count('id'),
+            correct=Count('id', filter=Q(is_correct=True)),
+        )
+        .annotate(accuracy=ExpressionWrapper(F('correct') * 100.0 / F('total'), output_field=FloatField()))
+    )
+
+
+def top_wrong_questions(student, limit=5):
+    return (
+        Submission.objects.filter(student=student, is_correct=False)
+        .values('question__question_text')
+        .annotate(count=Count('id'))
+        .order_by('-count')[:limit]
+    )
+
+
+def weak_concepts(student, limit=5):
+    """最常答錯的概念：加總各講次統計列的 concept_wrong_counts，不必再對 Submission 做 GROUP BY"""
+    counts = Counter()
+    for row in StudentLectureStats.objects.filter(student=student).values_list('concept_wrong_counts', flat=True):
+        counts.update(row)
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return [{'concept': concept, 'count': count} for concept, count in ranked[:limit] if count]
+
+
+def learning_suggestion(accuracy, rows):
+    if accuracy >= 90:
+        return "表現非常優異，繼續保持！"
+    if accuracy >= 70:
+        return "表現良好，建議複習部分錯題章節以鞏固知識。"
+    if accuracy > 0:
+        if rows:
+            weakest = min(rows, key=lambda row: row['correct'] / row['total'])
+            return f"建議加強學習「{weakest['lecture'].title}」單元，錯題比例較高。"
+        return "請多練習錯誤率高的章節，加強理解。"
+    return "目前尚無作答紀錄，請先完成練習題。"
+
+
+def progress_report_context(student):
+    """progress_report.html 所需的完整內容，學生與教師檢視共用"""
+    totals = student_totals(student)
+    rows = lecture_accuracy_rows(student)
+    labels = [row['lecture'].title for row in rows]
+    data = [row['accuracy'] for row in rows]
+    concepts = student_concept_report(student)['concepts']
+
+    return {
+        'student': student,
+        **totals,
+        'wrong': top_wrong_questions(student),
+        'labels_json': json.dumps(labels, ensure_ascii=False),
+        'data_json': json.dumps(data),
+        'has_data': bool(labels and data),
+        'suggestion': learning_suggestion(totals['accuracy'], rows),
+        'concepts': concepts,
+    }
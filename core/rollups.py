@@ -0,0 +1,73 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .etags import invalidate_submission_etag
+from .models import StudentLectureStats, Submission
+
+
+def record_quiz_attempt(student, lecture, submissions):
+    """批改後累加該學生在此講次的統計；需在批改的同一個 transaction 內呼叫"""
+    total = len(submissions)
+    correct = sum(1 for s in submissions if s.is_correct)
+    wrong_concepts = Counter(s.question.concept for s in submissions if not s.is_correct)
+    last = max((s.submitted_at for s in submissions if s.submitted_at), default=None) or timezone.now()
+
+    stats, _ = StudentLectureStats.objects.select_for_update().get_or_create(student=student, lecture=lecture)
+    stats.total += total
+    stats.correct += correct
+    if stats.last_submitted_at is None or last > stats.last_submitted_at:
+        stats.last_submitted_at = last
+    counts = Counter(stats.concept_wrong_counts)
+    counts.update(wrong_concepts)
+    stats.concept_wrong_counts = dict(counts)
+    stats.save()
+    # 作答內容改變，解析頁的 ETag 需重新計算
+    transaction.on_commit(lambda: invalidate_submission_etag(student.id, lecture.id))
+    return stats
+
+
+def compute_student_lecture_stats(student_ids=None):
+    """由 Submission 以 GROUP BY 重新計算統計列"""
+    submissions = Submission.objects.all()
+    if student_ids is not None:
+        submissions = submissions.filter(student_id__in=student_ids)
+
+    concept_counts = defaultdict(dict)
+    wrong = (
+        submissions.filter(is_correct=False)
+        .values('student_id', 'question__lecture_id', 'question__concept')
+        .annotate(n=Count('id'))
+    )
+    for row in wrong:
+        concept_counts[(row['student_id'], row['question__lecture_id'])][row['question__concept']] = row['n']
+
+    rows = (
+        submissions.values('student_id', 'question__lecture_id')
+        .annotate(total=Count('id'), correct=Count('id', filter=Q(is_correct=True)), last=Max('submitted_at'))
+    )
+    return [
+        StudentLectureStats(
+            student_id=row['student_id'],
+            lecture_id=row['question__lecture_id'],
+            total=row['total'],
+            correct=row['correct'],
+            last_submitted_at=row['last'],
+            concept_wrong_counts=concept_counts.get((row['student_id'], row['question__lecture_id']), {}),
+        )
+        for row in rows
+    ]
+
+
+def rebuild_student_lecture_stats(student_ids=None, batch_size=1000):
+    """清空並重建統計表（可限定部分學生）"""
+    stats = compute_student_lecture_stats(student_ids)
+    with transaction.atomic():
+        existing = StudentLectureStats.objects.all()
+        if student_ids is not None:
+            existing = existing.filter(student_id__in=student_ids)
+        existing.delete()
+        StudentLectureStats.objects.bulk_create(stats, batch_size=batch_size)
+    return len(stats)
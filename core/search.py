@@ -0,0 +1,164 @@
+import re
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, When
+
+FTS_TABLE = 'core_lecture_fts'
+SEARCH_LIMIT = 500
+# 不超過這個長度的英數字關鍵字改用 icontains 做子字串比對
+SHORT_LATIN_TERM = 2
+
+# CJK 連續字元切成 bigram，英數字以單字為單位
+TOKEN_RE = re.compile(r'[㐀-鿿豈-﫿]+|[0-9A-Za-zÀ-ɏ]+')
+CJK_RE = re.compile(r'[㐀-鿿豈-﫿]')
+
+
+def cjk_tokenize(text):
+    """把中文切成相鄰兩字的 bigram（資料庫 → 資料 料庫），英文轉小寫，以空白串接"""
+    tokens = []
+    for match in TOKEN_RE.finditer(text or ''):
+        word = match.group()
+        if CJK_RE.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word.lower())
+    return ' '.join(tokens)
+
+
+def fts_query(query):
+    """每個關鍵字轉成一個 phrase（bigram 需相鄰），多個關鍵字以 AND 連接
+
+    以英數字結尾的關鍵字加上 * 做前綴比對（norm 找得到 normalization），與原本 icontains 的行為接近。
+    """
+    phrases = []
+    for term in query.split():
+        tokens = cjk_tokenize(term)
+        if tokens:
+            prefix = '*' if not CJK_RE.match(tokens.split()[-1]) else ''
+            phrases.append('"' + tokens.replace('"', '') + '"' + prefix)
+    return ' AND '.join(phrases)
+
+
+class LikeSearchBackend:
+    """沒有全文索引時的退回做法"""
+
+    def index(self, lecture):
+        pass
+
+    def remove(self, lecture_id):
+        pass
+
+    def rebuild(self, lectures):
+        pass
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        from .models import Lecture
+
+        q = Q()
+        for term in query.split():
+            q &= Q(title__icontains=term) | Q(summary__icontains=term) | Q(transcript__icontains=term)
+        return list(Lecture.objects.filter(q).order_by('-id').values_list('id', flat=True)[:limit])
+
+
+class SQLiteFTSBackend:
+    """SQLite FTS5：另存 bigram 斷詞後的文字，bm25 排序（標題 > 摘要 > 逐字稿）"""
+
+    def index(self, lecture):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [lecture.id])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, summary, transcript) VALUES (%s, %s, %s, %s)",
+                [lecture.id, cjk_tokenize(lecture.title), cjk_tokenize(lecture.summary), cjk_tokenize(lecture.transcript)],
+            )
+
+    def remove(self, lecture_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [lecture_id])
+
+    def rebuild(self, lectures):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        for lecture in lectures:
+            self.index(lecture)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        match = fts_query(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, 10.0, 5.0, 1.0) LIMIT %s",
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class MySQLFulltextBackend:
+    """MySQL FULLTEXT（ngram parser，由 MySQL 自行維護索引）"""
+
+    def index(self, lecture):
+        pass
+
+    def remove(self, lecture_id):
+        pass
+
+    def rebuild(self, lectures):
+        pass
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        terms = ' '.join(f'+"{t}"' for t in query.replace('"', '').split())
+        if not terms:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM core_lecture "
+                "WHERE MATCH(title, summary, transcript) AGAINST (%s IN BOOLEAN MODE) "
+                "ORDER BY MATCH(title, summary, transcript) AGAINST (%s IN BOOLEAN MODE) DESC LIMIT %s",
+                [terms, terms, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+_fts5_tables = {}
+
+
+def fts5_table_exists():
+    """FTS5 表是否存在；每個資料庫只查一次 sqlite_master（每次儲存講次都會呼叫）"""
+    key = (connection.alias, connection.settings_dict['NAME'])
+    if key not in _fts5_tables:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts5_tables[key] = cursor.fetchone() is not None
+    return _fts5_tables[key]
+
+
+def get_search_backend():
+    if connection.vendor == 'sqlite' and fts5_table_exists():
+        return SQLiteFTSBackend()
+    if connection.vendor == 'mysql':
+        return MySQLFulltextBackend()
+    return LikeSearchBackend()
+
+
+def too_short_for_bigrams(query):
+    """單一中文字組不成 bigram；兩個字元以下的英數字（例如 B、tr）在單字中間出現的情況全文索引找不到"""
+    return any(
+        (len(term) == 1 and CJK_RE.match(term)) or (len(term) <= SHORT_LATIN_TERM and not CJK_RE.match(term))
+        for term in TOKEN_RE.findall(query)
+    )
+
+
+def search_lectures(queryset, query):
+    """依全文檢索相關度排序講次；單一中文字或很短的英數字退回 icontains"""
+    backend = get_search_backend()
+    if isinstance(backend, SQLiteFTSBackend) and (too_short_for_bigrams(query) or not fts_query(query)):
+        backend = LikeSearchBackend()
+    ids = backend.search(query)
+    if not ids:
+        return queryset.none()
+    ranking = Case(*[When(id=pk, then=pos) for pos, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(id__in=ids).annotate(search_rank=ranking).order_by('search_rank')
@@ -41,3 +41,21 @@ def create_profile_and_student(sender, instance, created, **kwargs):
 
         # 自動建立 Student
         Student.objects.create(user=instance, name=instance.username, email=instance.email)
+
+
+from django.db.models.signals import post_delete
+from .models import Lecture
+from .search import get_search_backend
+
+SEARCH_FIELDS = {'title', 'summary', 'transcript'}
+
+@receiver(post_save, sender=Lecture)
+def index_lecture_for_search(sender, instance, update_fields=None, **kwargs):
+    # 只有標題 / 摘要 / 逐字稿有變動時才重新建立索引
+    if update_fields is not None and not SEARCH_FIELDS & set(update_fields):
+        return
+    get_search_backend().index(instance)
+
+@receiver(post_delete, sender=Lecture)
+def remove_lecture_from_search(sender, instance, **kwargs):
+    get_search_backend().remove(instance.id)
@@ -1,3 +1,1352 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .ai_cache import (
+    DjangoCacheBackend, NullCacheBackend, SQLiteCacheBackend, cached_chat_completion, chat_cache_key, get_cache_backend,
+    set_cache_backend,
+)
+from .ai_modules import generate_quiz, get_openai_client, reset_openai_clients, summarize_ready_chunks
+from .chunking import count_tokens, token_chunks
+from . import ai_modules, ledger, local_whisper, metrics, rate_limit
+from .audio_ingest import TEMP_PREFIX, ingest_audio, sweep_temp_audio
+from .audio_utils import detect_silence, load_audio, plan_audio_segments, stitch_transcripts
+from .jobs import (
+    claim_next_job, enqueue_lecture_job, enqueue_lecture_job_once, job_status_payload, run_job, run_worker,
+)
+from .ledger import StageMeter, percentile
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .rollups import rebuild_student_lecture_stats, record_quiz_attempt
+from .search import SQLiteFTSBackend, get_search_backend
+from .live import (
+    LIVE_CHUNK_MAX_ATTEMPTS, claim_next_chunk, keep_legacy_transcript, live_transcript, pending_chunks,
+    requeue_stale_chunks, transcribe_chunk, transcript_events,
+)
+from .models import (
+    Course, Lecture, LectureJob, LectureSummaryChunk, LiveChunk, PipelineRun, Profile, Question, RateLimitBucket,
+    Student, StudentLectureStats, Submission,
+)
+
+
+def make_lectures(course, count):
+    lectures = []
+    for i in range(count):
+        lecture = Lecture.objects.create(course=course, title=f"單元 {i}", summary="摘要")
+        Question.objects.create(
+            lecture=lecture,
+            question_text=f"題目 {i}",
+            option_a="A", option_b="B", option_c="C", option_d="D",
+            correct_answer="A",
+            explanation="說明",
+        )
+        lectures.append(lecture)
+    return lectures
+
+
+class LectureJobQueueTests(TestCase):
+    def setUp(self):
+        self.lecture = Lecture.objects.create(course=Course.objects.create(name="資料庫系統"), title="正規化")
+
+    def test_conditional_update_lets_only_one_worker_claim_a_job(self):
+        first = enqueue_lecture_job(self.lecture, kind='transcript')
+        second = enqueue_lecture_job(self.lecture, kind='transcript')
+        stolen = []
+
+        def w1_claims_first(execute, sql, params, many, context):
+            # w2 已讀到候選清單、正要 UPDATE 時，w1 搶先拿走第一筆
+            if sql.startswith("UPDATE") and "w2" in (params or ()) and not stolen:
+                stolen.append(claim_next_job("w1"))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(w1_claims_first):
+            claimed = claim_next_job("w2")
+        self.assertEqual(stolen[0].id, first.id)
+        self.assertEqual(claimed.id, second.id)
+        self.assertEqual(LectureJob.objects.get(id=first.id).locked_by, "w1")
+        self.assertEqual(claimed.status, 'summarizing')
+        self.assertIsNone(claim_next_job("w3"))
+
+    @patch("core.ai_modules.process_transcript_and_generate_quiz", side_effect=RuntimeError("API 逾時"))
+    def test_failures_back_off_then_give_up_after_max_attempts(self, _):
+        job = enqueue_lecture_job(self.lecture, kind='transcript')
+        delays = []
+        for _ in range(job.max_attempts):
+            started = timezone.now()
+            job = run_job(job)
+            delays.append(round((job.run_after - started).total_seconds()))
+        self.assertEqual(delays[:2], [30, 60])
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 3)
+
+        payload = job_status_payload(self.lecture)
+        self.assertEqual(payload['status'], 'failed')
+        self.assertTrue(payload['finished'])
+        self.assertEqual(payload['error'], "RuntimeError: API 逾時")
+
+    @patch("core.ai_modules.process_transcript_and_generate_quiz", side_effect=[False, True])
+    def test_retry_succeeds_and_payload_ignores_partial_jobs(self, _):
+        self.assertEqual(job_status_payload(self.lecture)['status'], 'unknown')
+        job = run_job(enqueue_lecture_job(self.lecture, kind='transcript'))
+        self.assertEqual((job.status, job.last_error), ('queued', "JobFailed: AI 處理流程沒有產生結果"))
+        self.assertIsNone(claim_next_job("w1"))  # 退避時間還沒到
+
+        LectureJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        job = run_job(claim_next_job("w1"))
+        self.assertEqual(job.status, 'done')
+        enqueue_lecture_job(self.lecture, kind='partial', num_mcq=0)
+        payload = job_status_payload(self.lecture)
+        self.assertEqual((payload['status'], payload['attempts'], payload['finished']), ('done', 2, True))
+        self.assertTrue(Lecture.objects.get(id=self.lecture.id).quiz_generated)
+
+
+class LectureListQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("student1", "student1@example.com", "pass1234")
+        self.student = Student.objects.get(user=self.user)
+        self.course = Course.objects.create(name="資料庫系統")
+        self.client.force_login(self.user)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('lecture_list'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_query_count_does_not_grow_with_lectures(self):
+        lectures = make_lectures(self.course, 3)
+        Submission.objects.create(
+            student=self.student,
+            question=lectures[0].question_set.first(),
+            student_answer="A",
+            is_correct=True,
+        )
+        few, _ = self.count_queries()
+
+        make_lectures(self.course, 40)
+        many, response = self.count_queries()
+
+        self.assertEqual(few, many)
+        self.assertTrue(all(lec.is_ready for lec in response.context['page_obj']))
+
+    def test_answered_ids_limited_to_visible_page(self):
+        lectures = make_lectures(self.course, 8)
+        for lec in lectures:
+            Submission.objects.create(
+                student=self.student,
+                question=lec.question_set.first(),
+                student_answer="A",
+                is_correct=True,
+            )
+        _, response = self.count_queries()
+        visible = {lec.id for lec in response.context['page_obj']}
+        self.assertEqual(response.context['answered_lecture_ids'], visible)
+
+
+class LectureSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("student2", "student2@example.com", "pass1234")
+        self.client.force_login(self.user)
+        course = Course.objects.create(name="資料庫系統")
+        self.index_lecture = Lecture.objects.create(course=course, title="索引與查詢最佳化", summary="B+ tree")
+        self.normal_lecture = Lecture.objects.create(
+            course=course, title="正規化", summary="第三正規化", transcript="順帶一提，索引之後再講"
+        )
+        Lecture.objects.create(course=course, title="交易", summary="ACID")
+
+    def search(self, q):
+        response = self.client.get(reverse('lecture_list'), {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [lec.id for lec in response.context['page_obj']]
+
+    def test_title_match_ranks_above_transcript_match(self):
+        self.assertEqual(self.search("索引"), [self.index_lecture.id, self.normal_lecture.id])
+
+    def test_reindexes_when_summary_changes(self):
+        self.assertEqual(self.search("鎖定"), [])
+        self.normal_lecture.summary = "兩階段鎖定"
+        self.normal_lecture.save(update_fields=['summary'])
+        self.assertEqual(self.search("鎖定"), [self.normal_lecture.id])
+
+    def test_deleted_lecture_leaves_index(self):
+        self.index_lecture.delete()
+        self.assertEqual(self.search("索引"), [self.normal_lecture.id])
+
+    def test_single_character_and_latin_queries(self):
+        self.assertEqual(self.search("交"), [Lecture.objects.get(title="交易").id])
+        self.assertEqual(self.search("acid"), [Lecture.objects.get(title="交易").id])
+
+    def test_latin_prefix_and_short_substring_queries(self):
+        self.normal_lecture.transcript = "Normalization removes redundancy"
+        self.normal_lecture.save(update_fields=['transcript'])
+        # 前綴比對走全文索引；兩個字元以下的子字串退回 icontains
+        self.assertEqual(self.search("norm"), [self.normal_lecture.id])
+        self.assertEqual(self.search("tr"), [self.index_lecture.id])
+        # 三個字元以上、出現在單字中間的子字串不再比對得到（已知的行為改變）
+        self.assertEqual(self.search("mali"), [])
+
+    def test_backend_lookup_is_cached_per_database(self):
+        get_search_backend()
+        with self.assertNumQueries(0):
+            self.assertIsInstance(get_search_backend(), SQLiteFTSBackend)
+
+
+class SubmissionListTests(TestCase):
+    def setUp(self):
+        self.student = Student.objects.get(user=User.objects.create_user("student5", "s5@example.com", "pass1234"))
+        lectures = make_lectures(Course.objects.create(name="資料庫系統"), 7)
+        # 前四筆同一時間，測試 submitted_at 相同時以 id 決定順序
+        base = timezone.now()
+        for i, lecture in enumerate(lectures):
+            submission = Submission.objects.create(
+                student=self.student, question=lecture.question_set.first(), student_answer="A", is_correct=True,
+            )
+            Submission.objects.filter(id=submission.id).update(submitted_at=base - timedelta(minutes=max(i - 3, 0)))
+        self.expected = list(Submission.objects.order_by('-submitted_at', '-id').values_list('id', flat=True))
+
+    def ids(self, rows):
+        return [row.id for row in rows]
+
+    def test_keyset_pages_forward_and_back_without_gaps(self):
+        queryset = Submission.objects.all()
+        first, next_cursor, prev_cursor = keyset_page(queryset, page_size=3)
+        self.assertIsNone(prev_cursor)
+        second, next_cursor2, prev_cursor2 = keyset_page(queryset, after=next_cursor, page_size=3)
+        last, next_cursor3, prev_cursor3 = keyset_page(queryset, after=next_cursor2, page_size=3)
+        self.assertEqual(self.ids(first + second + last), self.expected)
+        # 最後一頁沒有下一頁
+        self.assertEqual(len(last), 1)
+        self.assertIsNone(next_cursor3)
+
+        # 往回翻得到同一頁
+        back, _, _ = keyset_page(queryset, before=prev_cursor3, page_size=3)
+        self.assertEqual(self.ids(back), self.ids(second))
+        back, _, prev_cursor = keyset_page(queryset, before=prev_cursor2, page_size=3)
+        self.assertEqual(self.ids(back), self.ids(first))
+        self.assertIsNone(prev_cursor)
+
+    def test_cursor_round_trip_and_bad_cursor(self):
+        submitted_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(submitted_at, 42)), (submitted_at, 42))
+        self.assertIsNone(decode_cursor("not-a-cursor"))
+        rows, _, _ = keyset_page(Submission.objects.all(), after="not-a-cursor", page_size=3)
+        self.assertEqual(self.ids(rows), self.expected[:3])
+
+    async def test_csv_export_streams_asynchronously_under_asgi(self):
+        user = await User.objects.acreate(username="teacher2")
+        await Profile.objects.filter(user=user).aupdate(role='teacher')
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.get(reverse('export_submissions_csv'))
+        self.assertTrue(response.is_async)
+        body = "".join([chunk.decode() async for chunk in response.streaming_content])
+        lines = body.strip().splitlines()
+        self.assertTrue(lines[0].startswith("\ufeffid,"))
+        self.assertEqual([int(line.split(",")[0]) for line in lines[1:]], self.expected)
+
+
+class SubmissionReportTests(TestCase):
+    def setUp(self):
+        self.course = Course.objects.create(name="資料庫系統")
+        self.lecture = make_lectures(self.course, 1)[0]
+        for i in range(3):
+            Question.objects.create(lecture=self.lecture, question_text=f"追加題 {i}", correct_answer="A",
+                                    explanation="說明")
+        self.questions = list(self.lecture.question_set.order_by('id'))
+        self.add_students(0, 55)
+        self.client.force_login(User.objects.get(username="s00"))
+
+    def add_students(self, start, stop):
+        """第 i 位學生作答前 i % 4 + 1 題，其中前 i % 3 題答對"""
+        submissions = []
+        for i in range(start, stop):
+            user = User.objects.create(username=f"s{i:02d}", email=f"s{i:02d}@example.com")
+            student = Student.objects.get(user=user)
+            for n, question in enumerate(self.questions[:i % 4 + 1]):
+                correct = n < i % 3
+                submissions.append(Submission(student=student, question=question,
+                                              student_answer="A" if correct else "B", is_correct=correct))
+        Submission.objects.bulk_create(submissions)
+
+    def per_student_loop(self):
+        """改寫前的做法：逐一學生查詢作答"""
+        expected = {}
+        for student in Student.objects.select_related('user'):
+            subs = Submission.objects.filter(student=student, question__lecture=self.lecture)
+            total = subs.count()
+            if total:
+                correct = subs.filter(is_correct=True).count()
+                expected[student.user.username] = (total, correct, round(correct / total * 100, 2))
+        return expected
+
+    def lecture_rows(self, **params):
+        response = self.client.get(reverse('lecture_submissions', args=[self.lecture.id]), params)
+        return response, [
+            (row['student'].user.username, row['total'], row['correct'], row['accuracy'])
+            for row in response.context['students_data']
+        ]
+
+    def test_lecture_aggregates_match_per_student_loop(self):
+        first, rows = self.lecture_rows()
+        second, more = self.lecture_rows(page=2)
+        self.assertEqual((first.context['page_obj'].paginator.num_pages, len(rows), len(more)), (2, 50, 5))
+        self.assertEqual([row[0] for row in rows + more], sorted(self.per_student_loop()))
+        self.assertEqual({name: values for name, *values in rows + more},
+                         {name: list(values) for name, values in self.per_student_loop().items()})
+
+    def test_lecture_sorting_and_pages(self):
+        _, rows = self.lecture_rows(sort='-accuracy')
+        _, more = self.lecture_rows(sort='-accuracy', page=2)
+        accuracies = [row[3] for row in rows + more]
+        self.assertEqual(accuracies, sorted(accuracies, reverse=True))
+        self.assertEqual(len({row[0] for row in rows + more}), 55)
+
+        _, rows = self.lecture_rows(sort='-name')
+        self.assertEqual(rows[0][0], "s54")
+        # 不支援的排序與頁碼退回預設
+        response, rows = self.lecture_rows(sort='password', page='abc')
+        self.assertEqual((response.context['sort'], rows[0][0]), ('name', "s00"))
+        response, rows = self.lecture_rows(page=99)
+        self.assertEqual((response.context['page_obj'].number, rows[-1][0]), (2, "s54"))
+
+    def test_lecture_query_count_independent_of_students(self):
+        url = reverse('lecture_submissions', args=[self.lecture.id])
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url, {'sort': '-accuracy'})
+        self.add_students(55, 130)
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            self.client.get(url, {'sort': '-accuracy'})
+
+    def test_student_views_match_per_lecture_loop(self):
+        student = Student.objects.get(user__username="s07")
+        for lecture in make_lectures(self.course, 3):
+            Submission.objects.create(student=student, question=lecture.question_set.get(), student_answer="B",
+                                      is_correct=False)
+        rebuild_student_lecture_stats()
+        expected = []
+        for lecture in Lecture.objects.order_by('id'):
+            subs = Submission.objects.filter(student=student, question__lecture=lecture)
+            if subs.exists():
+                correct = subs.filter(is_correct=True).count()
+                expected.append((lecture.title, subs.count(), correct, round(correct / subs.count() * 100, 2)))
+
+        def rows(response):
+            return [(r['lecture'].title, r['total'], r['correct'], r['accuracy']) for r in response.context['submissions']]
+
+        self.assertEqual(rows(self.client.get(reverse('student_submissions', args=[student.id]))), expected)
+        self.client.force_login(student.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(rows(self.client.get(reverse('my_submissions'))), expected)
+
+        # 作答過的講次變多，查詢數不變
+        for lecture in make_lectures(self.course, 5):
+            Submission.objects.create(student=student, question=lecture.question_set.get(), student_answer="A",
+                                      is_correct=True)
+        rebuild_student_lecture_stats([student.id])
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            response = self.client.get(reverse('my_submissions'))
+        self.assertEqual(len(response.context['submissions']), 9)
+
+
+class LiveChunkUploadTests(TestCase):
+    def setUp(self):
+        self.course = Course.objects.create(name="資料庫系統")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media = tmp.name
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, **fields):
+        audio = SimpleUploadedFile("chunk.webm", b"webm", content_type="audio/webm")
+        return self.client.post(reverse('live_chunk_upload'), {'audio_chunk': audio, 'session_id': "s1", **fields})
+
+    def test_upload_queues_chunk_and_ignores_retries(self):
+        response = self.upload(seq=0, lecture_title="直播", course_id=self.course.id)
+        self.assertEqual(response.status_code, 202)
+        lecture_id = response.json()['lecture_id']
+
+        response = self.upload(seq=1, lecture_id=lecture_id)
+        self.assertFalse(response.json()['duplicate'])
+        response = self.upload(seq=1, lecture_id=lecture_id)
+        self.assertTrue(response.json()['duplicate'])
+
+        chunks = LiveChunk.objects.filter(lecture_id=lecture_id)
+        self.assertEqual(chunks.count(), 2)
+        self.assertEqual(set(chunks.values_list('status', flat=True)), {'pending'})
+        self.assertEqual(len(os.listdir(os.path.join(self.media, "live_chunks"))), 2)
+        self.assertEqual(Lecture.objects.filter(title="直播").count(), 1)
+
+    @patch("core.live.enqueue_partial_summary")
+    @patch("core.live.transcribe_with_whisper", return_value=" 你好 ")
+    def test_worker_claims_and_transcribes_queued_chunk(self, transcribe, _):
+        lecture_id = self.upload(seq=0, lecture_title="直播", course_id=self.course.id).json()['lecture_id']
+        chunk = claim_next_chunk()
+        self.assertEqual((chunk.status, chunk.attempts), ('transcribing', 1))
+        # 已被搶走的段落不會再被別的 worker 拿到
+        self.assertIsNone(claim_next_chunk())
+
+        transcribe_chunk(chunk)
+        chunk.refresh_from_db()
+        self.assertEqual((chunk.status, chunk.text, chunk.audio.name), ('done', "你好", ""))
+        self.assertEqual(os.listdir(os.path.join(self.media, "live_chunks")), [])
+        self.assertFalse(pending_chunks(Lecture.objects.get(id=lecture_id)).exists())
+
+    @patch("core.live.transcribe_with_whisper", side_effect=RuntimeError("whisper 逾時"))
+    def test_failing_chunk_is_retried_then_reported_at_finalize(self, _):
+        lecture_id = self.upload(seq=0, lecture_title="直播", course_id=self.course.id).json()['lecture_id']
+        url = reverse('finalize_transcript_summary_quiz', args=[lecture_id])
+        for _ in range(LIVE_CHUNK_MAX_ATTEMPTS - 1):
+            transcribe_chunk(claim_next_chunk())
+            self.assertEqual(LiveChunk.objects.get().status, 'pending')
+        transcribe_chunk(claim_next_chunk())
+        self.assertEqual(LiveChunk.objects.get().status, 'failed')
+
+        response = self.client.post(url, "{}", content_type="application/json")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['failed'], [0])
+        # 使用者確認略過後才繼續（這裡沒有任何逐字稿）
+        response = self.client.post(url, json.dumps({"skip_failed": True}), content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+
+        # 重新上傳失敗的段落會再排入佇列
+        self.assertFalse(self.upload(seq=0, lecture_id=lecture_id).json()['duplicate'])
+        self.assertEqual(LiveChunk.objects.get().status, 'pending')
+
+    def test_stale_transcription_is_requeued_instead_of_dropped(self):
+        lecture = Lecture.objects.create(course=self.course, title="直播")
+        chunk = self.add_chunk(lecture, 0, "", status='transcribing')
+        LiveChunk.objects.filter(id=chunk.id).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_chunks(), 1)
+        self.assertEqual(LiveChunk.objects.get(id=chunk.id).status, 'pending')
+        url = reverse('finalize_transcript_summary_quiz', args=[lecture.id])
+        self.assertEqual(self.client.post(url, "{}", content_type="application/json").status_code, 409)
+
+    def add_chunk(self, lecture, seq, text, status='done', session_id="s1"):
+        return LiveChunk.objects.create(lecture=lecture, session_id=session_id, seq=seq, status=status, text=text)
+
+    def test_chunks_finished_out_of_order_are_assembled_in_order(self):
+        lecture = Lecture.objects.create(course=self.course, title="直播")
+        self.add_chunk(lecture, 2, "第三段")
+        self.add_chunk(lecture, 0, "第一段", status='pending')
+        self.add_chunk(lecture, 1, "第二段")
+        self.assertEqual(live_transcript(lecture, contiguous=True), "")
+
+        LiveChunk.objects.filter(lecture=lecture, seq=0).update(status='done')
+        self.assertEqual(live_transcript(lecture, contiguous=True), "第一段\n第二段\n第三段")
+
+    def test_finalize_waits_for_pending_chunks(self):
+        lecture = Lecture.objects.create(course=self.course, title="直播", transcript="舊的內容")
+        url = reverse('finalize_transcript_summary_quiz', args=[lecture.id])
+        keep_legacy_transcript(lecture)
+        self.add_chunk(lecture, 0, "", status='pending')
+        self.assertEqual(self.client.post(url, "{}", content_type="application/json").status_code, 409)
+
+        LiveChunk.objects.filter(lecture=lecture, seq=0, session_id="s1").update(status='done', text="新的段落")
+        response = self.client.post(url, "{}", content_type="application/json")
+        self.assertEqual(response.json()['status'], "queued")
+        lecture.refresh_from_db()
+        self.assertEqual(lecture.transcript, "舊的內容\n新的段落")
+
+        # 重複送出沿用同一筆工作
+        again = self.client.post(url, "{}", content_type="application/json")
+        self.assertEqual(again.json()['job_id'], response.json()['job_id'])
+        self.assertEqual(LectureJob.objects.filter(lecture=lecture).count(), 1)
+
+    def test_partial_jobs_are_claimed_with_their_own_status(self):
+        lecture = Lecture.objects.create(course=self.course, title="直播")
+        partial = enqueue_lecture_job(lecture, kind='partial', num_mcq=0)
+        self.assertEqual(claim_next_job("w1").status, 'partial_summarizing')
+        # 段落摘要進行中不影響結束錄音排入整合工作，也不顯示成講次的進度
+        job, created = enqueue_lecture_job_once(lecture)
+        self.assertTrue(created)
+        self.assertNotEqual(job.id, partial.id)
+        self.assertEqual(job_status_payload(lecture)['status'], 'queued')
+
+    def test_events_view_refuses_to_stream_under_wsgi(self):
+        lecture = Lecture.objects.create(course=self.course, title="直播")
+        response = self.client.get(reverse('live_transcript_events', args=[lecture.id]))
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(response.streaming)
+
+    @patch("core.live.SSE_POLL_SECONDS", 0)
+    async def test_events_stream_pushes_chunks_finished_by_any_worker(self):
+        lecture = await Lecture.objects.acreate(course=self.course, title="直播")
+        earlier = await LiveChunk.objects.acreate(lecture=lecture, session_id="s1", seq=0, status='done', text="之前",
+                                                 transcribed_at=timezone.now())
+        chunk = await LiveChunk.objects.acreate(lecture=lecture, session_id="s1", seq=1, status='transcribing')
+        stream = transcript_events(lecture.id)
+        ready = await stream.__anext__()
+        # 轉錄由另一個 process 的 worker 寫入資料表
+        await LiveChunk.objects.filter(id=chunk.id).aupdate(status='done', text="你好", transcribed_at=timezone.now())
+        event = await stream.__anext__()
+        await stream.aclose()
+        self.assertIn("event: ready", ready)
+        self.assertIn("id: 1\nevent: transcript", event)
+        self.assertIn("你好", event)
+        self.assertNotIn(earlier.text, event)
+
+    @patch("core.live.SSE_POLL_SECONDS", 0)
+    async def test_late_subscriber_receives_finished_chunks_first(self):
+        lecture = await Lecture.objects.acreate(course=self.course, title="直播")
+        now = timezone.now()
+        await LiveChunk.objects.acreate(lecture=lecture, session_id="s1", seq=1, status='done', text="第二段",
+                                        transcribed_at=now)
+        pending = await LiveChunk.objects.acreate(lecture=lecture, session_id="s1", seq=2, status='pending')
+        await LiveChunk.objects.acreate(lecture=lecture, session_id="old", seq=0, status='done', text="上次錄音",
+                                        transcribed_at=now)
+
+        stream = transcript_events(lecture.id, "s1")
+        await stream.__anext__()
+        snapshot = await stream.__anext__()
+        await LiveChunk.objects.filter(id=pending.id).aupdate(status='done', text="第三段", transcribed_at=timezone.now())
+        live = await stream.__anext__()
+        await stream.aclose()
+        self.assertIn("id: 1\nevent: transcript", snapshot)
+        self.assertIn("第二段", snapshot)
+        self.assertIn("第三段", live)
+
+
+class AudioIngestTests(TestCase):
+    def test_sweep_removes_only_old_prefixed_files(self):
+        old = tempfile.NamedTemporaryFile(prefix=TEMP_PREFIX, delete=False).name
+        fresh = tempfile.NamedTemporaryFile(prefix=TEMP_PREFIX, delete=False).name
+        other = tempfile.NamedTemporaryFile(prefix="other-", delete=False).name
+        an_hour_ago = time.time() - 3600
+        os.utime(old, (an_hour_ago, an_hour_ago))
+        os.utime(other, (an_hour_ago, an_hour_ago))
+
+        sweep_temp_audio(max_age_seconds=60)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(other))
+        os.remove(fresh)
+        os.remove(other)
+
+    @patch('core.audio_ingest.ffmpeg_available', return_value=False)
+    def test_ingest_keeps_original_when_ffmpeg_is_missing(self, _):
+        upload = SimpleUploadedFile("recording.webm", b"webm-bytes", content_type="audio/webm")
+        with ingest_audio(upload, "第一講") as audio:
+            self.assertEqual(audio.name, "第一講.webm")
+            self.assertEqual(audio.read(), b"webm-bytes")
+
+
+class FakeAudio:
+    """只提供 plan_audio_segments 需要的長度與音量"""
+
+    def __init__(self, length_ms):
+        self.length_ms = length_ms
+        self.dBFS = -20
+
+    def __len__(self):
+        return self.length_ms
+
+
+class AudioSegmentPlanTests(SimpleTestCase):
+    @patch("core.audio_utils.detect_silence")
+    def test_short_audio_is_a_single_segment(self, detect):
+        self.assertEqual(plan_audio_segments(FakeAudio(9000), max_ms=10000), [(0, 9000)])
+        detect.assert_not_called()
+
+    @patch("core.audio_utils.detect_silence", return_value=[(3000, 3400), (7000, 8000), (16000, 17000)])
+    def test_cuts_at_last_silence_in_second_half(self, _):
+        segments = plan_audio_segments(FakeAudio(25000), max_ms=10000)
+        # 3200 落在前半段不採用；在靜音中點切開，前後段不重疊
+        self.assertEqual(segments, [(0, 7500), (7500, 16500), (16500, 25000)])
+
+    @patch("core.audio_utils.detect_silence", return_value=[])
+    def test_hard_cut_overlaps_next_segment(self, _):
+        segments = plan_audio_segments(FakeAudio(25000), max_ms=10000, overlap_ms=2000)
+        self.assertEqual(segments, [(0, 10000), (8000, 18000), (16000, 25000)])
+        self.assertTrue(all(end - start <= 10000 for start, end in segments))
+
+    def ffmpeg_run(self, stderr="", stdout=b"", duration=b"95.5\n"):
+        """模擬 ffprobe / ffmpeg，記錄每次呼叫的參數"""
+        calls = []
+
+        def run(args, **kwargs):
+            calls.append(args)
+            out = duration if "-show_entries" in args else stdout
+            return SimpleNamespace(returncode=0, stdout=out, stderr=stderr.encode())
+
+        return calls, patch("core.audio_utils.subprocess.run", side_effect=run)
+
+    def test_silences_are_streamed_from_ffmpeg(self):
+        stderr = (
+            "[silencedetect @ 0x1] silence_start: 10.2\n"
+            "[silencedetect @ 0x1] silence_end: 11.4 | silence_duration: 1.2\n"
+            "[silencedetect @ 0x1] silence_start: 94.9\n"
+            "[Parsed_volumedetect_0 @ 0x2] mean_volume: -23.5 dB\n"
+        )
+        calls, run = self.ffmpeg_run(stderr)
+        with run:
+            audio = load_audio("/tmp/lecture.mp3")
+            self.assertEqual(len(audio), 95500)
+            self.assertEqual(audio.dBFS, -23.5)
+            self.assertEqual(detect_silence(audio, 700, -39.5), [(10200, 11400), (94900, 95500)])
+        self.assertIn("silencedetect=noise=-39.5dB:d=0.700", calls[-1])
+
+    def test_segments_are_extracted_by_seeking(self):
+        calls, run = self.ffmpeg_run(stdout=b"\x00\x40" * 4)
+        with run:
+            audio = load_audio("/tmp/lecture.webm")
+            audio.export_segment(60000, 90500, "/tmp/segment_002.mp3")
+            pcm = audio.read_pcm(1000, 2000, 16000)
+        export = calls[1]
+        self.assertEqual(export[export.index("-ss") + 1:export.index("-i") + 2],
+                         ["60.000", "-t", "30.500", "-i", "/tmp/lecture.webm"])
+        self.assertEqual(export[-1], "/tmp/segment_002.mp3")
+        self.assertEqual((calls[2][calls[2].index("-ss") + 1], pcm), ("1.000", b"\x00\x40" * 4))
+
+    def test_missing_duration_is_measured_by_decoding(self):
+        stderr = "size=N/A time=00:01:05.20 bitrate=N/A\nmean_volume: -30.0 dB\n"
+        calls, run = self.ffmpeg_run(stderr, duration=b"N/A\n")
+        with run:
+            audio = load_audio("/tmp/live.webm")
+        self.assertEqual((len(audio), audio.dBFS), (65200, -30.0))
+        self.assertEqual(len(calls), 2)
+
+    def test_stitch_drops_text_repeated_across_overlap(self):
+        first = "今天我們要介紹資料庫的正規化，第一正規化要求欄位不可再分割"
+        second = "第一正規化要求欄位不可再分割，第二正規化消除部分相依"
+        self.assertEqual(stitch_transcripts([first, "", None, second]), first + "，第二正規化消除部分相依")
+
+    def test_stitch_keeps_unrelated_or_distant_matches(self):
+        self.assertEqual(stitch_transcripts(["交易要滿足原子性", "索引可以加快查詢"]), "交易要滿足原子性\n索引可以加快查詢")
+        # 相同的句子出現在前一段開頭而不是接縫處，不算重疊
+        first = "第一正規化要求欄位不可再分割。" + "接下來我們看一個實際的例子。" * 3
+        second = "第一正規化要求欄位不可再分割的原因"
+        self.assertEqual(stitch_transcripts([first, second], window=60), first + "\n" + second)
+
+
+class LocalWhisperTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.audio_path = os.path.join(tmp.name, "lecture.mp3")
+        with open(self.audio_path, "wb") as f:
+            f.write(b"fake mp3")
+        set_cache_backend(SQLiteCacheBackend(os.path.join(tmp.name, "ai_cache.sqlite3")))
+        self.addCleanup(set_cache_backend, None)
+
+        # 以假的 torch / whisper 模組載入模型，不需真的安裝
+        self.model = object()
+        self.whisper = SimpleNamespace(load_model=Mock(return_value=self.model))
+        modules = patch.dict(sys.modules, {"torch": SimpleNamespace(set_num_threads=Mock()), "whisper": self.whisper})
+        modules.start()
+        self.addCleanup(modules.stop)
+        for name in ("_model", "_model_name"):
+            original = getattr(local_whisper, name)
+            setattr(local_whisper, name, None)
+            self.addCleanup(setattr, local_whisper, name, original)
+
+    @patch("core.local_whisper.segment_to_array", side_effect=lambda audio, start, end: (start, end))
+    @patch("core.local_whisper.load_audio", return_value=FakeAudio(50000))
+    @patch("core.audio_utils.detect_silence", return_value=[(24000, 25000)])
+    def test_local_backend_uses_preloaded_model_and_cache(self, *_):
+        with patch("core.ai_modules.TRANSCRIBE_BACKEND", "local"):
+            self.assertEqual(run_worker(once=True), 0)
+        self.whisper.load_model.assert_called_once_with(
+            local_whisper.LOCAL_WHISPER_MODEL, device=local_whisper.LOCAL_WHISPER_DEVICE,
+        )
+
+        decoded = []
+
+        def decode(model, arrays):
+            decoded.append((model, arrays))
+            return [f"第 {i} 段" for i, _ in enumerate(arrays)]
+
+        with patch("core.local_whisper.decode_batch", side_effect=decode), \
+                patch("core.ai_modules.get_openai_client", side_effect=AssertionError("不應呼叫 API")):
+            text = ai_modules.transcribe_with_whisper(self.audio_path, backend="local")
+            # 第二次命中快取，不再解碼
+            self.assertEqual(ai_modules.transcribe_with_whisper(self.audio_path, backend="local"), text)
+
+        self.assertEqual(text, "第 0 段\n第 1 段")
+        self.assertEqual(decoded, [(self.model, [(0, 24500), (24500, 50000)])])
+        self.whisper.load_model.assert_called_once()
+
+
+class TokenChunkingTests(SimpleTestCase):
+    def assert_covers(self, text, chunks):
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], len(text))
+        for (_, end, _), (start, _, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, start)
+
+    def test_unpunctuated_and_english_text_respect_budget(self):
+        for text in ["我們今天要講的是交易的隔離層級" * 500, "the planner picks an index scan " * 800]:
+            chunks = token_chunks(text, max_tokens=300, min_tokens=50, overlap_tokens=0)
+            self.assertGreater(len(chunks), 1)
+            self.assert_covers(text, chunks)
+            self.assertTrue(all(count_tokens(text[s:e]) <= 310 for s, e, _ in chunks))
+
+    def test_short_tail_never_pushes_a_chunk_over_budget(self):
+        # 每句約 100 tokens：裝滿 7 句後只剩 1 句，併入前一段會變成 800
+        sentence = "資料庫" * 33 + "。"
+        for count in (8, 15, 22):
+            text = sentence * count
+            chunks = token_chunks(text, max_tokens=700, min_tokens=200, overlap_tokens=0)
+            self.assert_covers(text, chunks)
+            self.assertTrue(all(count_tokens(text[s:e]) <= 700 for s, e, _ in chunks))
+            self.assertGreaterEqual(count_tokens(text[chunks[-1][0]:chunks[-1][1]]), 200)
+
+    def test_overlap_reaches_back_into_previous_chunk(self):
+        text = "第一正規化要求欄位不可再分割。第二正規化消除部分相依。" * 100
+        chunks = token_chunks(text, max_tokens=200, min_tokens=50, overlap_tokens=40)
+        self.assert_covers(text, chunks)
+        self.assertEqual(chunks[0][2], 0)
+        for start, _, context in chunks[1:]:
+            self.assertLess(context, start)
+            self.assertTrue(text[context:start].endswith("。"))
+
+    def test_resuming_from_offset_keeps_context(self):
+        text = "索引可以加快查詢。" * 200
+        chunks = token_chunks(text, start=450, max_tokens=200, overlap_tokens=30)
+        self.assertEqual(chunks[0][0], 450)
+        self.assertLess(chunks[0][2], 450)
+
+
+class ChunkSummaryConcurrencyTests(SimpleTestCase):
+    def test_results_keep_input_order_within_worker_limit(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0, 'finished': []}
+
+        def completion(client, messages, **params):
+            chunk = messages[-1]['content']
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            # 前面的段落睡比較久，完成順序與輸入相反
+            time.sleep(0.01 * (8 - int(chunk.split()[-1])))
+            with lock:
+                state['running'] -= 1
+                state['finished'].append(chunk)
+            return f"摘要 {chunk}"
+
+        chunks = [f"段落 {i}" for i in range(8)]
+        with patch('core.ai_modules.cached_chat_completion', side_effect=completion):
+            summaries, timings = ai_modules.summarize_chunks(object(), chunks, max_workers=3)
+
+        self.assertEqual(summaries, [f"摘要 段落 {i}" for i in range(8)])
+        self.assertEqual([t['index'] for t in timings], list(range(8)))
+        self.assertNotEqual(state['finished'], chunks)
+        self.assertEqual(state['peak'], 3)
+
+
+class FakeChatClient:
+    """依序回傳預先準備好的 JSON 回應，並記錄每次呼叫的參數"""
+
+    def __init__(self, *payloads):
+        self.payloads = list(payloads)
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        self.calls.append(params)
+        content = json.dumps(self.payloads.pop(0), ensure_ascii=False)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20, total_tokens=120),
+        )
+
+
+def mcq(n):
+    return {"concept": "正規化", "question": f"選擇題 {n}", "options": {"A": "1", "B": "2", "C": "3", "D": "4"},
+            "answer": "A", "explanation": "說明"}
+
+
+def tf(n, answer="True"):
+    return {"concept": "交易", "question": f"是非題 {n}", "answer": answer, "explanation": "說明"}
+
+
+class QuizGenerationTests(SimpleTestCase):
+    def setUp(self):
+        set_cache_backend(NullCacheBackend())
+        self.addCleanup(set_cache_backend, None)
+
+    def test_both_types_in_one_structured_call(self):
+        client = FakeChatClient({"mcq": [mcq(1), mcq(2)], "tf": [tf(1, "false")]})
+        quiz = generate_quiz(client, "摘要", num_mcq=2, num_tf=1)
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(client.calls[0]["response_format"]["type"], "json_schema")
+        self.assertEqual([q["question"] for q in quiz["mcq"]], ["選擇題 1", "選擇題 2"])
+        self.assertEqual(quiz["tf"][0]["answer"], "False")
+
+    def test_retry_asks_only_for_missing_items(self):
+        bad = dict(mcq(2), answer="E")
+        client = FakeChatClient({"mcq": [mcq(1), bad], "tf": [tf(1)]}, {"mcq": [mcq(3)], "tf": []})
+        quiz = generate_quiz(client, "摘要", num_mcq=2, num_tf=1)
+        self.assertEqual(len(client.calls), 2)
+        retry_prompt = client.calls[1]["messages"][0]["content"]
+        self.assertIn("選擇題（mcq）1 題", retry_prompt)
+        self.assertIn("是非題（tf）0 題", retry_prompt)
+        self.assertIn("選擇題 1", retry_prompt)
+        self.assertEqual([q["question"] for q in quiz["mcq"]], ["選擇題 1", "選擇題 3"])
+        self.assertEqual(len(quiz["tf"]), 1)
+
+
+class LiveSummaryTests(TestCase):
+    def setUp(self):
+        self.lecture = Lecture.objects.create(course=Course.objects.create(name="資料庫系統"), title="直播")
+        self.sent = []
+        patcher = patch("core.ai_modules.cached_chat_completion", side_effect=self.fake_completion)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_completion(self, client, model, messages, **kwargs):
+        self.sent.append(messages[-1]["content"])
+        return f"摘要 {len(self.sent)}"
+
+    def test_finalize_reuses_matching_partials_and_summarizes_only_the_rest(self):
+        text = "".join(f"第 {i} 句：正規化可以減少重複資料並避免更新時的異常情況。" for i in range(150))
+        partials = summarize_ready_chunks(self.lecture, client=object(), transcript=text)
+        spans = token_chunks(text)
+        self.assertGreater(len(spans), 2)
+        # 錄音中最後一段可能還在增長，先不摘要
+        self.assertEqual(len(partials), len(spans) - 1)
+        self.assertEqual(len(self.sent), len(spans) - 1)
+
+        self.lecture.transcript = text
+        self.sent.clear()
+        final = summarize_ready_chunks(self.lecture, client=object(), final=True)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual([p.id for p in final[:-1]], [p.id for p in partials])
+        self.assertEqual(final[-1].end_offset, len(text))
+
+        # 改寫第二段：第一段沿用，第二段之後重新摘要
+        start, end, _ = spans[1]
+        self.lecture.transcript = text[:start] + text[start:end].replace("正規化", "反正規化", 1) + text[end:]
+        self.sent.clear()
+        rebuilt = summarize_ready_chunks(self.lecture, client=object(), final=True)
+        self.assertEqual(rebuilt[0].id, partials[0].id)
+        self.assertEqual(len(self.sent), len(rebuilt) - 1)
+        # 各段併發送出，順序不固定
+        self.assertTrue(any("反正規化" in chunk for chunk in self.sent))
+        self.assertEqual(LectureSummaryChunk.objects.filter(lecture=self.lecture).count(), len(rebuilt))
+
+    def test_final_summary_covers_whole_transcript_after_losing_a_race(self):
+        text = "".join(f"第 {i} 句：交易必須滿足原子性、一致性、隔離性與持久性。" for i in range(150))
+        spans = token_chunks(text)
+        real_summarize_chunks = ai_modules.summarize_chunks
+
+        def other_worker_wins(client, chunks):
+            result = real_summarize_chunks(client, chunks)
+            if not LectureSummaryChunk.objects.exists():
+                # 摘要期間另一個 worker 先寫入了前兩段
+                for index, (start, end, _) in enumerate(spans[:2]):
+                    LectureSummaryChunk.objects.create(
+                        lecture=self.lecture, index=index, start_offset=start, end_offset=end,
+                        digest=ai_modules.chunk_digest(text[start:end]), summary=f"別的 worker {index}",
+                    )
+            return result
+
+        self.lecture.transcript = text
+        with patch("core.ai_modules.summarize_chunks", side_effect=other_worker_wins):
+            final = summarize_ready_chunks(self.lecture, client=object(), final=True)
+        self.assertEqual(final[-1].end_offset, len(text))
+        self.assertEqual([p.summary for p in final[:2]], ["別的 worker 0", "別的 worker 1"])
+        self.assertEqual(len(final), len(spans))
+        self.assertEqual(LectureSummaryChunk.objects.filter(lecture=self.lecture).count(), len(spans))
+
+
+class AICacheTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "ai_cache.sqlite3")
+        self.addCleanup(set_cache_backend, None)
+
+    def test_entries_expire_after_ttl(self):
+        backend = SQLiteCacheBackend(self.path, ttl=60)
+        with patch("core.ai_cache.time.time", return_value=1000.0):
+            backend.set("k", "摘要")
+        with patch("core.ai_cache.time.time", return_value=1059.0):
+            self.assertEqual(backend.get("k"), "摘要")
+        with patch("core.ai_cache.time.time", return_value=1061.0):
+            self.assertIsNone(backend.get("k"))
+
+    def test_least_recently_used_entries_are_evicted_at_size_bound(self):
+        # 每筆約 100 bytes，上限只放得下兩筆
+        backend = SQLiteCacheBackend(self.path, ttl=0, max_bytes=250)
+        value = "x" * 100
+        with patch("core.ai_cache.time.time", side_effect=[1.0, 2.0, 3.0, 4.0]):
+            backend.set("a", value)
+            backend.set("b", value)
+            backend.get("a")  # a 變成最近使用
+            backend.set("c", value)
+        self.assertEqual(backend.get("a"), value)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), value)
+
+    def test_response_is_cached_only_after_parse_succeeds(self):
+        backend = SQLiteCacheBackend(self.path)
+        set_cache_backend(backend)
+        messages = [{"role": "user", "content": "出題"}]
+        client = FakeChatClient({"mcq": []}, {"mcq": [mcq(1)]})
+
+        def parse(content):
+            data = json.loads(content)
+            if not data["mcq"]:
+                raise ValueError("沒有題目")
+            return data
+
+        with self.assertRaises(ValueError):
+            cached_chat_completion(client, "gpt-4o", messages, parse=parse)
+        self.assertIsNone(backend.get(chat_cache_key("gpt-4o", messages)))
+        self.assertEqual(cached_chat_completion(client, "gpt-4o", messages, parse=parse)["mcq"], [mcq(1)])
+        # 第三次直接命中快取，不再呼叫 API
+        self.assertEqual(cached_chat_completion(client, "gpt-4o", messages, parse=parse)["mcq"], [mcq(1)])
+        self.assertEqual(len(client.calls), 2)
+
+    def test_django_backend_clear_only_drops_ai_entries(self):
+        cache.clear()
+        cache.set("rate:other", 3)
+        backend = DjangoCacheBackend(alias="default", ttl=60)
+        backend.set("k", "摘要")
+        self.assertEqual(backend.get("k"), "摘要")
+        backend.clear()
+        self.assertIsNone(backend.get("k"))
+        self.assertEqual(cache.get("rate:other"), 3)
+        backend.set("k", "新摘要")
+        self.assertEqual(backend.get("k"), "新摘要")
+
+        # 世代編號被淘汰後仍能清除
+        cache.delete(DjangoCacheBackend.GENERATION_KEY)
+        backend.set("k", "摘要")
+        backend.clear()
+        self.assertIsNone(backend.get("k"))
+
+    def test_backend_is_selected_by_setting(self):
+        sqlite_backend = partial(SQLiteCacheBackend, self.path)
+        with patch.dict("core.ai_cache.BACKENDS", {"sqlite": sqlite_backend}):
+            for name, expected in [("sqlite", SQLiteCacheBackend), ("django", DjangoCacheBackend),
+                                   ("none", NullCacheBackend), ("redis?", NullCacheBackend)]:
+                set_cache_backend(None)
+                with patch("core.ai_cache.AI_CACHE_BACKEND", name):
+                    self.assertIsInstance(get_cache_backend(), expected)
+        self.assertTrue(os.path.exists(self.path))
+
+
+class WeaknessReportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_weak_concepts_come_from_lecture_stats(self):
+        user = User.objects.create_user("student5", "student5@example.com", "pass1234")
+        student = Student.objects.get(user=user)
+        for lecture, counts in zip(make_lectures(Course.objects.create(name="資料庫系統"), 2),
+                                   ({"正規化": 2, "索引": 1}, {"索引": 2, "交易": 0})):
+            StudentLectureStats.objects.create(student=student, lecture=lecture, total=5, concept_wrong_counts=counts)
+        self.client.force_login(user)
+        url = reverse('student_weakness_report', args=[student.id])
+        self.client.get(url)
+        # 概念報告已快取後，整頁不再查詢 Submission
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.context['weaknesses'], [{'concept': "索引", 'count': 3}, {'concept': "正規化", 'count': 2}])
+        self.assertNotIn("core_submission", " ".join(q['sql'] for q in ctx.captured_queries))
+
+
+class StudentStatsRollupTests(TestCase):
+    def setUp(self):
+        self.student = Student.objects.get(user=User.objects.create_user("student7", "student7@example.com", "pass1234"))
+        self.lecture = Lecture.objects.create(course=Course.objects.create(name="資料庫系統"), title="正規化")
+        self.questions = [
+            Question.objects.create(lecture=self.lecture, question_text=f"題目 {i}", correct_answer="A",
+                                    explanation="說明", concept=concept)
+            for i, concept in enumerate(["正規化", "正規化", "索引", "交易"])
+        ]
+
+    def submit(self, questions, answers):
+        submissions = Submission.objects.bulk_create([
+            Submission(student=self.student, question=q, student_answer=a, is_correct=a == q.correct_answer)
+            for q, a in zip(questions, answers)
+        ])
+        return record_quiz_attempt(self.student, self.lecture, submissions)
+
+    def test_attempts_accumulate_on_same_lecture(self):
+        stats = self.submit(self.questions[:2], ["A", "B"])
+        self.assertEqual((stats.total, stats.correct, stats.concept_wrong_counts), (2, 1, {"正規化": 1}))
+
+        # 講次新增題目後的第二次作答累加在同一列
+        self.submit(self.questions[2:], ["C", "D"])
+        stats = StudentLectureStats.objects.get(student=self.student, lecture=self.lecture)
+        self.assertEqual((stats.total, stats.correct), (4, 1))
+        self.assertEqual(stats.concept_wrong_counts, {"正規化": 1, "索引": 1, "交易": 1})
+        self.assertEqual(stats.last_submitted_at, Submission.objects.latest('submitted_at').submitted_at)
+        self.assertEqual(StudentLectureStats.objects.count(), 1)
+
+    def test_rebuild_matches_submission_rows(self):
+        self.submit(self.questions[:2], ["A", "B"])
+        self.submit(self.questions[2:], ["A", "D"])
+        accumulated = StudentLectureStats.objects.get()
+        # 統計列被改壞或遺失時，可由 Submission 重建
+        StudentLectureStats.objects.update(total=0, correct=0, concept_wrong_counts={})
+        call_command('rebuild_student_stats', stdout=StringIO())
+
+        rebuilt = StudentLectureStats.objects.get()
+        self.assertEqual((rebuilt.total, rebuilt.correct), (4, 2))
+        self.assertEqual(rebuilt.concept_wrong_counts, {"正規化": 1, "交易": 1})
+        self.assertEqual(
+            (rebuilt.total, rebuilt.correct, rebuilt.concept_wrong_counts, rebuilt.last_submitted_at),
+            (accumulated.total, accumulated.correct, accumulated.concept_wrong_counts, accumulated.last_submitted_at),
+        )
+
+        StudentLectureStats.objects.all().delete()
+        self.assertEqual(rebuild_student_lecture_stats([self.student.id]), 1)
+
+
+class SubmissionResultTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("student3", "student3@example.com", "pass1234")
+        self.student = Student.objects.get(user=self.user)
+        self.lecture = make_lectures(Course.objects.create(name="資料庫系統"), 1)[0]
+        for i in range(5):
+            Question.objects.create(lecture=self.lecture, question_text=f"追加題 {i}", correct_answer="True",
+                                    explanation="說明", question_type='tf')
+        self.client.force_login(self.user)
+        self.url = reverse('submission_result', args=[self.lecture.id])
+
+    def test_query_count_independent_of_question_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context['results']), 6)
+        # 含 ETag 的題目版本查詢（一次彙總，與題數無關）
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+
+    def test_repeat_view_returns_304_until_new_submission(self):
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        tables = " ".join(q['sql'] for q in ctx.captured_queries)
+        self.assertNotIn("core_submission", tables)
+        self.assertNotIn("core_student", tables)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('quiz', args=[self.lecture.id]), {})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_editing_questions_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        question = self.lecture.question_set.first()
+        question.correct_answer = "B"
+        question.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        question.delete()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class QuizSubmissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("student6", "student6@example.com", "pass1234")
+        self.student = Student.objects.get(user=self.user)
+        self.lecture = make_lectures(Course.objects.create(name="資料庫系統"), 1)[0]
+        for i in range(4):
+            Question.objects.create(lecture=self.lecture, question_text=f"是非題 {i}", correct_answer="True",
+                                    explanation="說明", question_type='tf')
+        self.questions = list(self.lecture.question_set.order_by('id'))
+        self.answers = {str(q.id): q.correct_answer for q in self.questions}
+        self.answers[str(self.questions[-1].id)] = "False"
+        self.client.force_login(self.user)
+        self.url = reverse('quiz', args=[self.lecture.id])
+
+    def test_answers_graded_with_single_insert(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, self.answers)
+        self.assertRedirects(response, reverse('lecture_detail', args=[self.lecture.id]), fetch_redirect_response=False)
+        inserts = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "core_submission"')]
+        self.assertEqual(len(inserts), 1)
+        # 批次寫入與統計累加在同一個 transaction 內
+        sql = [q['sql'] for q in ctx.captured_queries]
+        insert_at = sql.index(inserts[0])
+        self.assertTrue(any(s.startswith('SAVEPOINT') for s in sql[:insert_at]))
+        self.assertTrue(any(s.startswith('RELEASE SAVEPOINT') for s in sql[insert_at:]))
+        graded = dict(Submission.objects.filter(student=self.student).values_list('question_id', 'is_correct'))
+        self.assertEqual(graded, {q.id: q != self.questions[-1] for q in self.questions})
+
+    def test_duplicate_post_writes_nothing(self):
+        self.client.post(self.url, self.answers)
+        stats = StudentLectureStats.objects.get(student=self.student, lecture=self.lecture)
+
+        response = self.client.post(self.url, {k: "A" for k in self.answers})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("請勿重複作答", response.content.decode())
+        self.assertEqual(Submission.objects.filter(student=self.student).count(), len(self.questions))
+        self.assertEqual(Submission.objects.filter(student=self.student, student_answer="A").count(), 1)
+        stats.refresh_from_db()
+        self.assertEqual((stats.total, stats.correct), (5, 4))
+
+    def test_conflicting_answer_rolls_back_whole_batch(self):
+        # 另一個請求已寫入其中一題：整批回滾，不留下部分作答與統計
+        Submission.objects.create(student=self.student, question=self.questions[0], student_answer="A", is_correct=True)
+        response = self.client.post(self.url, self.answers)
+        self.assertIn("請勿重複作答", response.content.decode())
+        self.assertEqual(Submission.objects.filter(student=self.student).count(), 1)
+        self.assertFalse(StudentLectureStats.objects.filter(student=self.student).exists())
+
+
+class StandInOpenAIHandler(BaseHTTPRequestHandler):
+    """模擬 OpenAI API：前 fail_first 次回 429，之後回傳固定的 chat completion"""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server.requests += 1
+        server.connections.add(self.client_address)
+        if server.requests <= server.fail_first:
+            self.reply(429, {"error": {"message": "slow down"}}, {"retry-after-ms": "1"})
+            return
+        self.reply(200, {
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "好的"}}],
+        })
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class OpenAIClientRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOpenAIHandler)
+        self.server.requests, self.server.fail_first, self.server.connections = 0, 1, set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        env = patch.dict(os.environ, {
+            "OPENAI_API_KEY": "test-key",
+            "OPENAI_API_BASE": f"http://127.0.0.1:{self.server.server_port}/v1",
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        reset_openai_clients()
+        self.addCleanup(reset_openai_clients)
+
+    def ask(self, client):
+        return client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "hi"}])
+
+    def test_client_is_shared_and_connection_reused_across_retries(self):
+        client = get_openai_client()
+        self.assertIs(get_openai_client(), client)
+        self.assertEqual(self.ask(client).choices[0].message.content, "好的")
+        self.assertEqual(self.ask(get_openai_client()).choices[0].message.content, "好的")
+        self.assertEqual(self.server.requests, 3)  # 第一次 429 後自動重送
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_sdk_retries_are_counted_in_current_stage(self):
+        meter = StageMeter("combine_summaries")
+        token = ledger._stage.set(meter)
+        try:
+            self.ask(get_openai_client())
+        finally:
+            ledger._stage.reset(token)
+        self.assertEqual(meter.http_requests, 2)
+
+    def test_forked_child_gets_a_fresh_client(self):
+        client = get_openai_client()
+        with patch("core.ai_modules.os.getpid", return_value=-1):
+            self.assertIsNot(get_openai_client(), client)
+
+
+@patch.dict("core.rate_limit.RATE_LIMITS", {"gpt-4o": (60, 600)}, clear=True)
+@patch("core.rate_limit.time.sleep")
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        rate_limit.set_bucket_store(rate_limit.CacheBucketStore())
+        self.addCleanup(rate_limit.set_bucket_store, None)
+        rate_limit._stats.clear()
+
+    def test_requests_queue_behind_reservations_once_bucket_is_empty(self, sleep):
+        for _ in range(60):
+            self.assertEqual(rate_limit.acquire("gpt-4o"), 0)
+        # 每秒補充一個請求：第 61、62 個呼叫依序排在後面
+        self.assertAlmostEqual(rate_limit.acquire("gpt-4o"), 1, delta=0.1)
+        self.assertAlmostEqual(rate_limit.acquire("gpt-4o"), 2, delta=0.1)
+        self.assertEqual(sleep.call_count, 2)
+        usage = rate_limit.utilization()["gpt-4o"]
+        self.assertGreater(usage["requests_used"], 1)
+        self.assertEqual(usage["waits"], 2)
+
+    def test_token_budget_and_reconcile(self, sleep):
+        rate_limit.acquire("gpt-4o", tokens=600)
+        # 實際只用了 300 tokens，退回的額度可以立刻使用
+        rate_limit.reconcile("gpt-4o", 600, 300)
+        self.assertEqual(rate_limit.acquire("gpt-4o", tokens=300), 0)
+        self.assertAlmostEqual(rate_limit.acquire("gpt-4o", tokens=60), 6, delta=0.1)
+        with self.assertRaises(rate_limit.RateLimitTimeout):
+            rate_limit.acquire("gpt-4o", tokens=600, max_wait=10)
+
+    def test_unlisted_models_are_not_limited(self, sleep):
+        for _ in range(100):
+            self.assertEqual(rate_limit.acquire("whisper-1"), 0)
+        self.assertNotIn("whisper-1", rate_limit.utilization())
+        sleep.assert_not_called()
+
+
+@patch.dict("core.rate_limit.RATE_LIMITS", {"gpt-4o": (60, 600)}, clear=True)
+@patch("core.rate_limit.time.sleep")
+class DatabaseRateLimitTests(TestCase):
+    def setUp(self):
+        # 資料庫比快取慢，固定時鐘以免桶子在測試途中補充
+        clock = patch("core.rate_limit.time.time", return_value=1_000_000.0)
+        clock.start()
+        self.addCleanup(clock.stop)
+        rate_limit.set_bucket_store(rate_limit.DatabaseBucketStore())
+        self.addCleanup(rate_limit.set_bucket_store, None)
+        rate_limit._stats.clear()
+
+    def test_local_memory_cache_falls_back_to_database(self, sleep):
+        with patch("core.rate_limit.RATE_LIMIT_BACKEND", "auto"):
+            self.assertIsInstance(rate_limit.create_bucket_store(), rate_limit.DatabaseBucketStore)
+        with patch("core.rate_limit.RATE_LIMIT_BACKEND", "cache"):
+            self.assertIsInstance(rate_limit.create_bucket_store(), rate_limit.CacheBucketStore)
+
+    def test_reservations_are_shared_through_the_database(self, sleep):
+        for _ in range(60):
+            self.assertEqual(rate_limit.acquire("gpt-4o"), 0)
+        self.assertAlmostEqual(rate_limit.acquire("gpt-4o"), 1, delta=0.1)
+        # 另一個 worker 建立的存放處讀到同一份額度
+        self.assertLess(rate_limit.DatabaseBucketStore().read("gpt-4o")["requests"], 0)
+        self.assertEqual(RateLimitBucket.objects.count(), 1)
+
+    def test_token_budget_and_reconcile(self, sleep):
+        rate_limit.acquire("gpt-4o", tokens=600)
+        rate_limit.reconcile("gpt-4o", 600, 300)
+        self.assertEqual(rate_limit.acquire("gpt-4o", tokens=300), 0)
+        with self.assertRaises(rate_limit.RateLimitTimeout):
+            rate_limit.acquire("gpt-4o", tokens=600, max_wait=10)
+
+
+class PipelineLedgerTests(TestCase):
+    def setUp(self):
+        set_cache_backend(NullCacheBackend())
+        self.addCleanup(set_cache_backend, None)
+        self.lecture = Lecture.objects.create(
+            course=Course.objects.create(name="資料庫系統"), title="正規化", transcript="第一正規化要求欄位不可再分割。",
+        )
+
+    def run_transcript_job(self, *payloads):
+        job = enqueue_lecture_job(self.lecture, kind='transcript', num_mcq=1, num_tf=0)
+        job.attempts = 0
+        with patch("core.ai_modules.get_openai_client", return_value=FakeChatClient(*payloads)):
+            return run_job(job)
+
+    def test_run_records_each_stage_with_tokens_and_cost(self):
+        job = self.run_transcript_job("段落摘要", "整合摘要", {"mcq": [mcq(1)], "tf": []})
+        self.assertEqual(job.status, 'done')
+        run = PipelineRun.objects.get(job=job)
+        self.assertEqual(run.status, 'done')
+        stages = {stage.name: stage for stage in run.stages.all()}
+        self.assertEqual(list(stages), ['chunk_summaries', 'combine_summaries', 'generate_quiz'])
+        self.assertEqual(stages['generate_quiz'].api_calls, 1)
+        self.assertEqual(run.prompt_tokens, 300)
+        self.assertEqual(run.completion_tokens, 60)
+        self.assertGreater(run.cost_usd, 0)
+
+    def test_quiz_retry_and_failure_are_recorded(self):
+        self.run_transcript_job("段落摘要", "整合摘要", {"mcq": [], "tf": []}, {"mcq": [], "tf": []})
+        run = PipelineRun.objects.get()
+        stages = {stage.name: stage for stage in run.stages.all()}
+        self.assertEqual(stages['generate_quiz'].retries, 1)
+        self.assertEqual(run.status, 'done')
+
+        self.lecture.transcript = ""
+        self.lecture.save()
+        self.run_transcript_job()
+        failed = PipelineRun.objects.exclude(id=run.id).get()
+        self.assertEqual(failed.status, 'failed')
+        self.assertIn("JobFailed", failed.error)
+
+    def test_report_shows_stage_percentiles_to_teachers(self):
+        self.run_transcript_job("段落摘要", "整合摘要", {"mcq": [mcq(1)], "tf": []})
+        user = User.objects.create_user("teacher1", "teacher1@example.com", "pass1234")
+        Profile.objects.filter(user=user).update(role='teacher')
+        self.client.force_login(user)
+        response = self.client.get(reverse('pipeline_report'), {'days': 30})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({row['name'] for row in response.context['stages']},
+                         {'chunk_summaries', 'combine_summaries', 'generate_quiz'})
+        self.assertContains(response, "整合摘要")
+        self.assertEqual(percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 90), 9)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics._buffer.flush()
+        cache.clear()
+        self.user = User.objects.create_user("student4", "student4@example.com", "pass1234")
+        self.client.force_login(self.user)
+
+    def scrape(self, **headers):
+        return self.client.get(reverse('metrics'), **headers)
+
+    def test_latency_and_query_histograms_per_view(self):
+        make_lectures(Course.objects.create(name="資料庫系統"), 2)
+        for _ in range(3):
+            self.client.get(reverse('lecture_list'))
+        self.user.is_staff = True
+        self.user.save()
+        body = self.scrape().content.decode()
+        self.assertIn('django_http_request_duration_seconds_count{view="lecture_list"} 3', body)
+        self.assertIn('django_http_responses_total{view="lecture_list",status="2xx"} 3', body)
+        self.assertIn('django_db_queries_per_request_bucket{view="lecture_list",le="+Inf"} 3', body)
+        self.assertNotIn('django_db_queries_per_request_bucket{view="lecture_list",le="0"} 3', body)
+
+    def test_endpoint_requires_staff_or_token(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        with patch("core.metrics.METRICS_TOKEN", "secret"):
+            self.assertEqual(self.scrape().status_code, 403)
+            response = self.scrape(HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+
+    def test_counters_from_every_worker_are_summed_in_the_database(self):
+        self.assertIsInstance(metrics.create_metric_store(), metrics.DatabaseMetricStore)
+        # 兩個 process 各自的 buffer 寫進同一張表
+        for worker in (metrics.MetricsBuffer(), metrics.MetricsBuffer()):
+            worker.observe("admin:index", 200, 0.02, 3, 0.001)
+            worker.flush()
+        body = metrics.render_metrics()
+        self.assertIn('django_http_request_duration_seconds_count{view="admin:index"} 2', body)
+        self.assertIn('django_http_responses_total{view="admin:index",status="2xx"} 2', body)
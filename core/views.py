@@ -1,5 +1,6 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Count, Q , Max
+from django.db.models import Exists, OuterRef, Q , Max
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from datetime import timedelta
 from django.core.cache import cache
@@ -8,12 +9,16 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import HttpResponse
-from django.views.decorators.http import require_POST
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.views.decorators.http import condition, require_POST
+from django.core.handlers.asgi import ASGIRequest
 import json
 from django.views.decorators.csrf import csrf_exempt
 import io, uuid
+import csv
+from urllib.parse import urlencode
 from collections import defaultdict
+from itertools import islice
 
 from .models import Lecture, Question, Student, Submission, Course, Profile
 from .forms import (
@@ -21,7 +26,18 @@ from .forms import (
     CourseForm,
     CustomUserCreationForm
 )
-from .ai_modules import process_audio_and_generate_quiz
+from .reports import lecture_accuracy_rows, lecture_submission_stats, progress_report_context, student_totals, submission_results, top_wrong_questions, weak_concepts
+from .etags import student_id_for_user, submission_etag
+from .analytics import course_concept_report as course_concept_report_data, student_concept_report
+from .decorators import teacher_required
+from .pagination import keyset_page
+from .search import search_lectures
+from .rollups import record_quiz_attempt
+from .jobs import enqueue_lecture_job, enqueue_lecture_job_once, job_status_payload
+from .ledger import pipeline_stats
+from .metrics import metrics_authorized, render_metrics
+from .live import failed_chunks, finalize_live_transcript, pending_chunks, store_chunk, transcript_events
+from asgiref.sync import sync_to_async
 import os
 from django.conf import settings
 import re
@@ -38,7 +54,7 @@ def upload_lecture(request):
         if course_id and audio_file:
             course = Course.objects.get(id=course_id)
             lecture = Lecture.objects.create(course=course, audio_file=audio_file)
-            process_audio_and_generate_quiz(lecture.id)
+            enqueue_lecture_job(lecture)
             return redirect('lecture_detail', lecture.id)
     courses = Course.objects.all()
     return render(request, 'upload.html', {'courses': courses})
@@ -49,42 +65,54 @@ def upload_lecture_for_course(request, course_id):
         audio_file = request.FILES.get('audio')
         if audio_file:
             lecture = Lecture.objects.create(course=course, audio_file=audio_file, title=request.POST.get('title'))
-            process_audio_and_generate_quiz(lecture.id)
+            enqueue_lecture_job(lecture)
             return redirect('lecture_detail', lecture.id)
     return render(request, 'upload.html', {'course': course})
 
 def lecture_detail(request, lecture_id):
     lecture = get_object_or_404(Lecture, pk=lecture_id)
     questions = Question.objects.filter(lecture=lecture)
-    return render(request, 'lecture_detail.html', {'lecture': lecture, 'questions': questions})
+    return render(request, 'lecture_detail.html', {
+        'lecture': lecture,
+        'questions': questions,
+        'job': job_status_payload(lecture),
+    })
 
 def lecture_list(request):
     query = request.GET.get('q', '')
-    lectures = Lecture.objects.all()
+    lectures = Lecture.objects.select_related('course').annotate(
+        has_questions=Exists(Question.objects.filter(lecture=OuterRef('pk')))
+    )
 
     if query:
-        lectures = lectures.filter(Q(summary__icontains=query))
+        # 全文檢索（標題 / 摘要 / 逐字稿），依相關度排序
+        lectures = search_lectures(lectures, query)
+    else:
+        lectures = lectures.order_by('-id')
 
-    lectures = lectures.order_by('-id')
-    for lec in lectures:
-        lec.is_ready = bool(lec.summary and lec.question_set.exists())
+    paginator = Paginator(lectures, 5)
+    page_number = request.GET.get('page')
+    page_obj = paginator.get_page(page_number)
 
-    # ✅ 加上學生作答狀態
+    # 只針對目前這一頁計算是否可作答
+    for lec in page_obj:
+        lec.is_ready = bool(lec.summary and lec.has_questions)
+
+    # ✅ 加上學生作答狀態（只查目前這一頁的講次）
     student = None
     answered_lecture_ids = set()
     if request.user.is_authenticated and hasattr(request.user, 'profile') and request.user.profile.role == 'student':
         try:
             student = Student.objects.get(user=request.user)
             answered_lecture_ids = set(
-                Submission.objects.filter(student=student).values_list('question__lecture', flat=True)
+                Submission.objects.filter(
+                    student=student,
+                    question__lecture__in=[lec.id for lec in page_obj],
+                ).values_list('question__lecture', flat=True).distinct()
             )
         except Student.DoesNotExist:
             pass
 
-    paginator = Paginator(lectures, 5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
     return render(request, 'lecture_list.html', {
         'page_obj': page_obj,
         'query': query,
@@ -98,54 +126,68 @@ def delete_lecture(request, lecture_id):
 
 # ---------- 測驗相關 ----------
 
-def quiz(request, lecture_id):
-    lecture = get_object_or_404(Lecture, pk=lecture_id)
-    questions = Question.objects.filter(lecture=lecture)
-    
-    if request.method == 'POST':
-        student = request.user.profile  # 假設有登入並有 profile
-        for question in questions:
-            student_answer = request.POST.get(str(question.id))
-            correct = student_answer == question.correct_answer
-            Submission.objects.create(
-                student=student,
-                question=question,
-                student_answer=student_answer,
-                is_correct=correct
-            )
-        return redirect('lecture_detail', lecture_id)
-    
-    return render(request, 'quiz.html', {'lecture': lecture, 'questions': questions})
-
 # ---------- 學生報告 ----------
 
 @login_required
 def student_report(request):
     student = get_object_or_404(Student, user=request.user)
-    submissions = Submission.objects.filter(student=student)
-    total = submissions.count()
-    correct = submissions.filter(is_correct=True).count()
-    accuracy = (correct / total * 100) if total else 0
-    wrong = submissions.filter(is_correct=False).values('question__question_text').annotate(count=Count('id')).order_by('-count')[:5]
-    wrong_count = total - correct
-
-
     return render(request, 'student_report.html', {
         'student': student,
-        'total': total,
-        'correct': correct,
-        'wrong_count': wrong_count,
-        'accuracy': round(accuracy, 2),
-        'wrong': wrong,
+        **student_totals(student),
+        'wrong': top_wrong_questions(student),
     })
 
+@login_required
 def student_weakness_report(request, student_id):
-    student = get_object_or_404(Student, user=request.user)
-    weaknesses = Submission.objects.filter(student=student, is_correct=False).values('question__concept').annotate(count=Count('id')).order_by('-count')[:5]
+    # 教師可查看任一學生，學生只能看自己的
+    if request.user.profile.role == 'teacher':
+        student = get_object_or_404(Student, id=student_id)
+    else:
+        student = get_object_or_404(Student, user=request.user)
+    weaknesses = weak_concepts(student)
+    report = student_concept_report(student)
 
     return render(request, 'student_weakness_report.html', {
         'student': student,
         'weaknesses': weaknesses,
+        'concepts': report['concepts'],
+        'trend_json': json.dumps(report['trend'], ensure_ascii=False),
+    })
+
+@teacher_required
+def course_concept_report(request, course_id):
+    """教師查看全班在此課程各概念的掌握度"""
+    course = get_object_or_404(Course, id=course_id)
+    report = course_concept_report_data(course)
+    return render(request, 'course_concept_report.html', {
+        'course': course,
+        'concepts': report['concepts'],
+        'trend_json': json.dumps(report['trend'], ensure_ascii=False),
+    })
+
+def metrics(request):
+    """Prometheus 抓取用：各 view 的延遲、SQL 數量與 SQL 時間（需 METRICS_TOKEN 或 staff 帳號）"""
+    if not metrics_authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+PIPELINE_REPORT_DAYS = (1, 7, 30, 90)
+
+@teacher_required
+def pipeline_report(request):
+    """教師查看 AI 處理流程各階段的耗時百分位數、tokens 與成本"""
+    try:
+        days = int(request.GET.get('days', 7))
+    except ValueError:
+        days = 7
+    if days not in PIPELINE_REPORT_DAYS:
+        days = 7
+    stats = pipeline_stats(days)
+    return render(request, 'pipeline_report.html', {
+        'days': days,
+        'day_options': PIPELINE_REPORT_DAYS,
+        'stages': stats['stages'],
+        'daily': stats['daily'],
     })
 
 # ---------- 課程相關 ----------
@@ -188,19 +230,13 @@ def course_detail(request, course_id=None):
             messages.warning(request, "⚠ 請選擇要上傳的音檔。")
             return redirect('course_detail', course_id=course.id)
 
-        # 建立講次並觸發 AI 處理
+        # 建立講次並排入背景 AI 處理
         lecture = Lecture.objects.create(
             course=course,
             audio_file=audio_file,
             title=lecture_title
         )
-        print("🧠 呼叫 AI 處理開始")
-
-        process_audio_and_generate_quiz(
-            lecture.id,
-            num_mcq=num_mcq,
-            num_tf=num_tf
-        )
+        enqueue_lecture_job(lecture, num_mcq=num_mcq, num_tf=num_tf)
 
         #messages.success(request, f"✅ 成功建立講次《{lecture_title}》並開始產生題目。")
         return redirect('lecture_detail', lecture.id)
@@ -322,23 +358,29 @@ def quiz(request, lecture_id):
     except Student.DoesNotExist:
         return HttpResponse("❌ 找不到對應的學生資料，請聯絡管理員。")
 
-    # ✅ 防止學生重複作答
-    if Submission.objects.filter(student=student, question__lecture=lecture).exists():
-        return HttpResponse("⚠️ 你已經完成這份測驗，請勿重複作答。")
-
-    # ✅ 如果是提交作答
+    # ✅ 如果是提交作答：一次批次寫入，(student, question) 唯一限制防止重複作答
     if request.method == 'POST':
+        submissions = []
         for question in questions:
-            student_answer = request.POST.get(str(question.id))
-            correct = student_answer == question.correct_answer
-            Submission.objects.create(
+            student_answer = request.POST.get(str(question.id)) or ''
+            submissions.append(Submission(
                 student=student,
                 question=question,
                 student_answer=student_answer,
-                is_correct=correct
-            )
+                is_correct=student_answer == question.correct_answer
+            ))
+        try:
+            with transaction.atomic():
+                Submission.objects.bulk_create(submissions)
+                record_quiz_attempt(student, lecture, submissions)
+        except IntegrityError:
+            return HttpResponse("⚠️ 你已經完成這份測驗，請勿重複作答。")
         return redirect('lecture_detail', lecture_id)
 
+    # ✅ 防止學生重複作答
+    if Submission.objects.filter(student=student, question__lecture=lecture).exists():
+        return HttpResponse("⚠️ 你已經完成這份測驗，請勿重複作答。")
+
     # ✅ 顯示測驗表單
     return render(request, 'quiz.html', {
         'lecture': lecture,
@@ -369,96 +411,125 @@ def edit_summary(request, lecture_id):
 def view_student_report_by_teacher(request, student_id):
     """教師查看指定學生的綜合報告"""
     student = get_object_or_404(Student, id=student_id)
-    submissions = Submission.objects.filter(student=student)
-
-    total = submissions.count()
-    correct = submissions.filter(is_correct=True).count()
-    accuracy = round(correct / total * 100, 2) if total > 0 else 0
-
-    # 錯題分析（前5題）
-    wrong = (
-        submissions.filter(is_correct=False)
-        .values("question__question_text")
-        .annotate(count=Count("id"))
-        .order_by("-count")[:5]
-    )
-
-    # 各講次統計
-    lecture_stats = defaultdict(lambda: {"total": 0, "correct": 0})
-    for s in submissions:
-        if s.question and s.question.lecture:
-            lec = s.question.lecture.title
-            lecture_stats[lec]["total"] += 1
-            if s.is_correct:
-                lecture_stats[lec]["correct"] += 1
-
-    labels = list(lecture_stats.keys())
-    data = [round(v["correct"] / v["total"] * 100, 2) for v in lecture_stats.values()]
-
-    # 學習建議
-    if accuracy >= 90:
-        suggestion = "表現非常優異，繼續保持！"
-    elif accuracy >= 70:
-        suggestion = "表現良好，建議複習部分錯題章節以鞏固知識。"
-    elif accuracy > 0:
-        if lecture_stats:
-            weakest = min(
-                lecture_stats.items(),
-                key=lambda kv: kv[1]["correct"] / kv[1]["total"],
-            )[0]
-            suggestion = f"建議加強學習「{weakest}」單元，錯題比例較高。"
-        else:
-            suggestion = "請多練習錯誤率高的章節，加強理解。"
-    else:
-        suggestion = "目前尚無作答紀錄，請先完成練習題。"
-
-    context = {
-        "student": student,
-        "total": total,
-        "correct": correct,
-        "wrong_count": total - correct,
-        "accuracy": accuracy,
-        "wrong": wrong,
-        "labels_json": json.dumps(labels, ensure_ascii=False),
-        "data_json": json.dumps(data),
-        "has_data": bool(labels and data),
-        "suggestion": suggestion,
-    }
-
-    return render(request, "progress_report.html", context)
+    return render(request, "progress_report.html", progress_report_context(student))
+
+def filtered_submissions(request):
+    """依 GET 參數 course / lecture / student 篩選作答紀錄"""
+    submissions = Submission.objects.all()
+    filters = {}
+    for param, lookup in (('course', 'question__lecture__course_id'),
+                          ('lecture', 'question__lecture_id'),
+                          ('student', 'student_id')):
+        value = request.GET.get(param, '')
+        if value.isdigit():
+            submissions = submissions.filter(**{lookup: int(value)})
+            filters[param] = value
+    return submissions, filters
 
 @login_required
 def all_submissions(request):
     if not request.user.profile.role == 'teacher':
         return HttpResponseForbidden("你沒有權限查看此頁面")
 
-    submissions = Submission.objects.select_related('student', 'question', 'question__lecture')
+    submissions, filters = filtered_submissions(request)
+    submissions = submissions.select_related('student__user', 'question', 'question__lecture')
+    rows, next_cursor, prev_cursor = keyset_page(
+        submissions,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
     return render(request, 'all_submissions.html', {
-        'submissions': submissions,
+        'submissions': rows,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'filters': filters,
+        'filter_query': urlencode(filters),
+        'courses': Course.objects.order_by('name'),
     })
 
+class Echo:
+    """給 csv.writer 用的假檔案，write() 直接回傳字串供串流輸出"""
+    def write(self, value):
+        return value
+
+CSV_BATCH_SIZE = 2000
+
+
+def next_batch(iterator, size=CSV_BATCH_SIZE):
+    return list(islice(iterator, size))
+
+@login_required
+def export_submissions_csv(request):
+    if not request.user.profile.role == 'teacher':
+        return HttpResponseForbidden("你沒有權限查看此頁面")
+
+    submissions, _ = filtered_submissions(request)
+    rows = submissions.order_by('-submitted_at', '-id').values_list(
+        'id', 'submitted_at', 'student__user__username', 'student__name',
+        'question__lecture__course__name', 'question__lecture__title',
+        'question__question_text', 'student_answer', 'is_correct',
+    )
+
+    writer = csv.writer(Echo())
+    # '\ufeff' 讓 Excel 正確判斷 UTF-8
+    header = '\ufeff' + writer.writerow(['id', '作答時間', '學生帳號', '學生姓名', '課程', '單元標題', '題目內容', '學生作答', '是否正確'])
+
+    if isinstance(request, ASGIRequest):
+        # ASGI 下同步 iterator 會被整個讀成 list 才送出，改成每次在執行緒取一批、邊查邊送
+        # （values_list 的 aiterator() 會在事件迴圈內直接查詢，不能用）
+        async def stream():
+            yield header
+            iterator = rows.iterator(chunk_size=CSV_BATCH_SIZE)
+            while batch := await sync_to_async(next_batch)(iterator):
+                yield ''.join(writer.writerow(row) for row in batch)
+    else:
+        def stream():
+            yield header
+            for row in rows.iterator(chunk_size=CSV_BATCH_SIZE):
+                yield writer.writerow(row)
+
+    response = StreamingHttpResponse(stream(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="submissions.csv"'
+    return response
+
+LECTURE_SUBMISSION_SORTS = {
+    'name': 'student__user__username',
+    '-name': '-student__user__username',
+    'accuracy': 'accuracy',
+    '-accuracy': '-accuracy',
+    'total': 'total',
+    '-total': '-total',
+}
+
 @login_required
 def lecture_submissions(request, lecture_id):
-    lecture = get_object_or_404(Lecture, id=lecture_id)
-    submissions = Submission.objects.filter(question__lecture=lecture)
-
-    # 對每個學生統計該講次的作答情況
-    students_data = []
-    for student in Student.objects.all():
-        student_subs = submissions.filter(student=student)
-        total = student_subs.count()
-        correct = student_subs.filter(is_correct=True).count()
-        if total > 0:
-            students_data.append({
-                'student': student,
-                'total': total,
-                'correct': correct,
-                'accuracy': round(correct / total * 100, 2)
-            })
+    lecture = get_object_or_404(Lecture.objects.select_related('course'), id=lecture_id)
+
+    # 一次 GROUP BY 統計每位有作答學生的題數與正確數
+    students = lecture_submission_stats(lecture)
+
+    sort = request.GET.get('sort', 'name')
+    if sort not in LECTURE_SUBMISSION_SORTS:
+        sort = 'name'
+    students = students.order_by(LECTURE_SUBMISSION_SORTS[sort], 'student_id')
+
+    paginator = Paginator(students, 50)
+    page_obj = paginator.get_page(request.GET.get('page'))
+
+    # 只取目前這一頁的學生資料
+    student_map = Student.objects.select_related('user').in_bulk([row['student_id'] for row in page_obj])
+    students_data = [{
+        'student': student_map[row['student_id']],
+        'total': row['total'],
+        'correct': row['correct'],
+        'accuracy': round(row['accuracy'], 2),
+    } for row in page_obj]
 
     return render(request, 'lecture_submissions.html', {
         'lecture': lecture,
-        'students_data': students_data
+        'students_data': students_data,
+        'page_obj': page_obj,
+        'sort': sort,
     })
 
 
@@ -467,36 +538,9 @@ def lecture_submissions(request, lecture_id):
 @login_required
 def student_submissions(request, student_id):
     student = get_object_or_404(Student, pk=student_id)
-    submissions = Submission.objects.filter(student=student).select_related('question__lecture__course')
-
-    summary = {}
-    for s in submissions:
-        lec = s.question.lecture
-        if lec.id not in summary:
-            summary[lec.id] = {
-                'lecture': lec,
-                'total': 0,
-                'correct': 0
-            }
-        summary[lec.id]['total'] += 1
-        if s.is_correct:
-            summary[lec.id]['correct'] += 1
-
-    result = []
-    for item in summary.values():
-        total = item['total']
-        correct = item['correct']
-        accuracy = round((correct / total) * 100, 2) if total > 0 else 0
-        result.append({
-            'lecture': item['lecture'],
-            'total': total,
-            'correct': correct,
-            'accuracy': accuracy
-        })
-
     return render(request, 'student_submissions.html', {
         'student': student,
-        'submissions': result
+        'submissions': lecture_accuracy_rows(student)
     })
 
 @login_required
@@ -507,26 +551,23 @@ def student_directory(request):
 # ---------- 題目解析頁 ----------
 
 
+def submission_result_etag(request, lecture_id):
+    student_id = student_id_for_user(request.user)
+    return submission_etag(student_id, lecture_id) if student_id else None
+
+
 @login_required
+@condition(etag_func=submission_result_etag)
 def submission_result(request, lecture_id):
     student = get_object_or_404(Student, user=request.user)
-    lecture = get_object_or_404(Lecture, id=lecture_id)
-    questions = Question.objects.filter(lecture=lecture)
-    submissions = Submission.objects.filter(student=student, question__lecture=lecture)
-
-    result = []
-    for q in questions:
-        sub = submissions.filter(question=q).first()
-        result.append({
-            'question': q,
-            'student_answer': sub.student_answer if sub else None,
-            'is_correct': sub.is_correct if sub else None,
-        })
-
-    return render(request, 'submission_result.html', {
+    lecture = get_object_or_404(Lecture.objects.select_related('course'), id=lecture_id)
+    response = render(request, 'submission_result.html', {
         'lecture': lecture,
-        'results': result
+        'results': submission_results(student.id, lecture),
     })
+    # 每次都向伺服器確認，作答沒變時回 304
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 @login_required
 def edit_lecture_title(request, lecture_id):
@@ -555,80 +596,14 @@ import json
 @login_required
 def progress_report(request):
     """學生端：顯示自己學習進度與圖表報告（含錯題分析）"""
-
-    # 取得目前登入學生
     student = get_object_or_404(Student, user=request.user)
-
-    # 該學生所有作答紀錄
-    submissions = Submission.objects.filter(student=student)
-    total = submissions.count()
-    correct = submissions.filter(is_correct=True).count()
-    wrong_count = total - correct
-    accuracy = round(correct / total * 100, 2) if total > 0 else 0
-
-    # 各講次統計正確率
-    lecture_stats = defaultdict(lambda: {"total": 0, "correct": 0})
-    for s in submissions:
-        if s.question and s.question.lecture:
-            lec = s.question.lecture.title
-            lecture_stats[lec]["total"] += 1
-            if s.is_correct:
-                lecture_stats[lec]["correct"] += 1
-
-    labels = list(lecture_stats.keys())
-    data = [
-        round(v["correct"] / v["total"] * 100, 2)
-        for v in lecture_stats.values()
-    ]
-
-    # 🔴 錯題分析（前 5 題）
-    wrong = (
-        submissions.filter(is_correct=False)
-        .values("question__question_text")
-        .annotate(count=Count("id"))
-        .order_by("-count")[:5]
-    )
-
-    # 💬 學習建議
-    if accuracy >= 90:
-        suggestion = "表現非常優異，繼續保持！"
-    elif accuracy >= 70:
-        suggestion = "表現良好，建議複習部分錯題章節以鞏固知識。"
-    elif accuracy > 0:
-        if lecture_stats:
-            weakest = min(
-                lecture_stats.items(),
-                key=lambda kv: kv[1]["correct"] / kv[1]["total"],
-            )[0]
-            suggestion = f"建議加強學習「{weakest}」單元，錯題比例較高。"
-        else:
-            suggestion = "請多練習錯誤率高的章節，加強理解。"
-    else:
-        suggestion = "目前尚無作答紀錄，請先完成練習題。"
-
-    # ✅ 傳給模板
-    context = {
-        "student": student,
-        "total": total,
-        "correct": correct,
-        "wrong_count": wrong_count,
-        "accuracy": accuracy,
-        "wrong": wrong,  # 加入這行讓模板可顯示錯題分析
-        "labels_json": json.dumps(labels, ensure_ascii=False),
-        "data_json": json.dumps(data),
-        "has_data": bool(labels and data),
-        "suggestion": suggestion,
-    }
-
-    return render(request, "progress_report.html", context)
+    return render(request, "progress_report.html", progress_report_context(student))
     
 
-import tempfile
 from django.http import JsonResponse
-from django.core.files import File
-from pydub import AudioSegment
+from django.urls import reverse
 from .models import Course, Lecture
-from .ai_modules import process_audio_and_generate_quiz
+from .audio_ingest import ingest_audio
 
 @require_POST
 def record_and_process(request, course_id):
@@ -646,84 +621,100 @@ def record_and_process(request, course_id):
     if not audio_file or not lecture_title:
         return JsonResponse({'error': '缺少音檔或標題'}, status=400)
 
-    # 儲存 .webm 到暫存檔
-    with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_webm:
-        for chunk in audio_file.chunks():
-            temp_webm.write(chunk)
-        webm_path = temp_webm.name
+    # 經由 ffmpeg 管線轉成 16 kHz 單聲道 Opus 後直接存檔，不再產生 WAV 與暫存檔
+    with ingest_audio(audio_file, lecture_title) as audio:
+        lecture = Lecture.objects.create(course=course, title=lecture_title)
+        lecture.audio_file.save(audio.name, audio)
 
-    # 轉換為 .wav
-    wav_path = webm_path.replace('.webm', '.wav')
-    AudioSegment.from_file(webm_path, format='webm').export(wav_path, format='wav')
+    # 排入背景 AI 分析
+    job = enqueue_lecture_job(lecture, num_mcq=num_mcq, num_tf=num_tf)
 
-    # 建立 Lecture 並儲存音檔
-    with open(wav_path, 'rb') as wav_file:
-        lecture = Lecture.objects.create(course=course, title=lecture_title)
-        lecture.audio_file.save(f"{lecture_title}.wav", File(wav_file))
+    return JsonResponse({
+        'success': True,
+        'lecture_id': lecture.id,
+        'job_id': job.id,
+        'status_url': reverse('lecture_job_status', args=[lecture.id]),
+    })
 
-    # 執行 AI 分析
-    process_audio_and_generate_quiz(
-        lecture.id,
-        num_mcq=num_mcq,
-        num_tf=num_tf  # ✅ 加入是非題
-    )
+def submission_detail_etag(request, lecture_id, student_id):
+    return submission_etag(student_id, lecture_id)
 
-    return JsonResponse({'success': True})
 
+@teacher_required
+@condition(etag_func=submission_detail_etag)
 def submission_detail(request, lecture_id, student_id):
-    lecture = get_object_or_404(Lecture, id=lecture_id)
+    lecture = get_object_or_404(Lecture.objects.select_related('course'), id=lecture_id)
     student = get_object_or_404(Student, id=student_id)
-    submissions = Submission.objects.filter(student=student, question__lecture=lecture).select_related('question')
-
-    return render(request, 'submission_result.html', {
+    response = render(request, 'submission_result.html', {
         'lecture': lecture,
         'student': student,
-        'results': submissions,
+        'results': submission_results(student.id, lecture),
     })
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 
-from .ai_modules import process_transcript_and_generate_quiz, process_audio_and_generate_quiz,transcribe_with_whisper
-import uuid
 @csrf_exempt
-def live_chunk_upload(request):
-    if request.method == 'POST':
-        audio_chunk = request.FILES.get('audio_chunk')
-        lecture_title = request.POST.get('lecture_title')
-        course_id = request.POST.get('course_id')
-
-        if not (audio_chunk and lecture_title and course_id):
-            return JsonResponse({'error': '缺少必要欄位'}, status=400)
-
-        lecture, _ = Lecture.objects.get_or_create(title=lecture_title, course_id=course_id)
-
-        # ✅ 注意：Windows 下不要 delete=True，Whisper會讀不到檔案
-        with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as tmp:
-            for chunk in audio_chunk.chunks():
-                tmp.write(chunk)
-            tmp_path = tmp.name  # 不要用 tmp.name 以外的東西
-
-        print("✅ Whisper 轉錄開始")
-        try:
-            text = transcribe_with_whisper(tmp_path)
-            print("✅ Whisper 轉錄成功")
-        except Exception as e:
-            print("❌ Whisper 轉錄錯誤:", e)
-            text = ""
+async def live_chunk_upload(request):
+    """接收直播音訊段落：依 (session_id, seq) 存成一列並排入轉錄佇列，立即回傳；逐字稿由 SSE 推回
+
+    同一段重送（網路重試）不會重複轉錄，也不會讓逐字稿重複或錯序。
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+    audio_chunk = request.FILES.get('audio_chunk')
+    lecture_id = request.POST.get('lecture_id')
+    lecture_title = request.POST.get('lecture_title')
+    course_id = request.POST.get('course_id')
+    session_id = request.POST.get('session_id', '')[:64]
+    try:
+        seq = int(request.POST.get('seq', ''))
+    except ValueError:
+        seq = -1
 
-        if text:
-            lecture.transcript = (lecture.transcript or '') + '\n' + text
-            lecture.save()
+    if not audio_chunk or not session_id or seq < 0 or not (lecture_id or (lecture_title and course_id)):
+        return JsonResponse({'error': '缺少必要欄位'}, status=400)
 
-        return JsonResponse({'transcript': text, 'lecture_id': lecture.id})
-    return JsonResponse({'error': 'Invalid request method'}, status=405)
+    # 第一段之後前端會帶 lecture_id，不用每段都以標題 get_or_create
+    if lecture_id:
+        lecture = await Lecture.objects.filter(id=lecture_id).afirst()
+        if lecture is None:
+            return JsonResponse({'error': '找不到講次'}, status=404)
+    else:
+        lecture, _ = await Lecture.objects.aget_or_create(title=lecture_title, course_id=course_id)
+
+    # 音檔存進 storage、段落列排入資料庫佇列，由 run_lecture_worker 轉錄
+    chunk, queued = await sync_to_async(store_chunk)(lecture, session_id, seq, audio_chunk)
+    return JsonResponse({
+        'lecture_id': lecture.id,
+        'seq': chunk.seq,
+        'status': chunk.status,
+        'duplicate': not queued,
+        'events_url': reverse('live_transcript_events', args=[lecture.id]) + '?' + urlencode({'session_id': session_id}),
+    }, status=202)
+
+
+async def live_transcript_events(request, lecture_id):
+    """Server-Sent Events：推送直播逐字稿段落（需以 ASGI 執行）"""
+    if not isinstance(request, ASGIRequest):
+        # WSGI 會把串流整個讀進記憶體，永遠等不到結尾而卡住 worker；回 501 讓 EventSource 直接放棄
+        return HttpResponse("SSE 需以 ASGI 伺服器執行", status=501)
+    events = transcript_events(lecture_id, request.GET.get('session_id') or None)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @csrf_exempt
 def finalize_transcript_summary_quiz(request, lecture_id):
     lecture = Lecture.objects.get(id=lecture_id)
 
-    if not lecture.transcript:
-        return JsonResponse({"error": "Transcript not found"}, status=404)
+    # 還有段落在轉錄時先不整合，前端稍後重試
+    pending = pending_chunks(lecture).count()
+    if pending:
+        return JsonResponse({"status": "transcribing", "pending": pending}, status=409)
 
     # ✅ 接收前端傳來的題目數量
     try:
@@ -732,10 +723,29 @@ def finalize_transcript_summary_quiz(request, lecture_id):
         num_tf = int(data.get("num_tf", 0))
     except Exception as e:
         print("❌ 題目數量解析錯誤", e)
-        num_mcq, num_tf = 3, 0  # 預設值
+        data, num_mcq, num_tf = {}, 3, 0  # 預設值
+
+    # 重試多次仍轉錄失敗的段落不默默略過：回報序號，使用者確認後才帶 skip_failed 繼續
+    failed = list(failed_chunks(lecture).order_by('seq').values_list('seq', flat=True))
+    if failed and not data.get("skip_failed"):
+        return JsonResponse({"status": "failed_chunks", "failed": failed}, status=422)
+    if failed:
+        print(f"⚠️ 講次 {lecture.id} 略過轉錄失敗的段落：{failed}")
+
+    # 依序組出完整逐字稿，只寫入這一次
+    finalize_live_transcript(lecture)
+    if not lecture.transcript:
+        return JsonResponse({"error": "Transcript not found"}, status=404)
+
+    # 重複按下「結束」只會沿用進行中的工作
+    job, _ = enqueue_lecture_job_once(lecture, kind='transcript', num_mcq=num_mcq, num_tf=num_tf)
+    return JsonResponse({"status": "queued", "job_id": job.id})
 
-    process_transcript_and_generate_quiz(lecture, num_mcq=num_mcq, num_tf=num_tf)
-    return JsonResponse({"status": "ok"})
+
+def lecture_job_status(request, lecture_id):
+    """講次 AI 處理進度（供講次頁面輪詢）"""
+    lecture = get_object_or_404(Lecture, id=lecture_id)
+    return JsonResponse(job_status_payload(lecture))
 
 
 @login_required
@@ -745,40 +755,8 @@ def dashboard(request):
 @login_required
 def my_submissions(request):
     """學生查看自己的所有講次作答紀錄"""
-    # 取得目前登入學生
     student = get_object_or_404(Student, user=request.user)
-
-    # 該學生所有作答紀錄
-    submissions = Submission.objects.filter(student=student).select_related('question__lecture__course')
-
-    # 統計各單元作答情況
-    summary = {}
-    for s in submissions:
-        lec = s.question.lecture
-        if lec.id not in summary:
-            summary[lec.id] = {
-                'lecture': lec,
-                'total': 0,
-                'correct': 0
-            }
-        summary[lec.id]['total'] += 1
-        if s.is_correct:
-            summary[lec.id]['correct'] += 1
-
-    # 整理結果供模板使用
-    result = []
-    for item in summary.values():
-        total = item['total']
-        correct = item['correct']
-        accuracy = round((correct / total) * 100, 2) if total > 0 else 0
-        result.append({
-            'lecture': item['lecture'],
-            'total': total,
-            'correct': correct,
-            'accuracy': accuracy
-        })
-
     return render(request, 'student_submissions.html', {
         'student': student,
-        'submissions': result
-    })
\ No newline at end of file
+        'submissions': lecture_accuracy_rows(student)
+    })
@@ -26,11 +26,15 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(template_name='logout.html'), name='logout'),
     path('dashboard/', views.dashboard, name='dashboard'),  # 登入後的主頁
     path('register/', views.register, name='register'),
+    path('course/<int:course_id>/concepts/', views.course_concept_report, name='course_concept_report'),
+    path('pipeline/report/', views.pipeline_report, name='pipeline_report'),
+    path('metrics', views.metrics, name='metrics'),
     path('course/<int:course_id>/edit/', views.edit_course, name='edit_course'),
     path('course/<int:course_id>/delete/', views.delete_course, name='delete_course'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('lecture/<int:lecture_id>/edit_summary/', views.edit_summary, name='edit_summary'),
     path('submissions/', views.all_submissions, name='all_submissions'),
+    path('submissions/export/', views.export_submissions_csv, name='export_submissions_csv'),
     path('lecture/<int:lecture_id>/submissions/', views.lecture_submissions, name='lecture_submissions'),
     path('student/<int:student_id>/submissions/', views.student_submissions, name='student_submissions'),
     path('student/directory/', views.student_directory, name='student_directory'),
@@ -42,7 +46,9 @@ urlpatterns = [
     #path('progress/<int:student_id>/', views.student_progress_report_admin, name='student_progress_report_admin'),
     path('student/<int:student_id>/report/', views.view_student_report_by_teacher, name='teacher_student_report'),
     path("api/live_chunk_upload/", views.live_chunk_upload, name="live_chunk_upload"),
+    path("api/lecture/<int:lecture_id>/live/events/", views.live_transcript_events, name="live_transcript_events"),
     path("api/finalize_transcript_summary_quiz/<int:lecture_id>/", views.finalize_transcript_summary_quiz, name="finalize_transcript_summary_quiz"),
+    path("api/lecture/<int:lecture_id>/status/", views.lecture_job_status, name="lecture_job_status"),
     path('my/submissions/', views.my_submissions, name='my_submissions'),
     #path('progress-report/debug/', views.progress_report_debug, name='progress_report_debug'),
 ]